@@ -19,13 +19,17 @@ except (ModuleNotFoundError, AssertionError):
     if torch.distributed.is_initialized():
         USE_DDP = True
 
+import queue
+import threading
 import numpy as np
 from typing import List
 
 from mqbench.utils.logger import logger
 from mqbench.utils.hook import DataSaverHook, StopForwardException
+from mqbench.utils.disk_cache import MemoryBudget
+from mqbench.utils.compression import CACHE_DTYPES, CompressedTensor, compress, decompress
 from mqbench.utils import deepcopy_graphmodule, deepcopy_mixedmodule, topology_order, getitem2node
-from mqbench.utils.utils import _fix_succ_recursivly
+from mqbench.utils.utils import _fix_succ_recursivly, drop_mask
 from mqbench.utils.state import enable_quantization, disable_all
 import mqbench.nn.intrinsic.qat as qnniqat
 
@@ -93,13 +97,15 @@ def tensor_detach(data):
 
 
 def save_inp_oup_data(model: GraphModule, inp_module: Module, oup_module: Module, cali_data: list, store_inp=True, store_oup=True,
-                      keep_gpu: bool = True):
+                      keep_gpu: bool = True, budget: MemoryBudget = None, cache_dtype: str = None):
     """
     Save input data and output data of a particular layer/block over calibration dataset.
     :param fp_model: fp_model
     :param quant_model: quant_model
     :param cali_data: calibration data set
     :param keep_gpu: put saved data on GPU for faster optimization
+    :param budget: with keep_gpu False, output data which does not fit in this MemoryBudget is written to disk
+    :param cache_dtype: store the output data compressed to one of CACHE_DTYPES, see CompressedTensor
     :return: input and output data
     """
     device = next(model.parameters()).device
@@ -124,10 +130,14 @@ def save_inp_oup_data(model: GraphModule, inp_module: Module, oup_module: Module
                 else:
                     cached[0].append([to_device(tensor_detach(inp), 'cpu') for inp in inp_saver.input_store])  # tuple/list one
             if store_oup:
+                oup = compress(tensor_detach(oup_saver.output_store), cache_dtype)
                 if keep_gpu:
-                    cached[1].append(tensor_detach(oup_saver.output_store))
+                    cached[1].append(oup)
                 else:
-                    cached[1].append(to_device(tensor_detach(oup_saver.output_store), 'cpu'))
+                    oup = oup.to('cpu') if isinstance(oup, CompressedTensor) else to_device(oup, 'cpu')
+                    if budget is not None and len(cached[1]) == 0:
+                        cached = (cached[0], budget.new_list())
+                    cached[1].append(oup)
     if store_inp:
         inp_handle.remove()
     if store_oup:
@@ -136,6 +146,248 @@ def save_inp_oup_data(model: GraphModule, inp_module: Module, oup_module: Module
     return cached
 
 
+
+class SequentialActivationCache:
+    r"""Outputs of the nodes of ``model`` (a GraphModule) over ``cali_data``, computed node by node.
+
+    Computed values are kept between requests and only the missing ancestors of the requested nodes
+    are run, in graph order, so going through the blocks of the model in order runs every node about
+    once, instead of running the whole prefix of the model for each block. A value is freed once all
+    of its users have been run. evict drops the values computed from modules which have changed.
+    The args of the nodes are read once here, later rewrites of the graph do not change the result.
+    With ``keep_gpu`` False and a ``budget`` (MemoryBudget), the batches which do not fit in it are
+    written to disk and read back when used. With a ``cache_dtype``, the
+    values of the requested nodes are kept compressed, and the nodes run after them read them back
+    decompressed.
+    """
+    def __init__(self, model: GraphModule, cali_data: list, keep_gpu: bool = True, budget: MemoryBudget = None,
+                 cache_dtype: str = None):
+        self.model = model
+        self.modules = dict(model.named_modules())
+        self.device = next(model.parameters()).device
+        self.keep_gpu = keep_gpu
+        self.budget = budget
+        self.cache_dtype = cache_dtype
+        self.cali_data = cali_data
+        self.nodes = [node for node in model.graph.nodes if node.op != 'output']
+        self.order = {node: idx for idx, node in enumerate(self.nodes)}
+        self.by_name = {node.name: node for node in self.nodes}
+        self.first_placeholder = next(node for node in self.nodes if node.op == 'placeholder')
+        self.args = {node: (node.args, node.kwargs) for node in self.nodes}
+        self.inputs, self.users = {}, {node: set() for node in self.nodes}
+        updates = dict()
+        for node in self.nodes:
+            inputs = []
+            fx.node.map_arg(self.args[node], inputs.append)
+            # dict.update has no users, the nodes reading the dict after it depend on it.
+            for arg in list(inputs):
+                inputs += updates.get(arg, [])
+            if node.target == 'update':
+                updates.setdefault(node.args[0], []).append(node)
+            self.inputs[node] = list(dict.fromkeys(inputs))
+            for arg in self.inputs[node]:
+                self.users[arg].add(node)
+        self.pending = {}
+        # node -> its values over the batches, a list or a BudgetedTensorList
+        self.values = {}
+
+    def get(self, nodes: List[Node]):
+        r"""Values of ``nodes``, a sequence over the calibration batches for each of them."""
+        missing, stack = set(), [node for node in nodes if node not in self.pending]
+        while stack:
+            node = stack.pop()
+            if node not in missing:
+                missing.add(node)
+                stack.extend([arg for arg in self.inputs[node] if arg not in self.pending])
+        with torch.no_grad():
+            for node in sorted(missing, key=self.order.get):
+                values = self._new_values(node)
+                for idx, batch in enumerate(self.cali_data):
+                    value = self._run(node, idx, batch)
+                    if node in nodes and node.op != 'placeholder':
+                        value = compress(value, self.cache_dtype)
+                    values.append(self._store(value))
+                self.values[node] = values
+                self.pending[node] = set([user for user in self.users[node] if user not in self.pending])
+                for arg in self.inputs[node]:
+                    self.pending[arg].discard(node)
+                    if not self.pending[arg] and arg not in nodes:
+                        self._free(arg)
+        values = [self.values[node] for node in nodes]
+        for node in nodes:
+            if node in self.pending and not self.pending[node]:
+                self._free(node)
+        return values
+
+    def evict(self, nodes: List[Node]):
+        r"""Drop the values of ``nodes`` and of the nodes computed from them, they are run again when needed."""
+        stack = [node for node in nodes if node in self.pending]
+        while stack:
+            node = stack.pop()
+            if node not in self.pending:
+                continue
+            self._free(node)
+            for arg in self.inputs[node]:
+                if arg in self.pending:
+                    self.pending[arg].add(node)
+            stack.extend([user for user in self.users[node] if user in self.pending])
+
+    def _new_values(self, node):
+        # the batches are kept by cali_data anyway
+        if self.budget is None or node.op == 'placeholder':
+            return []
+        return self.budget.new_list()
+
+    def _free(self, node):
+        # the budget is released once the callers drop the values too
+        del self.pending[node]
+        del self.values[node]
+
+    def _run(self, node, idx, batch):
+        if node.op == 'placeholder':
+            if node is self.first_placeholder:
+                return batch
+            return self.args[node][0][0] if len(self.args[node][0]) > 0 else None
+        if node.op == 'get_attr':
+            attr = self.model
+            for atom in node.target.split('.'):
+                attr = getattr(attr, atom)
+            return attr
+        args, kwargs = fx.node.map_arg(self.args[node], lambda arg: self._load(self.values[arg][idx]))
+        if node.op == 'call_module':
+            return self.modules[node.target](*args, **kwargs)
+        if node.op == 'call_function':
+            return node.target(*args, **kwargs)
+        self_obj, *args = args
+        return getattr(self_obj, node.target)(*args, **kwargs)
+
+    def _load(self, value):
+        if isinstance(value, CompressedTensor):
+            return value.to(self.device).decompress()
+        return fx.node.map_aggregate(value, lambda x: x.to(self.device) if isinstance(x, torch.Tensor) else x)
+
+    def _store(self, value):
+        if self.keep_gpu:
+            return value
+        if isinstance(value, CompressedTensor):
+            return value.to('cpu')
+        return fx.node.map_aggregate(value, lambda x: x.detach().cpu() if isinstance(x, torch.Tensor) else x)
+
+class ReconstructionBatches:
+    r"""``max_count`` random steps over the cached data of subgraph_reconstruction.
+
+    Each step is a list of tensors: the quantized inputs, the fp32 inputs if ``prob`` < 1, then the
+    output, each the concatenation of ``batches_per_step`` cached batches. When the cached data is on
+    the CPU and ``device`` is a GPU, a thread samples and gathers the next steps into pinned memory
+    and each one is copied with non_blocking copies on a side stream while the previous step runs.
+    Otherwise the steps are gathered in the loop, without copy when a single batch is already on ``device``.
+    The indices are drawn from np.random in the same order as before, always in the calling thread.
+    CompressedTensor are copied compressed and decompressed on ``device``.
+    """
+    def __init__(self, cached_inps, cached_oups, prob, device, max_count, batches_per_step=1, depth=2):
+        cached_inps = list(cached_inps[0]) + list(cached_inps[1]) if prob < 1.0 else list(cached_inps)
+        self.sources = cached_inps + [cached_oups]
+        self.size = len(cached_oups)
+        self.device = torch.device(device)
+        self.max_count = max_count
+        self.batches_per_step = min(batches_per_step, self.size)
+        self.depth = depth
+
+    def __iter__(self):
+        first = [source[0] for source in self.sources]
+        if self.device.type == 'cuda' and all([isinstance(x, (torch.Tensor, CompressedTensor)) and x.device.type == 'cpu'
+                                               for x in first]):
+            return self._prefetch()
+        return self._direct()
+
+    def _sample(self):
+        if self.batches_per_step == 1:
+            return [np.random.randint(0, self.size)]
+        return np.random.choice(self.size, self.batches_per_step, replace=False).tolist()
+
+    def _gather(self, indices, pin=False):
+        step = []
+        for source in self.sources:
+            batches = [source[idx] for idx in indices]
+            if len(batches) == 1 and not pin:
+                step.append(batches[0])
+            elif isinstance(batches[0], CompressedTensor):
+                step.append(CompressedTensor(self._cat([batch.data for batch in batches], pin),
+                                             None if batches[0].scale is None else
+                                             self._cat([batch.scale for batch in batches], pin), batches[0].dtype))
+            else:
+                step.append(self._cat(batches, pin))
+        return step
+
+    @staticmethod
+    def _cat(tensors, pin):
+        shape = (sum([x.shape[0] for x in tensors]), ) + tuple(tensors[0].shape[1:])
+        out = torch.empty(shape, dtype=tensors[0].dtype, device=tensors[0].device, pin_memory=pin)
+        return torch.cat(tensors, out=out)
+
+    def _direct(self):
+        for _ in range(self.max_count):
+            yield [decompress(x.to(self.device) if isinstance(x, CompressedTensor) else to_device(x, self.device))
+                   for x in self._gather(self._sample())]
+
+    def _prefetch(self):
+        # The indices are drawn here rather than in the thread, so that np.random is advanced at the
+        # same points of the calling thread in every run: ``depth`` + 1 steps ahead of the step in use.
+        indices = queue.Queue()
+        steps = queue.Queue(maxsize=self.depth)
+        drawn = [0]
+
+        def draw():
+            if drawn[0] < self.max_count:
+                indices.put(self._sample())
+                drawn[0] += 1
+
+        def gather():
+            try:
+                while True:
+                    step_indices = indices.get()
+                    if step_indices is None:
+                        break
+                    steps.put(self._gather(step_indices, pin=True))
+            except Exception as e:
+                steps.put(e)
+
+        for _ in range(self.depth + 1):
+            draw()
+        thread = threading.Thread(target=gather, daemon=True)
+        thread.start()
+        stream = torch.cuda.Stream(self.device)
+
+        def copy():
+            step = steps.get()
+            if isinstance(step, Exception):
+                raise step
+            draw()
+            with torch.cuda.stream(stream):
+                return [x.to(self.device, non_blocking=True) for x in step]
+
+        try:
+            next_step = copy()
+            for i in range(self.max_count):
+                current_stream = torch.cuda.current_stream(self.device)
+                current_stream.wait_stream(stream)
+                step = next_step
+                for x in step:
+                    for tensor in x.tensors() if isinstance(x, CompressedTensor) else [x]:
+                        tensor.record_stream(current_stream)
+                if i + 1 < self.max_count:
+                    next_step = copy()
+                yield [decompress(x) for x in step]
+        finally:
+            # the loop may stop early, unblock the thread
+            indices.put(None)
+            while thread.is_alive():
+                try:
+                    steps.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+
 class LinearTempDecay:
     def __init__(self, t_max=10000, warm_up=0.2, start_b=20, end_b=2):
         self.t_max = t_max
@@ -186,10 +438,18 @@ class LossFunction:
         self.weight = weight
         self.loss_start = max_count * warm_up
         self.p = p
+        self.b_range = b_range
 
         self.temp_decay = LinearTempDecay(max_count, warm_up=warm_up,
                                           start_b=b_range[0], end_b=b_range[1])
         self.count = 0
+        self.rec_loss = None
+
+    def compress_schedule(self, start, length):
+        r"""Start the rounding loss at ``start`` and decay its temperature over ``length`` iterations."""
+        self.loss_start = start
+        self.temp_decay = LinearTempDecay(start + length, warm_up=start / (start + length),
+                                          start_b=self.b_range[0], end_b=self.b_range[1])
 
     def __call__(self, pred, tgt):
         """
@@ -203,6 +463,7 @@ class LossFunction:
         """
         self.count += 1
         rec_loss = lp_loss(pred, tgt, p=self.p)
+        self.rec_loss = rec_loss.detach()
 
         b = self.temp_decay(self.count)
         if self.count < self.loss_start:
@@ -221,6 +482,67 @@ class LossFunction:
         return total_loss
 
 
+class AdaptiveIterationBudget:
+    r"""Early stop of subgraph_reconstruction, called after every iteration with its count.
+
+    Every ``interval`` iterations, the reconstruction loss averaged over the interval and the
+    fraction of rounding values of the AdaRound quantizers saturated to 0 or 1 are reduced over the
+    ranks. The loss is flat once it changed less than ``tol`` (relative) for ``patience`` intervals.
+    A flat loss during the warm up ends it, and the temperature decay of ``loss_func`` is compressed
+    by the same ratio as the warm up. After it, the reconstruction stops at the end of the decay, or
+    once a ``saturation`` fraction of the rounding values are saturated: they get no gradient anymore.
+    """
+    def __init__(self, loss_func: LossFunction, max_count: int, world_size: int = 1, interval: int = 100,
+                 patience: int = 5, tol: float = 1e-2, saturation: float = 0.99):
+        self.loss_func = loss_func
+        self.quantizers = [layer.weight_fake_quant for layer in loss_func.subgraph.modules()
+                           if isinstance(layer, _ADAROUND_SUPPORT_TYPE)]
+        self.max_count = max_count
+        self.end = max_count
+        self.world_size = world_size
+        self.interval = interval
+        self.patience = patience
+        self.tol = tol
+        self.saturation = saturation
+        self.loss_sum = 0.
+        self.last_loss, self.flat = None, 0
+
+    def __call__(self, count):
+        if count >= self.end:
+            return count < self.max_count
+        self.loss_sum = self.loss_sum + self.loss_func.rec_loss
+        if count % self.interval != 0:
+            return False
+        with torch.no_grad():
+            round_vals = [quantizer.rectified_sigmoid() for quantizer in self.quantizers]
+            saturated = sum([((x == 0) | (x == 1)).sum() for x in round_vals], torch.zeros((), device=self.loss_sum.device))
+            stats = torch.stack([self.loss_sum / self.interval, saturated.float(),
+                                 torch.tensor(float(sum([x.numel() for x in round_vals])), device=saturated.device)])
+        if self.world_size > 1:
+            if USE_LINK:
+                link.allreduce(stats)
+            elif USE_DDP:
+                dist.all_reduce(stats)
+        loss, saturated, total = stats.tolist()
+        self.loss_sum = 0.
+        if self.last_loss is not None and abs(loss - self.last_loss) <= self.tol * abs(self.last_loss):
+            self.flat += 1
+        else:
+            self.flat = 0
+        self.last_loss = loss
+        flat = self.flat >= self.patience
+        if count < self.loss_func.loss_start:
+            if flat:
+                warm_up = self.loss_func.loss_start
+                length = max(int((self.max_count - warm_up) * count / warm_up), self.interval)
+                self.loss_func.compress_schedule(count, length)
+                self.end = count + length
+                self.last_loss, self.flat = None, 0
+                logger.info('Warm up converged at {}, decay the temperature until {}.'.format(count, self.end))
+            return False
+        return saturated >= self.saturation * total
+
+
 def _flatten_args(node):
     flattned_args = []
     if isinstance(node, dict):
@@ -319,25 +641,25 @@ def subgraph_reconstruction(subgraph, cached_inps, cached_oups, config):
     logger.info('start tuning by adaround')
     if config.prob < 1.0:
         # cache inps: drop x args x batch x data
-        sz = len(cached_inps[0][0])
         num_args = len(cached_inps[0])
     else:
         # cache inps: args x batch x data
-        sz = len(cached_inps[0])
         num_args = len(cached_inps)
-    for i in range(config.max_count):
-        idx = np.random.randint(0, sz)
+    batches_per_step = config.batches_per_step if hasattr(config, 'batches_per_step') else 1
+    budget = None
+    if hasattr(config, 'adaptive_budget'):
+        budget = AdaptiveIterationBudget(loss_func, config.max_count, world_size, **config.adaptive_budget)
+    steps = iter(ReconstructionBatches(cached_inps, cached_oups, config.prob, device, config.max_count,
+                                       batches_per_step))
+    for i, (*cur_inps, cur_out) in enumerate(steps):
         cur_args = []
         for a in range(num_args):
+            cur_inp = cur_inps[a]
             if config.prob < 1.0:
-                cur_inp = to_device(cached_inps[0][a][idx], device)
-                cur_sym = to_device(cached_inps[1][a][idx], device)
-                cur_inp = torch.where(torch.rand_like(cur_inp) < config.prob, cur_inp, cur_sym)
-            else:
-                cur_inp = to_device(cached_inps[a][idx], device)
+                cur_sym = cur_inps[num_args + a]
+                cur_inp = torch.where(drop_mask(cur_inp, config.prob), cur_inp, cur_sym)
             cur_args.append(cur_inp)
         cur_args = tuple(cur_args)
-        cur_out = to_device(cached_oups[idx], device)
         if a_opt:
             a_opt.zero_grad()
         w_opt.zero_grad()
@@ -358,6 +680,10 @@ def subgraph_reconstruction(subgraph, cached_inps, cached_oups, config):
             w_scheduler.step()
         if a_scheduler:
             a_scheduler.step()
+        if budget is not None and budget(i + 1):
+            logger.info('Stop the reconstruction at {} / {} iterations.'.format(i + 1, config.max_count))
+            break
+    steps.close()
     torch.cuda.empty_cache()
     for name, layer in subgraph.named_modules():        
         if isinstance(layer, _FUSED_TYPE):
@@ -525,8 +851,14 @@ def ptq_reconstruction(model: GraphModule, cali_data: list, config: dict, graph_
             max_count: 20000 (optimization iteration)
             b_range: [20,2] (beta decaying range )
             keep_gpu: True (calibration data restore in gpu or cpu)
+            cache_budget: 16 (optional, with keep_gpu False, GB of host memory for the cached activations, the rest is written to disk)
+            cache_dtype: float32 (optional, cached activations stored as float32, float16, bfloat16 or int8)
+            cache_dir: /tmp (optional, directory of the activations written to disk, the system temporary directory by default)
             round_mode: learned_hard_sigmoid (ways to reconstruct the weight, currently only support learned_hard_sigmoid)
             prob: 0.5 (dropping probability of QDROP)
+            batches_per_step: 1 (optional, cached batches concatenated into each optimization step)
+            adaptive_budget: {interval: 100, patience: 5, tol: 1.0e-2, saturation: 0.99} (optional, stop each block
+                once converged, see AdaptiveIterationBudget)
         }
 
     """
@@ -576,6 +908,15 @@ def ptq_reconstruction(model: GraphModule, cali_data: list, config: dict, graph_
     disable_all(fp32_model)
     enable_quantization(quant_model)
     torch.cuda.empty_cache()
+    budget = None
+    if hasattr(config, 'cache_budget') and not config.keep_gpu:
+        budget = MemoryBudget(int(config.cache_budget * 2 ** 30), config.cache_dir if hasattr(config, 'cache_dir') else None)
+    cache_dtype = config.cache_dtype if hasattr(config, 'cache_dtype') else None
+    assert cache_dtype is None or cache_dtype in CACHE_DTYPES, 'Do not support cache_dtype: {}'.format(cache_dtype)
+    if graph_module_list is None:
+        # Keep the block boundary activations and only run what is missing for each block.
+        fp32_cache = SequentialActivationCache(fp32_model, cali_data, config.keep_gpu, budget, cache_dtype)
+        quant_cache = SequentialActivationCache(quant_model, cali_data, config.keep_gpu, budget, cache_dtype)
     checked_nodes = dict()
     for node in nodes:
         if 'exclude_node_prefix' in config:
@@ -633,24 +974,37 @@ def ptq_reconstruction(model: GraphModule, cali_data: list, config: dict, graph_
                 continue
             logger.info('the node list is below!')
             logger.info(layer_node_list)
-            fp32_module = fp32_modules[qnode2fpnode_dict[layer_node_list[-1]]]
-            fp32_all_inps = []
-            quant_all_inps = []
-            fp32_final_oups = None
-            out_is_cached = False
-            for _node in layer_node_list:
-                if all([arg in layer_node_list for arg in _flatten_args(_node.args) if isinstance(arg, torch.fx.Node)]):
-                    continue
+            input_nodes = [_node for _node in layer_node_list
+                           if not all([arg in layer_node_list for arg in _flatten_args(_node.args)
+                                       if isinstance(arg, torch.fx.Node)])]
+            if graph_module_list is None:
+                quant_all_inps = quant_cache.get(input_nodes)
+                fp32_nodes = [fp32_cache.by_name[_node.name] for _node in input_nodes + [layer_node_list[-1]]]
+                if config.prob < 1.0:
+                    *fp32_all_inps, fp32_final_oups = fp32_cache.get(fp32_nodes)
                 else:
+                    fp32_all_inps, fp32_final_oups = [], fp32_cache.get(fp32_nodes[-1:])[0]
+            else:
+                fp32_module = fp32_modules[qnode2fpnode_dict[layer_node_list[-1]]]
+                fp32_all_inps = []
+                quant_all_inps = []
+                fp32_final_oups = None
+                out_is_cached = False
+                # the data of each block is dropped after its reconstruction
+                block_budget = MemoryBudget(budget.max_bytes, budget.directory) if budget is not None else None
+                for _node in input_nodes:
                     fp32_inp_module = fp32_modules[qnode2fpnode_dict[_node]]
                     quant_module = quant_modules[_node]
                     # fp32 inps: [out_b1, out_b2, ...]
-                    _, fp32_inps = save_inp_oup_data(fp32_model, None, fp32_inp_module, cali_data, 
-                                                     store_inp=False, store_oup=(config.prob < 1.0), keep_gpu=config.keep_gpu)
+                    _, fp32_inps = save_inp_oup_data(fp32_model, None, fp32_inp_module, cali_data,
+                                                     store_inp=False, store_oup=(config.prob < 1.0), keep_gpu=config.keep_gpu,
+                                                     budget=block_budget, cache_dtype=cache_dtype)
                     _, fp32_oups = save_inp_oup_data(fp32_model, None, fp32_module, cali_data,
-                                                     store_inp=False, store_oup=(not out_is_cached), keep_gpu=config.keep_gpu)
+                                                     store_inp=False, store_oup=(not out_is_cached), keep_gpu=config.keep_gpu,
+                                                     budget=block_budget, cache_dtype=cache_dtype)
                     _, quant_inps = save_inp_oup_data(quant_model, None, quant_module, cali_data,
-                                                      store_inp=False, store_oup=True, keep_gpu=config.keep_gpu)
+                                                      store_inp=False, store_oup=True, keep_gpu=config.keep_gpu,
+                                                      budget=block_budget, cache_dtype=cache_dtype)
                     fp32_all_inps.append(fp32_inps)
                     quant_all_inps.append(quant_inps)
                     if not out_is_cached:
@@ -666,6 +1020,9 @@ def ptq_reconstruction(model: GraphModule, cali_data: list, config: dict, graph_
                                         layer_node_list[-1], g2node)
             logger.info(subgraph.code)
             subgraph_reconstruction(subgraph, cached_inps, cached_oups, config)
+            if graph_module_list is None:
+                # The next blocks see the reconstructed weights.
+                quant_cache.evict([n for n in layer_node_list if n not in input_nodes])
             for x in layer_node_list:
                 checked_nodes[x] = True
     disable_all(quant_model)
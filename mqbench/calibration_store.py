@@ -0,0 +1,387 @@
+import json
+
+import numpy as np
+import torch
+
+from mqbench.observer import (
+    MinMaxObserver,
+    MinMaxFloorObserver,
+    EMAMinMaxObserver,
+    PoTModeObserver,
+    EMAQuantileObserver,
+    MomentsObserverBase,
+    LSQObserver,
+    MSEObserver,
+    EMAMSEObserver,
+    HistogramObserver,
+    HistogramMSEObserver,
+    HistogramPercentileObserver,
+    MultiObserver,
+    _channel_abs_mean,
+    _channel_aminmax,
+    _channel_reduce_dims,
+)
+from mqbench.fake_quantize.quantize_base import group_view
+from mqbench.prepare_by_platform import ObserverDict
+from mqbench.scheme import QuantizeScheme
+from mqbench.utils import aminmax
+from mqbench.utils.utils import no_sync_tensor, sync_observers
+from mqbench.utils.moments import Moments
+from mqbench.utils.logger import logger
+
+
+class _ActivationRecorder(torch.nn.Module):
+    """Per-batch min / max / mean of |x|, moments and a streaming histogram of an activation."""
+
+    def __init__(self, bins):
+        super(_ActivationRecorder, self).__init__()
+        self.histogram = HistogramObserver(bins=bins)
+        self.moments = None
+        self.min_vals, self.max_vals, self.abs_means = [], [], []
+
+    def forward(self, x):
+        x = x.detach().float()
+        if x.numel() == 0:
+            return
+        min_val, max_val = aminmax(x)
+        moments = Moments.from_tensor(x, min_val=min_val, max_val=max_val)
+        self.moments = moments if self.moments is None else self.moments.merge(moments)
+        self.min_vals.append(min_val)
+        self.max_vals.append(max_val)
+        self.abs_means.append(torch.norm(x, p=1) / x.numel())
+        self.histogram(x)
+
+    def sync_state(self):
+        r"""Merge the moments and histograms of all ranks. The statistics of the last batches of the
+        ranks which saw data are averaged, as the EMA observers sync theirs."""
+        device = self.histogram.histogram.device
+        seen = self.moments is not None
+        # a rank without data still has to make the same requests
+        no_batches = 2 ** 62
+        num_batches, = yield [(torch.tensor(len(self.min_vals) if seen else no_batches, device=device), 'min')]
+        num_batches = int(num_batches)
+        requests = []
+        if num_batches != no_batches:
+            for values in [self.min_vals, self.max_vals, self.abs_means]:
+                values = torch.stack(values[len(values) - num_batches:]) if seen else \
+                    torch.zeros(num_batches, device=device)
+                requests.append((values, 'sum'))
+            requests.append((torch.tensor(float(seen), device=device), 'sum'))
+        moments = self.moments if seen else Moments(
+            torch.tensor(0, device=device), torch.tensor(0., device=device), torch.tensor(0., device=device),
+            torch.tensor(float('inf'), device=device), torch.tensor(float('-inf'), device=device))
+        reduced = yield requests + moments.reduce_requests()
+        if len(requests) > 0:
+            num_ranks = reduced[len(requests) - 1]
+            self.min_vals, self.max_vals, self.abs_means = [list(values / num_ranks)
+                                                            for values in reduced[:len(requests) - 1]]
+        moments = moments.from_reduced(reduced[len(requests):])
+        self.moments = moments if int(moments.count) > 0 else None
+
+    def fields(self):
+        return {
+            'min_vals': torch.stack(self.min_vals),
+            'max_vals': torch.stack(self.max_vals),
+            'abs_means': torch.stack(self.abs_means),
+            'count': self.moments.count,
+            'mean': self.moments.mean.double(),
+            'm2': self.moments.m2.double(),
+            'min_val': self.moments.min_val,
+            'max_val': self.moments.max_val,
+            'histogram': self.histogram.histogram,
+            'hist_start': self.histogram.hist_start,
+            'hist_exp': self.histogram.hist_exp,
+        }
+
+
+class _WeightRecorder:
+    """Per-channel min / max / mean of |x| and moments of the weights along ``ch_axis``, rows of
+    group_view if ``group_size`` is given. ``keep_weight`` keeps the weights themselves instead,
+    for the observers which can not be solved from these statistics.
+    """
+
+    def __init__(self, ch_axis, group_size=None, keep_weight=False):
+        self.ch_axis = ch_axis
+        self.group_size = group_size
+        self.keep_weight = keep_weight
+        self.stats = None
+
+    def __call__(self, x):
+        x = x.detach().float()
+        if self.keep_weight:
+            self.stats = {'weight': x.clone()}
+            return
+        ch_axis = self.ch_axis
+        if self.group_size is not None:
+            x, ch_axis = group_view(x, self.group_size), 0
+        dims = _channel_reduce_dims(x, ch_axis)
+        min_vals, max_vals = _channel_aminmax(x, ch_axis)
+        moments = Moments.from_tensor(x, dims, min_vals, max_vals)
+        self.stats = {
+            'min_vals': min_vals,
+            'max_vals': max_vals,
+            'abs_means': _channel_abs_mean(x, ch_axis),
+            'count': moments.count,
+            'mean': moments.mean.double(),
+            'm2': moments.m2.double(),
+        }
+
+    def fields(self):
+        return self.stats
+
+
+def _solved_from_weight_stats(observer_cls):
+    return issubclass(observer_cls, (MinMaxObserver, EMAMinMaxObserver, MomentsObserverBase, LSQObserver))
+
+
+def _check_qconfig(extra_qconfig_dict):
+    """Raise a ValueError if solve_qparams can not compute the qparams of ``extra_qconfig_dict``."""
+    for prefix in ['w', 'a']:
+        observer_name = extra_qconfig_dict['{}_observer'.format(prefix)]
+        if observer_name not in ObserverDict:
+            raise ValueError('Do not support observer name: {}'.format(observer_name))
+        if issubclass(ObserverDict[observer_name], MultiObserver):
+            raise ValueError('{} can not be solved offline.'.format(observer_name))
+    if extra_qconfig_dict['a_qscheme'].get('per_channel', False):
+        # only per-tensor statistics of the activations are recorded
+        raise ValueError('Per-channel activation quantization with {} can not be solved offline.'.format(
+            extra_qconfig_dict['a_observer']))
+
+
+def record_calibration(model, cali_data, path, bins=2048, extra_qconfig_dict=None):
+    """Run ``model`` over ``cali_data`` once in float and save the statistics of the input of every
+    fake quantizer to ``path`` (a raw file read back with numpy memmap) and ``path + '.json'`` (its index).
+
+    Weights get per-channel min / max / mean of |x| and moments, activations per-batch min / max /
+    mean of |x|, their moments and a ``bins`` bins histogram, see solve_qparams for what is exact.
+    If the ``extra_qconfig_dict`` to be solved is given, it is checked before anything is recorded,
+    the weight statistics follow its group_size and the weights themselves are saved if its
+    w_observer needs them. In distributed training the statistics of all ranks are merged once
+    before they are saved.
+    """
+    group_size, keep_weight = None, False
+    if extra_qconfig_dict is not None:
+        _check_qconfig(extra_qconfig_dict)
+        group_size = extra_qconfig_dict['w_qscheme'].get('group_size', None)
+        keep_weight = not _solved_from_weight_stats(ObserverDict[extra_qconfig_dict['w_observer']])
+    recorders, handles, states = {}, [], {}
+    modules = dict(model.named_modules())
+    for name, submodule in modules.items():
+        if not isinstance(submodule, torch.quantization.FakeQuantizeBase):
+            continue
+        if name.endswith('weight_fake_quant'):
+            parent = modules[name.rsplit('.', 1)[0]] if '.' in name else model
+            # deconv weights are quantized per output channel along axis 1
+            ch_axis = 1 if isinstance(parent, torch.nn.modules.conv._ConvTransposeNd) else 0
+            recorder = _WeightRecorder(submodule.ch_axis if submodule.ch_axis != -1 else ch_axis,
+                                       group_size if group_size is not None else getattr(submodule, 'group_size', None),
+                                       keep_weight)
+        else:
+            recorder = _ActivationRecorder(bins).to(submodule.scale.device)
+        recorders[name] = recorder
+        states[name] = (submodule.fake_quant_enabled.clone(), submodule.observer_enabled.clone())
+        submodule.disable_fake_quant()
+        submodule.disable_observer()
+        handles.append(submodule.register_forward_pre_hook(lambda module, inputs, recorder=recorder: recorder(inputs[0])))
+    with torch.no_grad():
+        for batch in cali_data:
+            model(batch)
+    for handle in handles:
+        handle.remove()
+    for name, (fake_quant_enabled, observer_enabled) in states.items():
+        modules[name].enable_fake_quant(bool(fake_quant_enabled[0] == 1))
+        modules[name].enable_observer(bool(observer_enabled[0] == 1))
+    # the weights are the same on every rank
+    sync_observers(torch.nn.ModuleList([recorder for recorder in recorders.values()
+                                        if isinstance(recorder, _ActivationRecorder)]))
+
+    index, offset = {'bins': bins, 'quantizers': {}}, 0
+    with open(path, 'wb') as f:
+        for name, recorder in recorders.items():
+            if isinstance(recorder, _WeightRecorder) and recorder.stats is None or \
+                    isinstance(recorder, _ActivationRecorder) and recorder.moments is None:
+                logger.warning('{} saw no data, skip it.'.format(name))
+                continue
+            entry = {'kind': 'weight' if isinstance(recorder, _WeightRecorder) else 'activation', 'fields': {}}
+            if isinstance(recorder, _WeightRecorder):
+                entry['ch_axis'] = recorder.ch_axis
+                entry['group_size'] = recorder.group_size
+            for field, tensor in recorder.fields().items():
+                array = np.ascontiguousarray(tensor.cpu().numpy())
+                entry['fields'][field] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+                f.write(array.tobytes())
+                offset += array.nbytes
+                # keep every field 8 bytes aligned
+                f.write(b'\0' * (-offset % 8))
+                offset += -offset % 8
+            index['quantizers'][name] = entry
+    with open(path + '.json', 'w') as f:
+        json.dump(index, f)
+    logger.info('Save calibration statistics of {} quantizers to {}.'.format(len(index['quantizers']), path))
+    return path
+
+
+class CalibrationStatistics:
+    """Read only view of a file written by record_calibration."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + '.json') as f:
+            index = json.load(f)
+        self.bins = index['bins']
+        self.quantizers = index['quantizers']
+
+    def get(self, name, field):
+        meta = self.quantizers[name]['fields'][field]
+        array = np.memmap(self.path, dtype=np.dtype(meta['dtype']), mode='r', offset=meta['offset'],
+                          shape=tuple(meta['shape']))
+        return torch.from_numpy(np.array(array))
+
+
+def _load_histogram(observer, stats, name):
+    observer.histogram = stats.get(name, 'histogram')
+    observer.hist_start.fill_(int(stats.get(name, 'hist_start')))
+    observer.hist_exp.fill_(int(stats.get(name, 'hist_exp')))
+    observer.min_val = stats.get(name, 'min_val')
+    observer.max_val = stats.get(name, 'max_val')
+
+
+def _sample_histogram(stats, name, num_samples=2 ** 20):
+    """About ``num_samples`` points distributed like the recorded histogram, plus its min and max."""
+    histogram = HistogramObserver(bins=stats.bins)
+    _load_histogram(histogram, stats, name)
+    edges = histogram._bin_edges()
+    counts = histogram.histogram * min(1., num_samples / float(histogram.histogram.sum()))
+    x = ((edges[:-1] + edges[1:]) / 2).repeat_interleave(counts.round().long())
+    return torch.cat([histogram.min_val.reshape(1), x.clamp(float(histogram.min_val), float(histogram.max_val)),
+                      histogram.max_val.reshape(1)])
+
+
+def _ema(observer, min_vals, max_vals):
+    observer.min_val, observer.max_val = min_vals[0], max_vals[0]
+    for min_val, max_val in zip(min_vals[1:], max_vals[1:]):
+        observer.min_val = observer.min_val * observer.ema_ratio + min_val * (1.0 - observer.ema_ratio)
+        observer.max_val = observer.max_val * observer.ema_ratio + max_val * (1.0 - observer.ema_ratio)
+
+
+def _solve_activation(observer, stats, name):
+    min_vals, max_vals = stats.get(name, 'min_vals'), stats.get(name, 'max_vals')
+    if isinstance(observer, HistogramObserver):
+        _load_histogram(observer, stats, name)
+    elif isinstance(observer, MomentsObserverBase):
+        observer.count = stats.get(name, 'count')
+        observer.mean = stats.get(name, 'mean').float()
+        observer.m2 = stats.get(name, 'm2').float()
+        observer.min_val, observer.max_val = stats.get(name, 'min_val'), stats.get(name, 'max_val')
+    elif isinstance(observer, LSQObserver):
+        observer.tensor_norm = stats.get(name, 'abs_means')[-1]
+        observer.norm_count.fill_(1)
+        observer.min_val, observer.max_val = min_vals[-1], max_vals[-1]
+    elif isinstance(observer, EMAMinMaxObserver):
+        _ema(observer, min_vals, max_vals)
+    elif isinstance(observer, (MSEObserver, EMAMSEObserver, EMAQuantileObserver)):
+        # The clipping range is searched over the histogram of all data instead of each batch,
+        # and applied to each batch as a ratio of its range.
+        if isinstance(observer, EMAQuantileObserver):
+            histogram = HistogramPercentileObserver(observer.dtype, torch.per_tensor_symmetric, False, observer.quant_min,
+                                                    observer.quant_max, -1, False, stats.bins, observer.threshold)
+        else:
+            histogram = HistogramMSEObserver(observer.dtype, observer.qscheme, False, observer.quant_min,
+                                             observer.quant_max, -1, False, stats.bins, observer.p)
+        _load_histogram(histogram, stats, name)
+        min_clip, max_clip = histogram._clip_range()
+        min_vals = min_vals * torch.clamp(min_clip / histogram.min_val, max=1.).nan_to_num(1.)
+        max_vals = max_vals * torch.clamp(max_clip / histogram.max_val, max=1.).nan_to_num(1.)
+        if isinstance(observer, MSEObserver):
+            observer.min_val, observer.max_val = min_vals.min(), max_vals.max()
+        else:
+            _ema(observer, min_vals, max_vals)
+    elif isinstance(observer, (MinMaxFloorObserver, PoTModeObserver)):
+        observer(_sample_histogram(stats, name))
+    else:
+        observer.min_val, observer.max_val = stats.get(name, 'min_val'), stats.get(name, 'max_val')
+    return observer.calculate_qparams()
+
+
+def _solve_weight(observer, stats, name):
+    min_vals, max_vals, abs_means = [stats.get(name, field) for field in ['min_vals', 'max_vals', 'abs_means']]
+    count, mean, m2 = stats.get(name, 'count'), stats.get(name, 'mean'), stats.get(name, 'm2')
+    if observer.ch_axis == -1:
+        # merge the channels, which all have the same count
+        total_mean = mean.mean()
+        m2 = m2.sum() + count * ((mean - total_mean) ** 2).sum()
+        count, mean = count * mean.numel(), total_mean
+        min_vals, max_vals, abs_means = min_vals.min(), max_vals.max(), abs_means.mean()
+    observer.min_val, observer.max_val = min_vals, max_vals
+    if isinstance(observer, MomentsObserverBase):
+        observer.count, observer.mean, observer.m2 = count, mean.float(), m2.float()
+    elif isinstance(observer, LSQObserver):
+        observer.tensor_norm = abs_means
+        observer.norm_count.fill_(1)
+    return observer.calculate_qparams()
+
+
+def _solve_quantizer(stats, name, entry, extra_qconfig_dict):
+    prefix = 'w' if entry['kind'] == 'weight' else 'a'
+    observer_cls = ObserverDict[extra_qconfig_dict['{}_observer'.format(prefix)]]
+    qscheme = QuantizeScheme(**extra_qconfig_dict['{}_qscheme'.format(prefix)])
+    qscheme.kwargs.update(extra_qconfig_dict.get('{}_observer_extra_args'.format(prefix), {}))
+    observer_params = qscheme.to_observer_params()
+    group_size = observer_params.pop('group_size', None)
+    if issubclass(observer_cls, HistogramObserver):
+        observer_params['bins'] = stats.bins
+    if entry['kind'] == 'activation':
+        observer = observer_cls(**observer_params)
+        if hasattr(observer, 'set_quant_type'):
+            observer.set_quant_type('tensor')
+        return _solve_activation(observer, stats, name)
+    weight_saved = 'weight' in entry['fields']
+    if not weight_saved and not _solved_from_weight_stats(observer_cls):
+        raise ValueError('{} needs the weights of {}, pass the extra_qconfig_dict to record_calibration '
+                         'to save them.'.format(observer_cls.__name__, name))
+    if not weight_saved and group_size != entry['group_size']:
+        raise ValueError('The weight statistics of {} were recorded with group_size {}, not {}.'.format(
+            name, entry['group_size'], group_size))
+    if qscheme.per_channel and group_size is None:
+        observer_params['ch_axis'] = entry['ch_axis']
+    observer = observer_cls(**observer_params)
+    if hasattr(observer, 'set_quant_type'):
+        observer.set_quant_type('param')
+    if not weight_saved:
+        return _solve_weight(observer, stats, name)
+    weight = stats.get(name, 'weight')
+    if group_size is not None:
+        # a group-wise quantizer observes the grouped view of the weight
+        weight = group_view(weight, group_size)
+    observer(weight)
+    return observer.calculate_qparams()
+
+
+def solve_qparams(path, extra_qconfig_dict):
+    """Compute the qparams of every quantizer recorded in ``path`` without running the model.
+
+    Args:
+        path (str): file written by record_calibration.
+        extra_qconfig_dict (dict): 'w_observer' / 'a_observer' (names in ObserverDict),
+            'w_qscheme' / 'a_qscheme' (QuantizeScheme kwargs) and optionally
+            'w_observer_extra_args' / 'a_observer_extra_args', as for the Academic backend.
+
+    Weight qparams are exact. MinMax, EMAMinMax, ClipStd, LSQ and LSQ+ are solved from the weight
+    statistics, the other observers need the weights, saved by record_calibration when it is given
+    an ``extra_qconfig_dict`` with such a w_observer. For activations, MinMax, EMAMinMax, ClipStd,
+    LSQ, LSQ+ and the histogram observers are exact up to the recorded bins; MSE, EMAMSE and
+    EMAQuantile search the clipping ratio over the recorded histogram instead of each batch;
+    MinMaxFloor and PoTMode see samples of the histogram.
+    Per-channel activation quantization and MultiObserver are not supported, they raise a ValueError.
+    The statistics were merged over the ranks when recorded, so nothing is synced here.
+
+    Returns:
+        dict: quantizer name to (scale, zero_point), see mqbench.utils.state.load_qparams.
+    """
+    _check_qconfig(extra_qconfig_dict)
+    stats = CalibrationStatistics(path)
+    qparams = {}
+    with no_sync_tensor():
+        for name, entry in stats.quantizers.items():
+            qparams[name] = _solve_quantizer(stats, name, entry, extra_qconfig_dict)
+    return qparams
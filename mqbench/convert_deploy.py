@@ -8,6 +8,7 @@ import mqbench.fusion_method          # noqa: F401
 from mqbench.prepare_by_platform import BackendType
 from mqbench.utils import deepcopy_graphmodule
 from mqbench.utils.logger import logger
+from mqbench.utils.state import enable_export_mode
 from mqbench.utils.registry import (
     BACKEND_DEPLOY_FUNCTION,
     register_deploy_function,
@@ -18,6 +19,7 @@ from mqbench.deploy import (
     remove_fakequantize_and_collect_params,
     replace_fakequantize_and_collect_params_openvino,
     remove_fakequantize_and_collect_params_tengine,
+    collect_and_save_group_qparams,
     ONNXQLinearPass, ONNXQNNPass
 )
 
@@ -89,6 +91,13 @@ def convert_onnx(model: GraphModule, input_shape_dict, dummy_input, onnx_model_p
                               enable_onnx_checker=False)
 
 
+@register_deploy_function(BackendType.Academic_NLP)
+@register_deploy_function(BackendType.Academic)
+def deploy_qparams_group(model: GraphModule, output_path, model_name, **kwargs):
+    logger.info("Extract qparams of group-wise weights.")
+    collect_and_save_group_qparams(model, output_path, model_name)
+
+
 @register_deploy_function(BackendType.Tensorrt)
 def convert_onnx_qlinear(model: GraphModule, onnx_model_path, model_name, **kwargs):
     if kwargs.get('deploy_to_qlinear', False):
@@ -180,5 +189,6 @@ def convert_deploy(model: GraphModule, backend_type: BackendType,
     }
     kwargs.update(extra_kwargs)
     deploy_model = deepcopy_graphmodule(model)
+    enable_export_mode(deploy_model)
     for convert_function in BACKEND_DEPLOY_FUNCTION[backend_type]:
         convert_function(deploy_model, **kwargs)
@@ -1,3 +1,4 @@
+from .deploy_group import collect_group_qparams, collect_and_save_group_qparams
 from .deploy_linear import remove_fakequantize_and_collect_params
 from .deploy_nnie import remove_fakequantize_and_collect_params_nnie
 from .deploy_onnx_qlinear import ONNXQLinearPass
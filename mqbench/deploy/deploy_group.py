@@ -0,0 +1,45 @@
+import json
+import os
+
+from mqbench.fake_quantize.quantize_base import QuantizeBase
+from mqbench.utils.logger import logger
+
+
+def collect_group_qparams(model):
+    r"""Qparams of the group-wise weight quantizers of ``model``, keyed by the name of the weight.
+    step / zero_point / min / max are [rows, groups per row] lists, in the order of the groups
+    in the flattened row.
+    """
+    clip_ranges = {}
+    modules = dict(model.named_modules())
+    for name, submodule in modules.items():
+        if not isinstance(submodule, QuantizeBase) or submodule.group_size is None or \
+                not name.endswith('weight_fake_quant'):
+            continue
+        parent = modules[name.rsplit('.', 1)[0]] if '.' in name else model
+        rows = parent.weight.shape[0]
+        submodule.normalize_qparams()
+        scale = submodule.scale.detach().float().cpu().reshape(rows, -1)
+        zero_point = submodule.zero_point.detach().float().cpu().round().reshape(rows, -1)
+        clip_ranges[name[:-len('_fake_quant')]] = {
+            'group_size': submodule.group_size,
+            'step': scale.tolist(),
+            'zero_point': zero_point.int().tolist(),
+            'min': (scale * (submodule.quant_min - zero_point)).tolist(),
+            'max': (scale * (submodule.quant_max - zero_point)).tolist(),
+            'bit': submodule.bitwidth,
+        }
+    return clip_ranges
+
+
+def collect_and_save_group_qparams(model, output_path, model_name):
+    r"""Write the qparams of the group-wise weight quantizers to ``{model_name}_clip_ranges.json``,
+    nothing is written if there are none."""
+    clip_ranges = collect_group_qparams(model)
+    if not clip_ranges:
+        return None
+    context_filename = os.path.join(output_path, '{}_clip_ranges.json'.format(model_name))
+    with open(context_filename, 'w') as f:
+        json.dump({'group_wise': clip_ranges}, f, indent=4)
+    logger.info('Save qparams of {} group-wise weights to {}.'.format(len(clip_ranges), context_filename))
+    return context_filename
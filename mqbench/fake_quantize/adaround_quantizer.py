@@ -1,7 +1,13 @@
 import torch
 from torch.nn.parameter import Parameter
 
-from mqbench.fake_quantize.quantize_base import QuantizeBase, _version_under_1100 
+from mqbench.fake_quantize.quantize_base import (
+    QuantizeBase,
+    quantize_forward,
+    group_view,
+    _version_under_1100,
+    _fake_quantize_per_tensor_affine
+)
 from mqbench.utils.hook import PerChannelLoadHook
 
 def _rectified_sigmoid(alpha, zeta, gamma):
@@ -50,8 +56,8 @@ class AdaRoundFakeQuantize(QuantizeBase):
 
     def init(self, weight_tensor: torch.Tensor, round_mode='learned_hard_sigmoid', ):
         self.adaround = True
-        self.observer_enabled[0] = 0
-        self.fake_quant_enabled[0] = 1
+        self.disable_observer()
+        self.enable_fake_quant()
         self.round_mode = round_mode
 
         # self.soft_targets = False  # delete this
@@ -59,6 +65,9 @@ class AdaRoundFakeQuantize(QuantizeBase):
         self.init_alpha(x=weight_tensor.data.clone())
 
     def init_alpha(self, x: torch.Tensor):
+        if self.group_size is not None:
+            # alpha has the shape of the input of forward
+            x = group_view(x, self.group_size)
         if self.ch_axis != -1:
             new_shape = [1] * len(x.shape)
             new_shape[self.ch_axis] = x.shape[self.ch_axis]
@@ -88,38 +97,38 @@ class AdaRoundFakeQuantize(QuantizeBase):
         return ((self.zeta - self.gamma) * torch.sigmoid(self.alpha) + self.gamma).clamp(0, 1)
 
     def get_hard_value(self, X):
+        shape = X.shape
+        if self.group_size is not None:
+            X = group_view(X, self.group_size)
         X = adaround_forward(X, self.scale.data, self.zero_point.data.long(), self.quant_min,
                              self.quant_max, self.ch_axis, self.alpha, self.zeta, self.gamma, hard_value=True)
-        return X
+        return X.reshape(shape)
 
+    @quantize_forward
     def forward(self, X):
-        if self.observer_enabled[0] == 1:
+        if self._observer_enabled:
             self.activation_post_process(X.detach())
-            _scale, _zero_point = self.calculate_qparams()
-            _scale, _zero_point = _scale.to(self.scale.device), _zero_point.to(self.zero_point.device)
-            if self.scale.shape != _scale.shape:
-                self.scale.resize_(_scale.shape)
-                self.zero_point.resize_(_zero_point.shape)
-            self.scale.copy_(_scale)
-            self.zero_point.copy_(_zero_point)
-
-        if self.fake_quant_enabled[0] == 1:
+            if not self.defer_qparams:
+                self.update_qparams()
+
+        if self._fake_quant_enabled:
             if not self.adaround:
                 if self.is_per_channel:
-                    X = torch.fake_quantize_per_channel_affine(
-                        X, self.scale,
+                    X = self._fake_quantize(
+                        torch.fake_quantize_per_channel_affine, X, self.scale,
                         self.zero_point.long() if _version_under_1100 else self.zero_point,
                         self.ch_axis, self.quant_min, self.quant_max)
                 else:
-                    X = torch.fake_quantize_per_tensor_affine(
-                        X, self.scale.item(), int(self.zero_point.item()),
-                        self.quant_min, self.quant_max)
+                    X = self._fake_quantize(
+                        _fake_quantize_per_tensor_affine, X, self.scale, self.zero_point,
+                        self.quant_min, self.quant_max, self._exporting())
             else:
                 if not hasattr(self, 'alpha'):
                     raise NotImplementedError
                 if self.round_mode == 'learned_hard_sigmoid':
-                    X = adaround_forward(X, self.scale.data, self.zero_point.data.long(), self.quant_min,
-                                         self.quant_max, self.ch_axis, self.alpha, self.zeta, self.gamma)
+                    X = self._fake_quantize(adaround_forward, X, self.scale.data, self.zero_point.data.long(),
+                                            self.quant_min, self.quant_max, self.ch_axis, self.alpha, self.zeta,
+                                            self.gamma)
                 else:
                     raise NotImplementedError
         return X
@@ -2,8 +2,7 @@ import math
 
 import torch
 
-from mqbench.fake_quantize.quantize_base import QuantizeBase
-from mqbench.utils import is_tracing_state
+from mqbench.fake_quantize.quantize_base import QuantizeBase, quantize_forward
 from mqbench.utils.hook import PerChannelLoadHook
 
 
@@ -47,36 +46,74 @@ class DSQFakeQuantize(QuantizeBase):
         self.alpha = alpha
         self.load_state_dict_hook = PerChannelLoadHook(self)
 
+    @quantize_forward
     def forward(self, X):
-        if self.training:
+        if self._observer_enabled:
             self.activation_post_process(X.detach())
-            _scale, _zero_point = self.activation_post_process.calculate_qparams()
-            _scale, _zero_point = _scale.to(self.scale.device), _zero_point.to(self.zero_point.device)
-            if self.scale.shape != _scale.shape:
-                self.scale.resize_(_scale.shape)
-                self.zero_point.resize_(_zero_point.shape)
-            self.scale.copy_(_scale)
-            self.zero_point.copy_(_zero_point.float())
-
-        if self.fake_quant_enabled[0] == 1:
+            if not self.defer_qparams:
+                self.update_qparams()
+
+        if self._fake_quant_enabled:
             if self.is_per_channel:
-                if is_tracing_state():
+                if self._exporting():
                     X = FakeQuantizeDSQPerchannel.apply(
                         X, self.scale, self.zero_point, self.quant_min, self.quant_max, self.ch_axis, self.alpha)
                 else:
-                    X = dsq_function_per_channel(
+                    X = self._fake_quantize(
+                        FakeQuantizeDSQTraining.apply,
                         X, self.scale, self.zero_point, self.quant_min, self.quant_max, self.ch_axis, self.alpha)
             else:
-                if is_tracing_state():
+                if self._exporting():
                     X = FakeQuantizeDSQPertensor.apply(
                         X, self.scale, self.zero_point, self.quant_min, self.quant_max, self.alpha)
                 else:
-                    X = dsq_function_per_tensor(
-                        X, self.scale, self.zero_point, self.quant_min, self.quant_max, self.alpha)
+                    X = self._fake_quantize(
+                        FakeQuantizeDSQTraining.apply,
+                        X, self.scale, self.zero_point, self.quant_min, self.quant_max, None, self.alpha)
 
         return X
 
 
+
+def _dsq_tanh(alpha):
+    tanh_scale = 1 / (1 - alpha)
+    return tanh_scale, math.log((tanh_scale + 1) / (tanh_scale - 1))
+
+
+class FakeQuantizeDSQTraining(torch.autograd.Function):
+    r"""Same result and gradient as dsq_function_per_tensor / dsq_function_per_channel
+    (per-tensor if ch_axis is None), but only x, scale and zero_point are saved for backward
+    instead of the floor, tanh and clamp intermediates of the composite ops.
+    scale and zero_point are buffers set by the observer, only x gets a gradient.
+    """
+    @staticmethod
+    def forward(ctx, x, scale, zero_point, quant_min, quant_max, ch_axis, alpha):
+        if ch_axis is not None:
+            new_shape = [1] * x.dim()
+            new_shape[ch_axis] = x.shape[ch_axis]
+            scale, zero_point = scale.reshape(new_shape), zero_point.reshape(new_shape)
+        ctx.save_for_backward(x, scale, zero_point)
+        ctx.quant_min, ctx.quant_max, ctx.alpha = quant_min, quant_max, alpha
+        tanh_scale, tanh_k = _dsq_tanh(alpha)
+        # Same op order as the composite version, so the results are bitwise equal.
+        x = (x / scale).add_(zero_point).clamp_(quant_min, quant_max)
+        x_floor = torch.floor(x)
+        x.sub_(x_floor).sub_(0.5).mul_(tanh_k).tanh_().mul_(tanh_scale).mul_(0.5)
+        return x_floor.add_(x).add_(0.5).round_().sub_(zero_point).mul_(scale)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        x, scale, zero_point = ctx.saved_tensors
+        tanh_scale, tanh_k = _dsq_tanh(ctx.alpha)
+        # d out / d x = 0.5 * tanh_scale * tanh_k * (1 - tanh(tanh_k * (frac(x) - 0.5)) ** 2) in the range,
+        # computed in place in the buffer of the gradient, plus a bool mask for the clamp.
+        grad_x = (x / scale).add_(zero_point)
+        mask = torch.logical_or(grad_x < ctx.quant_min, grad_x > ctx.quant_max)
+        grad_x.remainder_(1).sub_(0.5).mul_(tanh_k).tanh_().square_().neg_().add_(1).mul_(0.5 * tanh_scale * tanh_k)
+        grad_x.masked_fill_(mask, 0).mul_(grad_output)
+        return grad_x, None, None, None, None, None, None
+
+
 class FakeQuantizeDSQPerchannel(torch.autograd.Function):
     @staticmethod
     def forward(ctx, x, scale, zero_point, quant_min, quant_max, ch_axis, alpha):
@@ -1,8 +1,8 @@
 import torch
 from torch.nn.parameter import Parameter
 
-from mqbench.fake_quantize.quantize_base import QuantizeBase
-from mqbench.utils import is_symmetric_quant, is_tracing_state
+from mqbench.fake_quantize.quantize_base import QuantizeBase, quantize_forward
+from mqbench.utils import is_symmetric_quant, no_jit_trace
 from mqbench.utils.hook import PerChannelLoadHook
 
 
@@ -27,6 +27,7 @@ class LearnableFakeQuantize(QuantizeBase):
 
     @torch.jit.export
     def extra_repr(self):
+        self.normalize_qparams()
         return 'fake_quant_enabled={}, observer_enabled={}, ' \
                'quant_min={}, quant_max={}, dtype={}, qscheme={}, ch_axis={}, ' \
                'scale={}, zero_point={}'.format(
@@ -35,50 +36,86 @@ class LearnableFakeQuantize(QuantizeBase):
                    self.dtype, self.qscheme, self.ch_axis, self.scale if self.ch_axis == -1 else 'List[%s]' % str(self.scale.shape),
                    self.zero_point if self.ch_axis == -1 else 'List')
 
+    def update_qparams(self):
+        _scale, _zero_point = self.activation_post_process.calculate_qparams()
+        _scale = _scale.to(self.scale.device)
+        _zero_point = _zero_point.to(self.zero_point.device)
+
+        if self.ch_axis != -1:
+            self.scale.data = torch.ones_like(_scale)
+            self.zero_point.data = torch.zeros_like(_zero_point.float())
+
+        self.scale.data.copy_(_scale)
+        self.zero_point.data.copy_(_zero_point.float())
+
+    def _qparams(self):
+        r"""scale / zero_point as forward uses them: a learned scale is positive, zero_point is 0 for
+        symmetric quantization and within the quantized range otherwise. The parameters themselves are
+        left as they are, gradients go straight through the projections. While exporting the parameters
+        are normalized and used as they are, so that they are exported as constants.
+        """
+        if self._exporting():
+            with no_jit_trace():
+                self.normalize_qparams()
+            return self.scale, self.zero_point
+        return self._projected_qparams()
+
+    def _projected_qparams(self):
+        scale = self.scale
+        if not self._observer_enabled:
+            scale = scale.abs()
+            scale = scale + (scale.clamp(min=self.eps) - scale).detach()
+        if is_symmetric_quant(self.qscheme):
+            zero_point = self.zero_point - self.zero_point.detach()
+        else:
+            zero_point = self.zero_point + (self.zero_point.clamp(self.quant_min, self.quant_max)
+                                            - self.zero_point).detach()
+        return scale, zero_point
+
+    @torch.jit.ignore
+    def normalize_qparams(self):
+        with torch.no_grad():
+            scale, zero_point = self._projected_qparams()
+            self.scale.copy_(scale)
+            self.zero_point.copy_(zero_point)
+
+    def _save_to_state_dict(self, destination, prefix, keep_vars):
+        # checkpoints hold the qparams forward uses
+        self.normalize_qparams()
+        super(LearnableFakeQuantize, self)._save_to_state_dict(destination, prefix, keep_vars)
+
+    @quantize_forward
     def forward(self, X):
         # Learnable fake quantize have to zero_point.float() to make it learnable.
-        if self.observer_enabled[0] == 1:
+        if self._observer_enabled:
             self.activation_post_process(X.detach())
-            _scale, _zero_point = self.activation_post_process.calculate_qparams()
-            _scale = _scale.to(self.scale.device)
-            _zero_point = _zero_point.to(self.zero_point.device)
-
-            if self.ch_axis != -1:
-                self.scale.data = torch.ones_like(_scale)
-                self.zero_point.data = torch.zeros_like(_zero_point.float())
-
-            self.scale.data.copy_(_scale)
-            self.zero_point.data.copy_(_zero_point.float())
-        else:
-            self.scale.data.abs_()
-            self.scale.data.clamp_(min=self.eps.item())
-
-        if self.fake_quant_enabled[0] == 1:
-            if is_symmetric_quant(self.qscheme):
-                self.zero_point.data.zero_()
-            else:
-                self.zero_point.data.clamp_(self.quant_min, self.quant_max).float()
+            if not self.defer_qparams:
+                self.update_qparams()
 
+        if self._fake_quant_enabled:
+            scale, zero_point = self._qparams()
             if self.is_per_channel:
                 if self.use_grad_scaling:
                     grad_factor = 1.0 / (X.numel() / X.shape[self.ch_axis] * self.quant_max) ** 0.5
                 else:
                     grad_factor = 1.0
-                if is_tracing_state():
+                if self._exporting():
                     X = FakeQuantizeLearnablePerchannelAffine.apply(
-                        X, self.scale, self.zero_point, self.ch_axis,
+                        X, scale, zero_point, self.ch_axis,
                         self.quant_min, self.quant_max, grad_factor)
                 else:
-                    X = _fake_quantize_learnable_per_channel_affine_training(
-                        X, self.scale, self.zero_point, self.ch_axis,
+                    X = self._fake_quantize(
+                        FakeQuantizeLearnablePerchannelAffineTraining.apply,
+                        X, scale, zero_point, self.ch_axis,
                         self.quant_min, self.quant_max, grad_factor)
             else:
                 if self.use_grad_scaling:
                     grad_factor = 1.0 / (X.numel() * self.quant_max) ** 0.5
                 else:
                     grad_factor = 1.0
-                X = torch._fake_quantize_learnable_per_tensor_affine(
-                    X, self.scale, self.zero_point,
+                X = self._fake_quantize(
+                    torch._fake_quantize_learnable_per_tensor_affine,
+                    X, scale, zero_point,
                     self.quant_min, self.quant_max, grad_factor)
         return X
 
@@ -95,6 +132,53 @@ def _fake_quantize_learnable_per_channel_affine_training(x, scale, zero_point, c
     return (x - zero_point) * scale
 
 
+class FakeQuantizeLearnablePerchannelAffineTraining(torch.autograd.Function):
+    r"""Same result and gradients as _fake_quantize_learnable_per_channel_affine_training
+    (round STE, clamp and LSQ gradients of scale / zero_point scaled by grad_factor),
+    but only x, scale and zero_point are saved for backward instead of the full size
+    intermediates of the composite ops. The rounded input and the in-range mask are
+    recomputed in backward.
+    """
+    @staticmethod
+    def forward(ctx, x, scale, zero_point, ch_axis, quant_min, quant_max, grad_factor):
+        ch_axis = ch_axis % x.dim()
+        new_shape = [1] * x.dim()
+        new_shape[ch_axis] = x.shape[ch_axis]
+        ctx.save_for_backward(x, scale, zero_point)
+        ctx.ch_axis, ctx.quant_min, ctx.quant_max, ctx.grad_factor = ch_axis, quant_min, quant_max, grad_factor
+        scale, zero_point = scale.reshape(new_shape), zero_point.round().reshape(new_shape)
+        x_q = (x / scale).add_(zero_point).round_().clamp_(quant_min, quant_max)
+        return x_q.sub_(zero_point).mul_(scale)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        x, scale, zero_point = ctx.saved_tensors
+        return _fake_quantize_learnable_per_channel_affine_backward(
+            grad_output, x, scale, zero_point, ctx.ch_axis, ctx.quant_min, ctx.quant_max,
+            ctx.grad_factor) + (None, None, None, None)
+
+
+def _fake_quantize_learnable_per_channel_affine_backward(grad_output, x, scale, zero_point, ch_axis,
+                                                         quant_min, quant_max, grad_factor):
+    new_shape = [1] * x.dim()
+    new_shape[ch_axis] = x.shape[ch_axis]
+    reduce_dims = [dim for dim in range(x.dim()) if dim != ch_axis]
+    scale, zero_point = scale.reshape(new_shape), zero_point.round().reshape(new_shape)
+    # Work in place on the two full size buffers x / scale + zero_point and its rounding.
+    x = (x / scale).add_(zero_point)
+    x_round = torch.round(x)
+    mask = (x_round >= quant_min) & (x_round <= quant_max)
+    # d out / d scale is round(x) - x inside the range and the clamped level outside of it.
+    x.neg_().add_(x_round)
+    x_round.clamp_(quant_min, quant_max).sub_(zero_point)
+    grad_s = torch.where(mask, x, x_round)
+    del x, x_round
+    grad_s = grad_s.mul_(grad_output).sum(reduce_dims) * grad_factor
+    grad_x = grad_output.masked_fill(~mask, 0)
+    grad_zero_point = (grad_x.sum(reduce_dims) - grad_output.sum(reduce_dims)) * scale.reshape(-1) * grad_factor
+    return grad_x, grad_s, grad_zero_point
+
+
 def grad_scale(t, scale):
     return (t - (t * scale)).detach() + (t * scale)
 
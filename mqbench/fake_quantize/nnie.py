@@ -1,6 +1,6 @@
 import torch
 
-from mqbench.fake_quantize.quantize_base import QuantizeBase
+from mqbench.fake_quantize.quantize_base import QuantizeBase, quantize_forward
 from mqbench.utils import no_jit_trace
 
 
@@ -9,30 +9,42 @@ class NNIEFakeQuantize(QuantizeBase):
         super(NNIEFakeQuantize, self).__init__(observer, **observer_kwargs)
         self.register_buffer('data_max', torch.tensor(float('-inf')))
 
+    @quantize_forward
     def forward(self, X):
         with no_jit_trace():
-            if self.observer_enabled[0] == 1:
+            if self._observer_enabled:
                 self.activation_post_process(X.detach())
             data_max = torch.max(-self.activation_post_process.min_val, self.activation_post_process.max_val)
             self.data_max = torch.max(data_max, self.data_max)
-        if self.fake_quant_enabled[0] == 1:
+        if self._fake_quant_enabled:
             X = NNIEQuantizeFunc.apply(X, self.data_max)
         return X
 
+    def update_qparams(self):
+        data_max = torch.max(-self.activation_post_process.min_val, self.activation_post_process.max_val)
+        self.data_max = torch.max(data_max, self.data_max)
+
 
 class NNIEQuantizeFunc(torch.autograd.Function):
     @staticmethod
     def forward(ctx, x, data_max):
+        r"""Log-domain quantization with 16 steps per octave, 128 codes per sign below ``data_max``.
+
+        Values in [-2 ** ((z - 15) / 16), 2 ** ((z - 16) / 16)) become 0, the others get the code
+        clamp(round(16 * log2(|x|) - z), 0 or 1, 127). Computed in float32 in one buffer, returned in the
+        dtype of ``x``.
+        """
         z = (16 * torch.log2(data_max.double())).round() - 127
-        x = x.double()
-        pos_idx = x > 2 ** ((z - 16) / 16)
-        neg_idx = x < - 2 ** ((z + 1 - 16) / 16)
-        zero_idx = (x >= - 2 ** ((z + 1 - 16) / 16)) & (x < 2 ** ((z - 16) / 16))
-        x[zero_idx] = 0
-        x[pos_idx] = 2 ** ((torch.clamp(torch.round(16 * torch.log2(x[pos_idx]) - z), 0, 127) + z) / 16)
-        x[neg_idx] = - 2 ** ((torch.clamp(torch.round(16 * torch.log2(-x[neg_idx]) - z), 1, 127) + z) / 16)
-        x = x.float()
-        return x
+        pos_min, neg_max = 2 ** ((z - 16) / 16), -2 ** ((z - 15) / 16)
+        z = z.float()
+        neg = x < 0
+        zero = (x >= neg_max) & (x < pos_min)
+        out = x.abs().float()
+        out.log2_().mul_(16).sub_(z).round_()
+        out.clamp_(min=neg.float()).clamp_(max=127)
+        out.add_(z).div_(16).exp2_()
+        out.copysign_(x)
+        return out.masked_fill_(zero, 0).to(x.dtype)
 
     @staticmethod
     def backward(ctx, grad_output):
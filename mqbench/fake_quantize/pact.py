@@ -1,7 +1,7 @@
 import torch
 from torch.nn.parameter import Parameter
 
-from mqbench.fake_quantize.quantize_base import QuantizeBase
+from mqbench.fake_quantize.quantize_base import QuantizeBase, quantize_forward, _fake_quantize_per_tensor_affine
 
 
 class PACTFakeQuantize(QuantizeBase):
@@ -22,31 +22,28 @@ class PACTFakeQuantize(QuantizeBase):
                    self.quant_min, self.quant_max,
                    self.dtype, self.qscheme, self.ch_axis, self.alpha)
 
+    @quantize_forward
     def forward(self, X):
-        if self.observer_enabled[0] == 1:
+        if self._observer_enabled:
             self.activation_post_process(X.detach())
-            X = torch.where(X > self.alpha, self.alpha, X)
+            X = torch.where(X > self.alpha, self.alpha.to(X.dtype), X)
             self.activation_post_process.max_val.data.fill_(self.alpha.data[0])
             if X.min() < 0:
                 if self.is_symmetric_quant:
-                    X = torch.where(X < -self.alpha, -self.alpha, X)
+                    X = torch.where(X < -self.alpha, -self.alpha.to(X.dtype), X)
                     self.activation_post_process.min_val.data.fill_(-self.alpha[0].data)
                 else:
-                    X = torch.where(X < self.n_alpha, self.n_alpha, X)
+                    X = torch.where(X < self.n_alpha, self.n_alpha.to(X.dtype), X)
                     self.activation_post_process.min_val.data.fill_(self.n_alpha[0].data)
             else:
                 self.activation_post_process.min_val.data.fill_(0.)
 
-            _scale, _zero_point = self.activation_post_process.calculate_qparams()
-            _scale, _zero_point = _scale.to(self.scale.device), _zero_point.to(self.zero_point.device)
-            if self.scale.shape != _scale.shape:
-                self.scale.resize_(_scale.shape)
-                self.zero_point.resize_(_zero_point.shape)
-            self.scale.copy_(_scale)
-            self.zero_point.copy_(_zero_point)
-
-        if self.fake_quant_enabled[0] == 1:
-            X = torch.fake_quantize_per_tensor_affine(
-                X, self.scale.item(), int(self.zero_point.item()), self.quant_min, self.quant_max)
+            if not self.defer_qparams:
+                self.update_qparams()
+
+        if self._fake_quant_enabled:
+            X = self._fake_quantize(
+                _fake_quantize_per_tensor_affine, X, self.scale, self.zero_point, self.quant_min, self.quant_max,
+                self._exporting())
 
         return X
\ No newline at end of file
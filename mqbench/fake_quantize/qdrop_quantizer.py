@@ -1,7 +1,8 @@
 '''this is for activation quantizer in BRECQ and QDrop'''
 import torch
 from torch.nn.parameter import Parameter
-from mqbench.fake_quantize.quantize_base import QuantizeBase
+from mqbench.fake_quantize.quantize_base import QuantizeBase, quantize_forward
+from mqbench.utils import drop_mask
 
 
 class QDropFakeQuantize(QuantizeBase):
@@ -16,29 +17,36 @@ class QDropFakeQuantize(QuantizeBase):
         self.register_buffer('zero_point', torch.tensor([0], dtype=torch.int))
         self.prob = 1.0  # 1.0 means no drop;
 
+    def update_qparams(self):
+        _scale, _zero_point = self.calculate_qparams()
+        _scale, _zero_point = _scale.to(self.scale.device), _zero_point.to(self.zero_point.device)
+        if self.ch_axis != -1:
+            self.scale.data = torch.ones_like(_scale)
+            self.zero_point.resize_(_zero_point.shape)
+
+        self.scale.data.copy_(_scale)
+        self.zero_point.copy_(_zero_point)
+
+    @quantize_forward
     def forward(self, X):
-        if self.observer_enabled[0] == 1:
+        if self._observer_enabled:
             self.activation_post_process(X.detach())
-            _scale, _zero_point = self.calculate_qparams()
-            _scale, _zero_point = _scale.to(self.scale.device), _zero_point.to(self.zero_point.device)
-            if self.ch_axis != -1:
-                self.scale.data = torch.ones_like(_scale)
-                self.zero_point.resize_(_zero_point.shape)
-
-            self.scale.data.copy_(_scale)
-            self.zero_point.copy_(_zero_point)
+            if not self.defer_qparams:
+                self.update_qparams()
 
-        if self.fake_quant_enabled[0] == 1:
+        if self._fake_quant_enabled:
             x_orig = X
             if self.is_per_channel:
-                X = _fake_quantize_learnable_per_channel_affine_training(
+                X = self._fake_quantize(
+                    _fake_quantize_learnable_per_channel_affine_training,
                     X, self.scale, self.zero_point, self.ch_axis,
                     self.quant_min, self.quant_max)
             else:
-                X = _fake_quantize_learnable_per_tensor_affine_training(
+                X = self._fake_quantize(
+                    _fake_quantize_learnable_per_tensor_affine_training,
                     X, self.scale, self.zero_point, self.quant_min, self.quant_max)
             if self.prob < 1.0:
-                x_prob = torch.where(torch.rand_like(X) < self.prob, X, x_orig)
+                x_prob = torch.where(drop_mask(X, self.prob), X, x_orig)
                 return x_prob
         return X
 
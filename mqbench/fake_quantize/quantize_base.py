@@ -1,11 +1,113 @@
+import copy
+import functools
+
 import torch
 from torch.quantization import FakeQuantizeBase
 from torch.quantization.observer import MovingAverageMinMaxObserver
 from torch.quantization.fake_quantize import _is_per_channel, _is_per_tensor
 
-from mqbench.utils import is_symmetric_quant
+from mqbench.utils import is_symmetric_quant, is_tracing_state
+
+# (major, minor), so that torch 2.x is not taken for a release before 1.10
+_version_under_1100 = tuple(int(v) for v in torch.__version__.split('.')[:2]) < (1, 10)
+
+
+def _fake_quantize_per_tensor_affine(x, scale, zero_point, quant_min, quant_max, export=False):
+    r"""torch.fake_quantize_per_tensor_affine with tensor qparams, which does not wait for the device
+    to read scale / zero_point back. With ``export`` (see QuantizeBase.export_mode) the qparams are
+    still exported as constants.
+    """
+    if _version_under_1100 or export:
+        return torch.fake_quantize_per_tensor_affine(
+            x, scale.item(), int(zero_point.item()), quant_min, quant_max)
+    return torch.fake_quantize_per_tensor_affine(
+        x, scale.reshape(-1).float(), zero_point.reshape(-1).int(), quant_min, quant_max)
+
+
+_REDUCED_PRECISION = (torch.float16, torch.bfloat16)
+
+
+class _Float32FakeQuantize(torch.autograd.Function):
+    r"""``fn(x.float(), *args)`` cast back to the dtype of ``x``. Only ``x`` in its own dtype and the
+    tensor ``args`` are saved, the float32 graph of ``fn`` is rebuilt in backward.
+    """
+
+    @staticmethod
+    def forward(ctx, fn, x, *args):
+        ctx.fn = fn
+        ctx.tensor_idx = [i for i, arg in enumerate(args) if isinstance(arg, torch.Tensor)]
+        ctx.args = [None if isinstance(arg, torch.Tensor) else arg for arg in args]
+        ctx.save_for_backward(x, *[args[i] for i in ctx.tensor_idx])
+        return fn(x.float(), *args).to(x.dtype)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        x, *tensors = ctx.saved_tensors
+        args, inputs, positions = list(ctx.args), [], []
+        x_float = x.detach().float().requires_grad_(ctx.needs_input_grad[1])
+        if ctx.needs_input_grad[1]:
+            inputs.append(x_float)
+            positions.append(0)
+        for i, tensor in zip(ctx.tensor_idx, tensors):
+            args[i] = tensor.detach().requires_grad_(ctx.needs_input_grad[i + 2])
+            if ctx.needs_input_grad[i + 2]:
+                inputs.append(args[i])
+                positions.append(i + 1)
+        grads = [None] * (len(args) + 1)
+        if inputs:
+            with torch.enable_grad():
+                output = ctx.fn(x_float, *args)
+            for pos, grad in zip(positions, torch.autograd.grad(output, inputs, grad_output.float(), allow_unused=True)):
+                grads[pos] = grad
+        if grads[0] is not None:
+            grads[0] = grads[0].to(x.dtype)
+        return (None, *grads)
+
+
+def _call_in_float32(fn, x, *args):
+    r"""``fn(x, *args)`` for a fake quantize function ``fn``. A float16 / bfloat16 ``x`` is quantized in
+    float32, x / scale does not fit their mantissa, and the result is returned in the dtype of ``x``
+    without keeping a float32 copy of ``x`` for backward. scale / zero_point stay float32.
+    """
+    if x.dtype not in _REDUCED_PRECISION:
+        return fn(x, *args)
+    if not torch.is_grad_enabled():
+        return fn(x.float(), *args).to(x.dtype)
+    return _Float32FakeQuantize.apply(fn, x, *args)
+
+
+def group_view(x, group_size):
+    r"""``x`` as ``[-1, group_size]``, each row of ``x`` (``x[i]`` flattened) split in groups of
+    ``group_size`` consecutive elements. Per-channel quantization with ch_axis 0 on this view gives
+    one scale per group. Applying it to a tensor already in this shape is a no-op.
+    """
+    if x.dim() == 0 or (x.numel() // max(x.shape[0], 1)) % group_size != 0:
+        raise ValueError('Rows of a tensor of shape {} can not be split in groups of {}.'.format(
+            tuple(x.shape), group_size))
+    return x.reshape(-1, group_size)
+
+
+def quantize_forward(forward):
+    r"""Decorator for the forward of a QuantizeBase subclass. A group-wise quantizer (``group_size``) runs
+    ``forward`` on group_view(X), so its observer and qparams only see the grouped view, and the result is
+    reshaped back. With ``cache_output`` the result is reused while X and the qparams are unchanged.
+    """
+    @functools.wraps(forward)
+    def wrapper(self, X):
+        def run():
+            if self.group_size is None:
+                return forward(self, X)
+            return forward(self, group_view(X, self.group_size)).reshape(X.shape)
+        return self._cached((X, ), run)
+    return wrapper
+
+
+def cached_fake_quantize(fake_quant, sources, compute=None):
+    r"""``fake_quant(compute())`` through QuantizeBase.cached_forward when possible."""
+    if isinstance(fake_quant, QuantizeBase):
+        return fake_quant.cached_forward(sources, compute)
+    return fake_quant(sources[0] if compute is None else compute())
 
-_version_under_1100 = int(torch.__version__.split('.')[1]) < 10
 
 class QuantizeBase(FakeQuantizeBase):
     r""" This is an extension of the FakeQuantize module in fake_quantize.py, which
@@ -15,7 +117,7 @@ class QuantizeBase(FakeQuantizeBase):
     In addition to the attributes in the original FakeQuantize module, the _LearnableFakeQuantize
     module also includes the following attributes to support quantization parameter learning.
     """
-    def __init__(self, observer=MovingAverageMinMaxObserver, **observer_kwargs):
+    def __init__(self, observer=MovingAverageMinMaxObserver, group_size=None, **observer_kwargs):
         super().__init__()
         self.activation_post_process = observer(**observer_kwargs)
         self.dtype = self.activation_post_process.dtype
@@ -32,18 +134,162 @@ class QuantizeBase(FakeQuantizeBase):
             'Only per channel and per tensor quantization are supported in fake quantize' + \
             ' got qscheme: ' + str(self.qscheme)
         self.is_per_channel = _is_per_channel(self.qscheme)
+        # Quantize each row in groups of group_size elements, see group_view.
+        self.group_size = group_size
+        if group_size is not None:
+            assert self.is_per_channel and self.ch_axis == 0, \
+                'Group-wise quantization needs a per-channel qscheme with ch_axis 0.'
         bitrange = torch.tensor(self.quant_max - self.quant_min + 1).double()
         self.bitwidth = int(torch.log2(bitrange).item())
         self.is_symmetric_quant = is_symmetric_quant(self.qscheme)
+        # Only feed the observer in forward, qparams are computed by update_qparams
+        # (see mqbench.utils.state.finalize_calibration).
+        self.defer_qparams = False
+        # Python mirrors of the observer_enabled / fake_quant_enabled buffers, so that forward
+        # can check them without reading the buffers back from the device.
+        self._observer_enabled = True
+        self._fake_quant_enabled = True
+        # Take the traceable path of forward, for ONNX export, see mqbench.utils.state.enable_export_mode
+        # and _exporting.
+        self.export_mode = False
+        # Reuse the output for an unchanged input, see cached_forward.
+        self.cache_output = False
+        self._cache = None
+        # bit width -> (quant_min, quant_max, scale, zero_point), see precompute_bitwidths.
+        self._bitwidth_qparams = {}
+        self._origin_qparams = None
+
+    def cached_forward(self, sources, compute=None):
+        r"""``self(compute())``, or ``self(sources[0])`` without ``compute``. With ``cache_output`` the
+        result is kept and returned again as long as the tensors in ``sources``, the parameters and
+        buffers of this quantizer are not replaced or modified in place. It is only used without
+        the observer and autograd, e.g. for the weights in evaluation or activation calibration.
+
+        In place writes through ``.data`` are not seen, call clear_cache after them.
+        """
+        return self._cached(sources, lambda: self(sources[0] if compute is None else compute()))
+
+    def _cached(self, sources, run):
+        if not self.cache_output or self._observer_enabled or torch.is_grad_enabled() or self._exporting():
+            if self._cache is not None:
+                self.clear_cache()
+            return run()
+        if self._cache is None or self._cache[0] != self._state_key(sources):
+            output = run()
+            # some forwards normalize their qparams in place, so the key is taken afterwards
+            self._cache = (self._state_key(sources), output)
+        return self._cache[1]
+
+    def _exporting(self):
+        r"""Whether forward takes its traceable path: in export mode, or when the model is traced
+        directly, e.g. by torch.onnx.export outside convert_deploy."""
+        return self.export_mode or is_tracing_state()
+
+    def _fake_quantize(self, fn, X, *args):
+        r"""_call_in_float32(fn, X, *args), or ``fn(X, *args)`` while exporting so that only the
+        symbolic of ``fn`` is traced."""
+        if self._exporting():
+            return fn(X, *args)
+        return _call_in_float32(fn, X, *args)
+
+    def normalize_qparams(self):
+        r"""Write the scale / zero_point forward actually uses back into the parameters, for the
+        quantizers which only project them in forward (e.g. a positive scale)."""
+        pass
+
+    def _state_key(self, sources):
+        tensors = list(sources) + list(self.parameters(recurse=False)) + list(self.buffers(recurse=False))
+        return [(t.data_ptr(), t._version) for t in tensors if t is not None]
+
+    def clear_cache(self):
+        self._cache = None
+
+    @torch.jit.export
+    def enable_fake_quant(self, enabled: bool = True) -> None:
+        self.fake_quant_enabled[0] = 1 if enabled else 0
+        self._fake_quant_enabled = enabled
+        self.clear_cache()
+
+    @torch.jit.export
+    def enable_observer(self, enabled: bool = True) -> None:
+        self.observer_enabled[0] = 1 if enabled else 0
+        self._observer_enabled = enabled
+        self.clear_cache()
+
+    def refresh_enabled_flags(self):
+        r"""Re-read the Python mirrors after observer_enabled / fake_quant_enabled were written directly."""
+        self._observer_enabled = bool(self.observer_enabled[0] == 1)
+        self._fake_quant_enabled = bool(self.fake_quant_enabled[0] == 1)
+
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict,
+                              missing_keys, unexpected_keys, error_msgs):
+        super(QuantizeBase, self)._load_from_state_dict(state_dict, prefix, local_metadata, strict,
+                                                        missing_keys, unexpected_keys, error_msgs)
+        self.refresh_enabled_flags()
+        self.clear_cache()
 
     @torch.jit.export
     def calculate_qparams(self):
         return self.activation_post_process.calculate_qparams()
 
+    def update_qparams(self):
+        r"""Copy the qparams of the observer into scale / zero_point."""
+        _scale, _zero_point = self.calculate_qparams()
+        _scale, _zero_point = _scale.to(self.scale.device), _zero_point.to(self.zero_point.device)
+        if self.scale.shape != _scale.shape:
+            self.scale.resize_(_scale.shape)
+            self.zero_point.resize_(_zero_point.shape)
+        self.scale.copy_(_scale)
+        self.zero_point.copy_(_zero_point)
+
+    def precompute_bitwidths(self, bitwidths, X):
+        r"""Observe ``X`` once for every bit width in ``bitwidths``, each time with a copy of the
+        observer as it is now, and keep the qparams so that select_bitwidth only switches to them.
+        Signed ranges are used for symmetric quantization, as in mqbench.mix_precision.
+        """
+        self.normalize_qparams()
+        self._origin_qparams = (self.bitwidth, self.quant_min, self.quant_max,
+                                self.scale.detach().clone(), self.zero_point.detach().clone())
+        self._bitwidth_qparams = {}
+        for bits in bitwidths:
+            if self.is_symmetric_quant:
+                quant_min, quant_max = -2 ** (bits - 1), 2 ** (bits - 1) - 1
+            else:
+                quant_min, quant_max = 0, 2 ** bits - 1
+            observer = copy.deepcopy(self.activation_post_process)
+            observer.quant_min, observer.quant_max = quant_min, quant_max
+            observer(X.detach() if self.group_size is None else group_view(X.detach(), self.group_size))
+            scale, zero_point = observer.calculate_qparams()
+            self._bitwidth_qparams[bits] = (quant_min, quant_max, scale.to(self.scale.device),
+                                            zero_point.to(self.zero_point.device))
+
+    def select_bitwidth(self, bits):
+        r"""Quantize with the range and qparams of ``bits`` computed by precompute_bitwidths."""
+        self._set_bitwidth(bits, *self._bitwidth_qparams[bits])
+
+    def restore_bitwidth(self):
+        r"""Go back to the bit width and qparams from before precompute_bitwidths."""
+        if self._origin_qparams is not None:
+            self._set_bitwidth(*self._origin_qparams)
+            self._origin_qparams = None
+
+    def _set_bitwidth(self, bits, quant_min, quant_max, scale, zero_point):
+        self.bitwidth = bits
+        self.quant_min = self.activation_post_process.quant_min = quant_min
+        self.quant_max = self.activation_post_process.quant_max = quant_max
+        with torch.no_grad():
+            if self.scale.shape != scale.shape:
+                # through .data, the learnable quantizers keep them as Parameter
+                self.scale.data = self.scale.new_empty(scale.shape)
+                self.zero_point.data = self.zero_point.new_empty(zero_point.shape)
+            self.scale.copy_(scale)
+            self.zero_point.copy_(zero_point)
+        self.clear_cache()
+
     @torch.jit.export
     def extra_repr(self):
         return 'fake_quant_enabled={}, observer_enabled={}, ' \
-               'quant_min={}, quant_max={}, dtype={}, qscheme={}, ch_axis={}, '.format(
+               'quant_min={}, quant_max={}, dtype={}, qscheme={}, ch_axis={}, group_size={}'.format(
                    self.fake_quant_enabled, self.observer_enabled,
                    self.quant_min, self.quant_max,
-                   self.dtype, self.qscheme, self.ch_axis)
+                   self.dtype, self.qscheme, self.ch_axis, self.group_size)
@@ -1,7 +1,7 @@
 import torch
 
-from mqbench.fake_quantize.quantize_base import QuantizeBase
-from mqbench.utils import is_symmetric_quant
+from mqbench.fake_quantize.quantize_base import QuantizeBase, quantize_forward
+from mqbench.utils import is_symmetric_quant, no_jit_trace
 
 
 class TqtFakeQuantize(QuantizeBase):
@@ -15,6 +15,7 @@ class TqtFakeQuantize(QuantizeBase):
 
     @torch.jit.export
     def extra_repr(self):
+        self.normalize_qparams()
         return 'fake_quant_enabled={}, observer_enabled={}, ' \
                'quant_min={}, quant_max={}, dtype={}, qscheme={}, ch_axis={}, ' \
                'scale={}, zero_point={}'.format(
@@ -23,31 +24,59 @@ class TqtFakeQuantize(QuantizeBase):
                    self.dtype, self.qscheme, self.ch_axis, self.scale if self.ch_axis == -1 else 'List',
                    self.zero_point if self.ch_axis == -1 else 'List')
 
+    def update_qparams(self):
+        _scale, _zero_point = self.activation_post_process.calculate_qparams()
+        _scale = _scale.to(self.scale.device)
+        _zero_point = _zero_point.to(self.zero_point.device)
+
+        if self.ch_axis != -1:
+            self.scale.data = torch.ones_like(_scale)
+            self.zero_point.data = torch.zeros_like(_zero_point.float())
+
+        self.scale.data.copy_(_scale)
+        self.zero_point.data.copy_(_zero_point.float())
+
+    def _qparams(self):
+        r"""scale / zero_point as forward uses them: a positive scale and a zero zero_point, see
+        LearnableFakeQuantize._qparams."""
+        if self._exporting():
+            with no_jit_trace():
+                self.normalize_qparams()
+            return self.scale, self.zero_point
+        return self._projected_qparams()
+
+    def _projected_qparams(self):
+        scale = self.scale if self._observer_enabled else self.scale.abs().clamp(min=self.eps)
+        return scale, torch.zeros_like(self.zero_point)
+
+    @torch.jit.ignore
+    def normalize_qparams(self):
+        with torch.no_grad():
+            scale, zero_point = self._projected_qparams()
+            self.scale.copy_(scale)
+            self.zero_point.copy_(zero_point)
+
+    def _save_to_state_dict(self, destination, prefix, keep_vars):
+        # checkpoints hold the qparams forward uses
+        self.normalize_qparams()
+        super(TqtFakeQuantize, self)._save_to_state_dict(destination, prefix, keep_vars)
+
+    @quantize_forward
     def forward(self, X):
         # Learnable fake quantize have to zero_point.float() to make it learnable.
-        if self.observer_enabled[0] == 1:
+        if self._observer_enabled:
             self.activation_post_process(X.detach())
-            _scale, _zero_point = self.activation_post_process.calculate_qparams()
-            _scale = _scale.to(self.scale.device)
-            _zero_point = _zero_point.to(self.zero_point.device)
+            if not self.defer_qparams:
+                self.update_qparams()
 
-            if self.ch_axis != -1:
-                self.scale.data = torch.ones_like(_scale)
-                self.zero_point.data = torch.zeros_like(_zero_point.float())
-
-            self.scale.data.copy_(_scale)
-            self.zero_point.data.copy_(_zero_point.float())
-        else:
-            self.scale.data.abs_()
-            self.scale.data.clamp_(min=self.eps.item())
-
-        if self.fake_quant_enabled[0] == 1:
+        if self._fake_quant_enabled:
             assert is_symmetric_quant(self.qscheme)
             "TQT is a symmetric quantization FakeQuantize Op."
-            self.zero_point.data.zero_()
             assert self.is_per_channel is False
             "TQT is a per-tensor quantization FakeQuantize Op."
-            X = FakeQuantizeTqtAffine.apply(X, self.scale, self.zero_point, self.quant_min, self.quant_max, self.mth)
+            scale, zero_point = self._qparams()
+            X = self._fake_quantize(FakeQuantizeTqtAffine.apply, X, scale, zero_point, self.quant_min,
+                                    self.quant_max, self.mth)
         return X
 
     def set_quant_type(self, quant_type):
@@ -85,32 +114,28 @@ def scale_round(t):
 def scale_floor_ceil(t):
     return (torch.where((t < 0) & (t - t.floor() == 0.5), t.ceil(), t.round()) - t).detach() + t
 
-def _t(x, t):
-    return torch.tensor(x).type_as(t)
-
 class FakeQuantizeTqtAffine(torch.autograd.Function):
     @staticmethod
     def forward(ctx, x, scale, zero_point, quant_min, quant_max, mth):
         qx = _fake_quantize_tqt_affine_training(x, scale, zero_point, quant_min, quant_max, mth)
-        ctx.save_for_backward(x, scale, _t(quant_min, x), _t(quant_max, x))
+        ctx.save_for_backward(x, scale)
+        ctx.quant_min, ctx.quant_max = int(quant_min), int(quant_max)
         return qx
 
     @staticmethod
     def backward(ctx, grad_outputs):
-        x, s, qmin, qmax = ctx.saved_tensors
-        scaled_x = x / s
-        rounded_scaled_x = torch.where(
-            (scaled_x < 0) & (scaled_x - torch.floor(scaled_x) == 0.5),
-            torch.ceil(scaled_x), torch.round(scaled_x)
-        )
-
-        is_lt_min = rounded_scaled_x < qmin
-        is_gt_max = rounded_scaled_x > qmax
-        is_ge_min_and_le_max = ~is_lt_min & ~is_gt_max
-
-        grad_x = grad_outputs.clone()
-        grad_x = torch.where(is_ge_min_and_le_max, grad_x, 0 * grad_x)
-        return grad_x.to(grad_outputs.device), None, None, None, None, None
+        x, s = ctx.saved_tensors
+        # round(x / s), with negative halves rounded up, is in [quant_min <= 0, quant_max] iff
+        # x / s >= quant_min - 0.5 and x / s < quant_max + 0.5, or == quant_max + 0.5 when
+        # quant_max is even (round half to even). The float mask is built in the gradient buffer.
+        grad_x = x / s
+        is_ge_min = grad_x >= ctx.quant_min - 0.5
+        if ctx.quant_max % 2 == 0:
+            grad_x.le_(ctx.quant_max + 0.5)
+        else:
+            grad_x.lt_(ctx.quant_max + 0.5)
+        grad_x.mul_(is_ge_min).mul_(grad_outputs)
+        return grad_x, None, None, None, None, None
 
     @staticmethod
     def symbolic(g, x, scale, zero_point, quant_min, quant_max, mth):
@@ -1,10 +1,11 @@
 from typing import List, Tuple
 
+import numpy as np
+import torch
 from torch.nn import Module
 
 from mqbench.mix_precision.hessian_per_layer import hessian_per_layer
 from mqbench.prepare_by_platform import BackendType, prepare_by_platform
-from mqbench.utils import is_symmetric_quant
 from mqbench.utils.logger import logger
 from mqbench.utils.state import disable_all
 
@@ -49,35 +50,47 @@ def mixprecision_profiling(model: Module, quantized_model: Module, bitwidth_list
     return sensetive_dict
 
 
-def get_delta_w(quantized_model: Module, bitwidth_list: List):
-    def get_new_qrange(bits, qscheme):
-        if is_symmetric_quant(qscheme):
-            return -2 ** (bits - 1), 2 ** (bits - 1) - 1
-        return 0, 2 ** bits - 1
+def _weight_quantizers(quantized_model: Module):
+    return {name: mod for name, mod in quantized_model.named_modules() if hasattr(mod, 'weight_fake_quant')}
+
+
+def _disable_all_quietly(quantized_model: Module):
+    logger.setLevel('CRITICAL')
+    disable_all(quantized_model)
+    logger.setLevel('INFO')
+
+
+def _weight_quantizer_inputs(quantized_model: Module, weight_quantizers, input_data):
+    """What every weight fake quantizer sees in a forward, e.g. the bn folded weight of conv-bn."""
+    inputs, handles = {}, []
+    for name, mod in weight_quantizers.items():
+        handles.append(mod.weight_fake_quant.register_forward_pre_hook(
+            lambda module, inp, name=name: inputs.__setitem__(name, inp[0].detach())))
+    with torch.no_grad():
+        quantized_model(input_data)
+    for handle in handles:
+        handle.remove()
+    return inputs
 
+
+def get_delta_w(quantized_model: Module, bitwidth_list: List):
     def square_mean(ta, tb):
         return torch.pow((ta - tb), 2.0).mean().detach().cpu().numpy()
 
     delta_w = {}
-    for name, mod in quantized_model.named_modules():
-        logger.setLevel('CRITICAL')
-        disable_all(quantized_model)
-        logger.setLevel('INFO')
-        if hasattr(mod, 'weight_fake_quant'):
-            delta_w[name] = []
-            mod.weight_fake_quant.enable_observer()
-            mod.weight_fake_quant.enable_fake_quant()
+    _disable_all_quietly(quantized_model)
+    for name, mod in _weight_quantizers(quantized_model).items():
+        fake_quant = mod.weight_fake_quant
+        fake_quant.precompute_bitwidths(bitwidth_list, mod.weight)
+        fake_quant.enable_fake_quant()
+        delta_w[name] = []
+        with torch.no_grad():
             for bits in bitwidth_list:
-                qscheme = mod.weight_fake_quant.activation_post_process.qscheme
-                new_quant_min, new_quant_max = get_new_qrange(bits, qscheme)
-                mod.weight_fake_quant.activation_post_process.quant_min = new_quant_min
-                mod.weight_fake_quant.activation_post_process.quant_max = new_quant_max
-                mod.weight_fake_quant.quant_min = new_quant_min
-                mod.weight_fake_quant.quant_max = new_quant_max
-                delta_w[name].append(square_mean(mod.weight, mod.weight_fake_quant(mod.weight)))
-            delta_w[name] = np.array(delta_w[name])
-            mod.weight_fake_quant.disable_observer()
-            mod.weight_fake_quant.disable_fake_quant()
+                fake_quant.select_bitwidth(bits)
+                delta_w[name].append(square_mean(mod.weight, fake_quant(mod.weight)))
+        delta_w[name] = np.array(delta_w[name])
+        fake_quant.restore_bitwidth()
+        fake_quant.disable_fake_quant()
 
     return delta_w
 
@@ -115,39 +128,30 @@ def mp_model_size(model: Module):
 def prec_degradation_by_layer(model: Module, quantized_model: Module, bitwidth_list: List, data: Tuple, creterion):
     """
     Calculate degradation of each layer in different bitwidth.
+    The weight qparams of every bit width are computed once up front, the sweep only switches them.
     """
-    def get_new_qrange(bits, qscheme):
-        if is_symmetric_quant(qscheme):
-            return -2 ** (bits - 1), 2 ** (bits - 1) - 1
-        return 0, 2 ** bits - 1
-
     input_data, label_data = data
     sensetive_dict = {}
     output_data = model(input_data)
     fp_loss = creterion(output_data, label_data)
 
-    for name, mod in quantized_model.named_modules():
-        logger.setLevel('CRITICAL')
-        disable_all(quantized_model)
-        logger.setLevel('INFO')
-        if hasattr(mod, 'weight_fake_quant'):
-            sensetive_dict[name] = []
-            mod.weight_fake_quant.enable_observer()
-            mod.weight_fake_quant.enable_fake_quant()
-            for bits in bitwidth_list:
-                qscheme = mod.weight_fake_quant.activation_post_process.qscheme
-                new_quant_min, new_quant_max = get_new_qrange(bits, qscheme)
-                mod.weight_fake_quant.activation_post_process.quant_min = new_quant_min
-                mod.weight_fake_quant.activation_post_process.quant_max = new_quant_max
-                mod.weight_fake_quant.quant_min = new_quant_min
-                mod.weight_fake_quant.quant_max = new_quant_max
-                with torch.no_grad():
-                    output_data = quantized_model(input_data)
-                loss = creterion(output_data, label_data)
-                sensetive_dict[name].append(loss - fp_loss)
-                logger.info("Layer {} under bit {} with sensetive {}".format(name, bits, loss - fp_loss))
-            mod.weight_fake_quant.disable_observer()
-            mod.weight_fake_quant.disable_fake_quant()
+    _disable_all_quietly(quantized_model)
+    weight_quantizers = _weight_quantizers(quantized_model)
+    weight_inputs = _weight_quantizer_inputs(quantized_model, weight_quantizers, input_data)
+    for name, mod in weight_quantizers.items():
+        mod.weight_fake_quant.precompute_bitwidths(bitwidth_list, weight_inputs[name])
+    for name, mod in weight_quantizers.items():
+        sensetive_dict[name] = []
+        mod.weight_fake_quant.enable_fake_quant()
+        for bits in bitwidth_list:
+            mod.weight_fake_quant.select_bitwidth(bits)
+            with torch.no_grad():
+                output_data = quantized_model(input_data)
+            loss = creterion(output_data, label_data)
+            sensetive_dict[name].append(loss - fp_loss)
+            logger.info("Layer {} under bit {} with sensetive {}".format(name, bits, loss - fp_loss))
+        mod.weight_fake_quant.restore_bitwidth()
+        mod.weight_fake_quant.disable_fake_quant()
 
     return sensetive_dict
 
@@ -228,8 +232,6 @@ def ILP_bit_selection(bitwidth_list, sensetive_dict, layer_parameters_dict, mode
 
 
 if __name__ == '__main__':
-    import numpy as np
-    import torch
     import torchvision
 
     model = torchvision.models.resnet18(pretrained=True).eval()
@@ -14,6 +14,7 @@ from typing import TypeVar
 
 import mqbench.nn.qat as qnnqat
 from mqbench.quantization.default_bias_fake_quant import bias_fake_quantizer
+from mqbench.fake_quantize.quantize_base import cached_fake_quantize
 
 _BN_CLASS_MAP = {
     1: nn.BatchNorm1d,
@@ -104,7 +105,10 @@ class _ConvBnNd(nn.modules.conv._ConvNd, _FusedModule):
         weight_shape[0] = -1
         bias_shape = [1] * len(self.weight.shape)
         bias_shape[1] = -1
-        scaled_weight = self.weight_fake_quant(self.weight * scale_factor.reshape(weight_shape))
+        # the scaled weight only changes with the weight and the bn statistics
+        scaled_weight = cached_fake_quantize(
+            self.weight_fake_quant, (self.weight, self.bn.weight, self.bn.running_var),
+            lambda: self.weight * scale_factor.reshape(weight_shape))
         # using zero bias here since the bias for original conv
         # will be added later
         if self.bias is not None:
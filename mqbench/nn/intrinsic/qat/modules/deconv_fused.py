@@ -12,6 +12,7 @@ from typing import TypeVar
 
 import mqbench.nn.intrinsic as qnni
 import mqbench.nn.qat as qnnqat
+from mqbench.fake_quantize.quantize_base import cached_fake_quantize
 
 
 _BN_CLASS_MAP = {
@@ -120,7 +121,10 @@ class _ConvTransposeBnNd(nn.modules.conv._ConvTransposeNd, _FusedModule):
         weight_shape[1] = -1
         bias_shape = [1] * len(self.weight.shape)
         bias_shape[1] = -1
-        scaled_weight = self.weight_fake_quant(self.weight * scale_factor.reshape(weight_shape))
+        # the scaled weight only changes with the weight and the bn statistics
+        scaled_weight = cached_fake_quantize(
+            self.weight_fake_quant, (self.weight, self.bn.weight, self.bn.running_var),
+            lambda: self.weight * scale_factor.reshape(weight_shape))
         # using zero bias here since the bias for original conv
         # will be added later
         if self.bias is not None:
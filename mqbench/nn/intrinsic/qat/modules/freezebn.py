@@ -9,6 +9,7 @@ from torch.nn.parameter import Parameter
 from typing import TypeVar
 import mqbench.nn.intrinsic as qnni
 from mqbench.nn.modules import FrozenBatchNorm2d
+from mqbench.fake_quantize.quantize_base import cached_fake_quantize
 from .deconv_fused import _ConvTransposeBnNd
 
 MOD = TypeVar('MOD', bound=nn.modules.conv._ConvNd)
@@ -93,7 +94,10 @@ class _ConvFreezebnNd(nn.modules.conv._ConvNd, nni._FusedModule):
         weight_shape[0] = -1
         bias_shape = [1] * len(self.weight.shape)
         bias_shape[1] = -1
-        scaled_weight = self.weight_fake_quant(self.weight * scale_factor.reshape(weight_shape))
+        # the scaled weight only changes with the weight and the bn statistics
+        scaled_weight = cached_fake_quantize(
+            self.weight_fake_quant, (self.weight, self.bn.weight, self.bn.running_var),
+            lambda: self.weight * scale_factor.reshape(weight_shape))
         # using zero bias here since the bias for original conv
         # will be added later
         if self.bias is not None:
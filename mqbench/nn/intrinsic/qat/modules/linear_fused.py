@@ -9,6 +9,7 @@ from torch.nn.intrinsic import _FusedModule
 from torch.nn.parameter import Parameter
 
 from mqbench.nn.intrinsic import LinearBn1d
+from mqbench.fake_quantize.quantize_base import cached_fake_quantize
 
 
 class LinearBn1d(Linear, _FusedModule):
@@ -90,7 +91,10 @@ class LinearBn1d(Linear, _FusedModule):
         weight_shape[0] = -1
         bias_shape = [1] * len(input.shape)
         bias_shape[1] = -1
-        scaled_weight = self.weight_fake_quant(self.weight * scale_factor.reshape(weight_shape))
+        # the scaled weight only changes with the weight and the bn statistics
+        scaled_weight = cached_fake_quantize(
+            self.weight_fake_quant, (self.weight, self.bn.weight, self.bn.running_var),
+            lambda: self.weight * scale_factor.reshape(weight_shape))
         # using zero bias here since the bias for original Linear
         # will be added later
         # Linear layer takes permuted input since the format is (batch_size, *, in_features)
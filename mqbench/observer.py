@@ -4,10 +4,139 @@ from typing import Tuple
 import torch
 from torch.quantization.observer import _ObserverBase
 
-from mqbench.fake_quantize.quantize_base import _version_under_1100 
-from mqbench.utils import sync_tensor, pot_quantization, is_symmetric_quant
+from mqbench.fake_quantize.quantize_base import _REDUCED_PRECISION, _version_under_1100, _fake_quantize_per_tensor_affine
+from mqbench.utils import sync_tensor, pot_quantization, is_symmetric_quant, aminmax
 from mqbench.utils.logger import logger
 from mqbench.utils.hook import PerChannelLoadHook
+from mqbench.utils.moments import Moments
+
+
+def _fake_quantize_affine(x, scale, zero_point, quant_min, quant_max):
+    r"""Fake quantize ``x`` with broadcastable ``scale`` / ``zero_point`` tensors.
+
+    Follows the arithmetic of ``torch.fake_quantize_per_tensor_affine``, i.e. multiply by the
+    float32 reciprocal of scale and round half to even, so it gives the same result on each slice.
+    """
+    x_q = x * (1.0 / scale)
+    x_q.round_().add_(zero_point).clamp_(quant_min, quant_max).sub_(zero_point).mul_(scale)
+    return x_q
+
+
+def _batched_lp_search(observer, x, x_min, x_max, iter, p=2.0, ch_axis=-1, chunk_numel=2 ** 24):
+    r"""Search the shrink ratio of ``[x_min, x_max]`` scoring all candidates in batches.
+
+    Gives the same result as the candidate loop of ``MSEObserver.mse`` (ch_axis == -1) and
+    ``MSEObserver.mse_perchannel``, without per-candidate host syncs. At most about ``chunk_numel``
+    elements are quantized at once, so the temporary memory is bounded whatever the size of ``x``.
+    """
+    ratio = torch.tensor([1.0 - (i * 0.01) for i in range(iter)], dtype=x_min.dtype, device=x_min.device)
+    ratio = ratio.reshape([-1] + [1] * x_min.dim())
+    cand_min, cand_max = x_min.unsqueeze(0) * ratio, x_max.unsqueeze(0) * ratio
+    scale, zero_point = observer._calculate_qparams(cand_min, cand_max)
+    if ch_axis == -1:
+        x_flat = x.reshape(-1)
+        numel = x_flat.numel()
+        step = min(numel, chunk_numel)
+        cand_step = max(1, chunk_numel // step)
+        score = torch.zeros(iter, dtype=scale.dtype, device=x.device)
+        for i in range(0, iter, cand_step):
+            _scale, _zero_point = scale[i:i + cand_step, None], zero_point[i:i + cand_step, None]
+            for start in range(0, numel, step):
+                x_part = x_flat[start:start + step].unsqueeze(0).to(scale.dtype)
+                x_q = _fake_quantize_affine(x_part, _scale, _zero_point, observer.quant_min, observer.quant_max)
+                score[i:i + cand_step] += x_q.sub_(x_part).abs_().pow_(p).sum(1)
+        best = torch.argmin(score / numel)
+        return cand_min[best], cand_max[best]
+    x = x.to(scale.dtype)
+    qparam_shape = [-1] + [1] * x.dim()
+    qparam_shape[ch_axis + 1] = x.shape[ch_axis]
+    reduce_dim = tuple([i + 1 for i in range(x.dim()) if i != ch_axis])
+    cand_step = max(1, chunk_numel // max(1, x.numel()))
+    score = []
+    for i in range(0, iter, cand_step):
+        _scale = scale[i:i + cand_step].reshape(qparam_shape)
+        _zero_point = zero_point[i:i + cand_step].reshape(qparam_shape)
+        x_q = _fake_quantize_affine(x.unsqueeze(0), _scale, _zero_point, observer.quant_min, observer.quant_max)
+        score.append(x_q.sub_(x.unsqueeze(0)).abs_().pow_(p).mean(reduce_dim))
+    best = torch.argmin(torch.cat(score), dim=0).unsqueeze(0)
+    return cand_min.gather(0, best).squeeze(0), cand_max.gather(0, best).squeeze(0)
+
+
+def _pot_scale_search(x, min_val, max_val, quant_min, quant_max, quant_type, chunk_numel=2 ** 24):
+    r"""Vitis power-of-two scale search over ``x``. Returns the exponent ``s`` (scale ``2 ** -s``)
+    with the least squared error, scoring all candidate exponents in one pass over chunks of
+    about ``chunk_numel`` elements, so ``x`` does not need to be kept until ``calculate_qparams``.
+    """
+    scale_range = 1 if quant_type == 'input' else 5
+    mth = 3 if quant_type == 'param' else 2
+    scale = torch.max(min_val / quant_min, max_val / quant_max)
+    if scale < 2 ** -15:
+        max_scale = 0
+    else:
+        max_scale = int(torch.floor((1 / scale).log2()))
+    factor = 2. ** torch.arange(max_scale, max_scale + scale_range, dtype=min_val.dtype, device=x.device).unsqueeze(1)
+    x = x.reshape(-1)
+    step = min(x.numel(), max(1, chunk_numel // scale_range))
+    loss = torch.zeros(scale_range, dtype=min_val.dtype, device=x.device)
+    for start in range(0, x.numel(), step):
+        x_part = x[start:start + step].unsqueeze(0).to(min_val.dtype)
+        if mth == 3:
+            new_x = torch.clamp(torch.round(x_part * factor), quant_min, quant_max)
+        else:
+            new_x = torch.clamp(x_part * factor, quant_min, quant_max)
+            new_x = torch.where((new_x < 0) & (new_x - new_x.floor() == 0.5), new_x.ceil(), new_x.round())
+        loss += ((new_x / factor - x_part) ** 2).sum(1)
+    final_scale = max_scale + int(torch.argmin(loss))
+    return min(final_scale, 12)
+
+
+def _channel_reduce_dims(x, ch_axis):
+    return tuple([i for i in range(x.dim()) if i != ch_axis])
+
+
+def _channel_aminmax(x, ch_axis):
+    r"""Per-channel min / max of ``x`` without a permuted copy.
+
+    Uses a single ``aminmax`` pass when the channel axis is outermost or innermost in memory
+    (e.g. OIHW weights or channels_last activations), otherwise ``amin`` / ``amax`` directly
+    over the reduce dims.
+    """
+    num_channels = x.shape[ch_axis]
+    y = x.movedim(ch_axis, -1)
+    if y.is_contiguous():
+        return aminmax(y.reshape(-1, num_channels), 0)
+    y = x.movedim(ch_axis, 0)
+    if y.is_contiguous():
+        return aminmax(y.reshape(num_channels, -1), 1)
+    reduce_dim = _channel_reduce_dims(x, ch_axis)
+    return torch.amin(x, reduce_dim), torch.amax(x, reduce_dim)
+
+
+def _observed(x_orig, dtype):
+    r"""``x_orig`` detached. float16 / bfloat16 inputs stay as they are, min / max are exact in any
+    float dtype and the searches upcast them chunk by chunk. Other inputs are cast to ``dtype``.
+    """
+    x = x_orig.detach()
+    return x if x.dtype in _REDUCED_PRECISION else x.to(dtype)
+
+
+def _observed_aminmax(x, ch_axis, dtype):
+    r"""Min / max of ``x`` (per channel unless ``ch_axis`` is -1) in the ``dtype`` of the observer state."""
+    min_val, max_val = aminmax(x) if ch_axis == -1 else _channel_aminmax(x, ch_axis)
+    return min_val.to(dtype), max_val.to(dtype)
+
+
+def _ema_update(running, current, ema_ratio):
+    r"""Moving average of ``running`` and ``current``, which starts from ``current`` while ``running``
+    still holds its initial inf. Written without a data-dependent branch, so torch.compile traces it.
+    """
+    return torch.where(running.isinf(), current, running * ema_ratio + current * (1.0 - ema_ratio))
+
+
+def _channel_abs_mean(x, ch_axis):
+    r"""Per-channel ``|x|.mean()`` as an L1 norm, without a full-size ``abs`` temporary."""
+    norm = torch.norm(x, p=1, dim=_channel_reduce_dims(x, ch_axis), dtype=torch.float)
+    return norm / (x.numel() // x.shape[ch_axis])
 
 
 class ObserverBase(_ObserverBase):
@@ -77,6 +206,13 @@ class ObserverBase(_ObserverBase):
                 quant_min, quant_max = 0, 15
         return quant_min, quant_max
 
+    def sync_state(self):
+        r"""Merge the statistics over ranks, driven by ``mqbench.utils.sync_observers``.
+
+        A generator yielding lists of (tensor, op) to reduce and receiving the reduced tensors.
+        """
+        self.min_val, self.max_val = yield [(self.min_val, 'min'), (self.max_val, 'max')]
+
     @torch.jit.export
     def extra_repr(self):
         return "min_val={}, max_val={} ch_axis={} pot={}".format(self.min_val if self.ch_axis == -1 else 'List',
@@ -99,17 +235,8 @@ class MinMaxObserver(ObserverBase):
         r"""Records the running minimum and maximum of ``x``."""
         if x_orig.numel() == 0:
             return x_orig
-        x = x_orig.to(self.min_val.dtype)
-        if self.ch_axis == -1:
-            min_val_cur, max_val_cur = torch._aminmax(x)
-        else:
-            x_dim = x.size()
-            new_axis_list = [i for i in range(len(x_dim))]
-            new_axis_list[self.ch_axis] = 0
-            new_axis_list[0] = self.ch_axis
-            y = x.permute(new_axis_list)
-            y = torch.flatten(y, start_dim=1)
-            min_val_cur, max_val_cur = torch._aminmax(y, 1)
+        x = _observed(x_orig, self.min_val.dtype)
+        min_val_cur, max_val_cur = _observed_aminmax(x, self.ch_axis, self.min_val.dtype)
         self.min_val = torch.min(self.min_val, min_val_cur)
         self.max_val = torch.max(self.max_val, max_val_cur)
 
@@ -123,7 +250,7 @@ class MinMaxFloorObserver(ObserverBase):
 
     def __init__(self, dtype=torch.quint8, qscheme=torch.per_tensor_affine,
                  reduce_range=False, quant_min=None, quant_max=None, ch_axis=-1, pot_scale=False,
-                 factory_kwargs=None):
+                 chunk_numel=2 ** 24, factory_kwargs=None):
         super(MinMaxFloorObserver, self).__init__(dtype, qscheme, reduce_range, quant_min, quant_max,
                                                   ch_axis, pot_scale, factory_kwargs)
         '''
@@ -132,55 +259,42 @@ class MinMaxFloorObserver(ObserverBase):
         mth is 2, 3, 2
         '''
         self.quant_type = None
+        self.chunk_numel = chunk_numel
+        self.pot_exp = None
+        if ch_axis != -1:
+            logger.warn('The per-tensor observer does not support per-channel min-max!')
 
 
     def forward(self, x_orig):
-        r"""Records the running minimum and maximum of ``x``."""
+        r"""Records the minimum and maximum of ``x`` and its best power-of-two scale."""
         if x_orig.numel() == 0:
             return x_orig
-        x = x_orig.to(self.min_val.dtype)
-        if self.ch_axis == -1:
-            min_val_cur, max_val_cur = torch._aminmax(x)
-        else:
-            logger.warn('The per-tensor observer does not support per-channel min-max!')
-            min_val_cur, max_val_cur = torch._aminmax(x)
+        x = _observed(x_orig, self.min_val.dtype)
+        min_val_cur, max_val_cur = _observed_aminmax(x, -1, self.min_val.dtype)
 
         self.min_val = min_val_cur
         self.max_val = max_val_cur
-        self._x = x
+        # without a quant type only min / max are kept, calculate_qparams raises
+        if self.quant_type is not None:
+            self.pot_exp = _pot_scale_search(x, self.min_val, self.max_val, self.quant_min, self.quant_max,
+                                             self.quant_type, self.chunk_numel)
         return x
 
+    def sync_state(self):
+        # the smallest exponent, i.e. the largest scale, covers the data of every rank. A rank which saw
+        # no data still takes part in the reduce with an exponent that never wins.
+        no_exp = torch.iinfo(torch.int64).max
+        pot_exp = torch.tensor(no_exp if self.pot_exp is None else self.pot_exp, dtype=torch.int64,
+                               device=self.min_val.device)
+        self.min_val, self.max_val, pot_exp = yield [(self.min_val, 'min'), (self.max_val, 'max'), (pot_exp, 'min')]
+        self.pot_exp = None if int(pot_exp) == no_exp else int(pot_exp)
+
     def calculate_qparams(self):
         if self.quant_type is None:
             raise ValueError('You should set the observer type before forward!')
-        else:
-            scale_range = 1 if self.quant_type == 'input' else 5
-            mth = 3 if self.quant_type == 'param' else 2
         scale, zero_point = self._calculate_qparams(self.min_val, self.max_val)
-        scale.data = scale.data * 0 + max(self.min_val / self.quant_min, self.max_val / self.quant_max)
-        if scale < 2 ** -15:
-            max_scale = 0
-        else:
-            max_scale = 1 / scale
-            max_scale = torch.floor(max_scale.log2())
-        min_loss = torch.tensor([float('inf')])
-        final_scale = max_scale
-        max_scale = int(max_scale)
-        for s in range(max_scale, max_scale + scale_range):
-            _s = 1 / 2 ** s
-            if mth == 3:
-                new_x = _s * torch.clamp(torch.round(self._x / _s), self.quant_min, self.quant_max)
-            elif mth == 2:
-                new_x = torch.clamp(self._x / _s, self.quant_min, self.quant_max)
-                new_x = torch.where((new_x < 0) & (new_x - new_x.floor() == 0.5), new_x.ceil(), new_x.round())
-                new_x *= _s
-            loss = ((new_x - self._x)**2).sum()
-            min_loss = min_loss.to(loss.device)
-            if loss < min_loss:
-                min_loss = loss
-                final_scale = s
-        final_scale = min(final_scale, 12)
-        scale = scale.data * 0 + 1 / (2 ** final_scale)
+        if self.pot_exp is not None:
+            scale = scale.data * 0 + 1 / (2 ** self.pot_exp)
         zero_point = torch.zeros_like(zero_point)
         if not is_symmetric_quant(self.qscheme):
             if self.min_val >= 0.:
@@ -208,26 +322,16 @@ class EMAMinMaxObserver(ObserverBase):
         r"""Records the running minimum and maximum of ``x``."""
         if x_orig.numel() == 0:
             return x_orig
-        x = x_orig.to(self.min_val.dtype)
-        if self.ch_axis == -1:
-            min_val_cur, max_val_cur = torch._aminmax(x)
-        else:
-            x_dim = x.size()
-            new_axis_list = [i for i in range(len(x_dim))]  # noqa: C416
-            new_axis_list[self.ch_axis] = 0
-            new_axis_list[0] = self.ch_axis
-            y = x.permute(new_axis_list)
-            y = torch.flatten(y, start_dim=1)
-            min_val_cur, max_val_cur = torch._aminmax(y, 1)
-
-        if self.max_val.numel() <= 1 and self.max_val.isinf():
-            self.min_val = min_val_cur
-            self.max_val = max_val_cur
-        else:
-            self.min_val = self.min_val * self.ema_ratio + min_val_cur * (1.0 - self.ema_ratio)
-            self.max_val = self.max_val * self.ema_ratio + max_val_cur * (1.0 - self.ema_ratio)
+        x = _observed(x_orig, self.min_val.dtype)
+        min_val_cur, max_val_cur = _observed_aminmax(x, self.ch_axis, self.min_val.dtype)
+
+        self.min_val = _ema_update(self.min_val, min_val_cur, self.ema_ratio)
+        self.max_val = _ema_update(self.max_val, max_val_cur, self.ema_ratio)
         return x
 
+    def sync_state(self):
+        self.min_val, self.max_val = yield [(self.min_val, 'mean'), (self.max_val, 'mean')]
+
 
 class PoTModeObserver(ObserverBase):
     r"""Records the most frequent Potscale of ``x``."""
@@ -237,60 +341,43 @@ class PoTModeObserver(ObserverBase):
     """
 
     def __init__(self, dtype=torch.quint8, qscheme=torch.per_tensor_affine, reduce_range=False,
-                 quant_min=None, quant_max=None, ch_axis=-1, pot_scale=False, factory_kwargs=None):
+                 quant_min=None, quant_max=None, ch_axis=-1, pot_scale=False, chunk_numel=2 ** 24,
+                 factory_kwargs=None):
         super(PoTModeObserver, self).__init__(dtype, qscheme, reduce_range, quant_min, quant_max, ch_axis, pot_scale, factory_kwargs)
         self.quant_type = None
+        self.chunk_numel = chunk_numel
         self.counter = [0] * 20
+        if ch_axis != -1:
+            logger.warn('The per-tensor observer does not support per-channel min-max!')
 
     def forward(self, x_orig):
-        r"""Records the running minimum and maximum of ``x``."""
+        r"""Records the minimum and maximum of ``x`` and votes for its best power-of-two scale."""
         if x_orig.numel() == 0:
             return x_orig
-        x = x_orig.to(self.min_val.dtype)
-        if self.ch_axis == -1:
-            min_val_cur, max_val_cur = torch._aminmax(x)
-        else:
-            logger.warn('The per-tensor observer does not support per-channel min-max!')
-            min_val_cur, max_val_cur = torch._aminmax(x)
+        x = _observed(x_orig, self.min_val.dtype)
+        min_val_cur, max_val_cur = _observed_aminmax(x, -1, self.min_val.dtype)
 
         self.min_val = min_val_cur
         self.max_val = max_val_cur
-        self._x = x
+        # without a quant type only min / max are kept, calculate_qparams raises
+        if self.quant_type is not None:
+            final_scale = _pot_scale_search(x, self.min_val, self.max_val, self.quant_min, self.quant_max,
+                                            self.quant_type, self.chunk_numel)
+            self.counter[final_scale + 7] += 1
         return x
 
+    def sync_state(self):
+        counter = torch.tensor(self.counter, device=self.min_val.device)
+        self.min_val, self.max_val, counter = yield [(self.min_val, 'min'), (self.max_val, 'max'), (counter, 'sum')]
+        self.counter = counter.tolist()
+
     def calculate_qparams(self):
         if self.quant_type is None:
             raise ValueError('You should set the observer type before forward!')
-        else:
-            scale_range = 1 if self.quant_type == 'input' else 5
-            mth = 3 if self.quant_type == 'param' else 2
         scale, zero_point = self._calculate_qparams(self.min_val, self.max_val)
-        scale.data = scale.data * 0 + max(self.min_val / self.quant_min, self.max_val / self.quant_max)
-        if scale < 2 ** -15:
-            max_scale = 0
-        else:
-            max_scale = 1 / scale
-            max_scale = torch.floor(max_scale.log2())
-        min_loss = torch.tensor([float('inf')])
-        final_scale = max_scale
-        max_scale = int(max_scale)
-        for s in range(max_scale, max_scale + scale_range):
-            _s = 1 / 2 ** s
-            if mth == 3:
-                new_x = _s * torch.clamp(torch.round(self._x / _s), self.quant_min, self.quant_max)
-            elif mth == 2:
-                new_x = torch.clamp(self._x / _s, self.quant_min, self.quant_max)
-                new_x = torch.where((new_x < 0) & (new_x - new_x.floor() == 0.5), new_x.ceil(), new_x.round())
-                new_x *= _s
-            loss = ((new_x - self._x)**2).sum()
-            min_loss = min_loss.to(loss.device)
-            if loss < min_loss:
-                min_loss = loss
-                final_scale = s
-        final_scale = min(final_scale, 12)
-        self.counter[final_scale + 7] += 1
-        final_scale = self.counter.index(max(self.counter)) - 7
-        scale = scale.data * 0 + 1 / (2 ** final_scale)
+        if sum(self.counter) > 0:
+            final_scale = self.counter.index(max(self.counter)) - 7
+            scale = scale.data * 0 + 1 / (2 ** final_scale)
         zero_point = torch.zeros_like(zero_point)
         if not is_symmetric_quant(self.qscheme):
             if self.min_val >= 0.:
@@ -312,75 +399,120 @@ class EMAQuantileObserver(ObserverBase):
                  threshold=0.99999, bins=2048, factory_kwargs=None):
         super(EMAQuantileObserver, self).__init__(dtype, qscheme, reduce_range, quant_min, quant_max,
                                                   ch_axis, pot_scale, factory_kwargs)
-        assert self.ch_axis == -1, "Quantile observer only support in per-tensor scheme."
         self.ema_ratio = ema_ratio
         self.threshold = threshold
         self.bins = bins
 
+    def _channel_histc(self, x_abs, max_hist_range):
+        r"""Per-channel ``torch.histc(x_abs, bins, 0, max_hist_range[c])`` in one ``bincount``."""
+        channel_shape = [1] * x_abs.dim()
+        channel_shape[self.ch_axis] = -1
+        inv_width = torch.where(max_hist_range > 0, self.bins / max_hist_range, torch.zeros_like(max_hist_range))
+        bin_idx = (x_abs * inv_width.reshape(channel_shape)).long().clamp_(max=self.bins - 1)
+        bin_idx += torch.arange(x_abs.shape[self.ch_axis], device=x_abs.device).reshape(channel_shape) * self.bins
+        hist = torch.bincount(bin_idx.reshape(-1), minlength=max_hist_range.numel() * self.bins)
+        return hist.reshape(-1, self.bins).to(max_hist_range.dtype)
+
+    def _quantile_clip(self, hist, max_hist_range, numel):
+        r"""Center of the first bin whose cumulative count reaches ``threshold * numel``, found by
+        ``searchsorted`` over the cumulative histogram (last dim) instead of walking the bins.
+        """
+        cdf = torch.cumsum(hist, dim=-1)
+        target = torch.full(cdf.shape[:-1] + (1, ), self.threshold * numel, dtype=cdf.dtype, device=cdf.device)
+        idx = torch.searchsorted(cdf, target).squeeze(-1)
+        clip_value = (idx.to(max_hist_range.dtype) + 0.5) * (max_hist_range / self.bins)
+        return torch.where(idx < self.bins, clip_value, max_hist_range)
+
     def forward(self, x_orig):
         r"""Records the running minimum and maximum of ``x``."""
         if x_orig.numel() == 0:
             return x_orig
-        x = x_orig.to(self.min_val.dtype)
-        min_val_cur, max_val_cur = torch._aminmax(x)
-        max_hist_range = torch.max(-min_val_cur, max_val_cur)
-        hist = torch.histc(torch.abs(x), bins=self.bins, min=0., max=max_hist_range)
-        cur_total = 0
-        clip_value = max_hist_range
-        for i, cnt in enumerate(hist):
-            if cur_total + cnt >= self.threshold * x.numel():
-                clip_value = (i + 0.5) * (max_hist_range / self.bins)
-                break
-            cur_total += cnt
-
-        if self.max_val.numel() <= 1 and self.max_val.isinf():
-            self.min_val = max(min_val_cur, -clip_value)
-            self.max_val = min(max_val_cur, clip_value)
+        x = _observed(x_orig, self.min_val.dtype)
+        min_val_cur, max_val_cur = _observed_aminmax(x, self.ch_axis, self.min_val.dtype)
+        if self.ch_axis == -1:
+            max_hist_range = torch.max(-min_val_cur, max_val_cur)
+            hist = torch.histc(torch.abs(x).to(max_hist_range.dtype), bins=self.bins, min=0., max=max_hist_range)
+            clip_value = self._quantile_clip(hist, max_hist_range, x.numel())
         else:
-            self.min_val = self.min_val * self.ema_ratio + max(min_val_cur, -clip_value) * (1.0 - self.ema_ratio)
-            self.max_val = self.max_val * self.ema_ratio + min(max_val_cur, clip_value) * (1.0 - self.ema_ratio)
+            max_hist_range = torch.max(-min_val_cur, max_val_cur)
+            hist = self._channel_histc(torch.abs(x), max_hist_range)
+            clip_value = self._quantile_clip(hist, max_hist_range, x.numel() // x.shape[self.ch_axis])
+        min_val_cur = torch.max(min_val_cur, -clip_value)
+        max_val_cur = torch.min(max_val_cur, clip_value)
+
+        self.min_val = _ema_update(self.min_val, min_val_cur, self.ema_ratio)
+        self.max_val = _ema_update(self.max_val, max_val_cur, self.ema_ratio)
         return x
 
+    def sync_state(self):
+        self.min_val, self.max_val = yield [(self.min_val, 'mean'), (self.max_val, 'mean')]
 
-class ClipStdObserver(ObserverBase):
-    """Clip std.
+
+class MomentsObserverBase(ObserverBase):
+    """Keeps the running count, mean, M2, min and max of all observed data.
+
+    The moments of each batch are merged into the running ones, so the statistics cover the
+    whole calibration set, and the moments of all ranks are merged in calculate_qparams.
     """
 
+    count: torch.Tensor
+    mean: torch.Tensor
+    m2: torch.Tensor
+
     def __init__(self, dtype=torch.quint8, qscheme=torch.per_tensor_affine, reduce_range=False,
-                 quant_min=None, quant_max=None, ch_axis=-1, pot_scale=False, std_scale=2.6,
-                 factory_kwargs=None):
-        super(ClipStdObserver, self).__init__(dtype, qscheme, reduce_range, quant_min, quant_max,
-                                              ch_axis, pot_scale, factory_kwargs=None)
-        self.std_scale = std_scale
+                 quant_min=None, quant_max=None, ch_axis=-1, pot_scale=False, factory_kwargs=None):
+        super(MomentsObserverBase, self).__init__(dtype, qscheme, reduce_range, quant_min, quant_max,
+                                                  ch_axis, pot_scale, factory_kwargs)
+        self.register_buffer("count", torch.tensor(0))
+        self.register_buffer("mean", torch.tensor(0.))
+        self.register_buffer("m2", torch.tensor(0.))
+        self.load_state_dict_hook.close()
+        self.load_state_dict_hook = PerChannelLoadHook(self, hook_param=["min_val", "max_val", "mean", "m2"])
+
+    def moments(self) -> Moments:
+        return Moments(self.count, self.mean, self.m2, self.min_val, self.max_val)
 
     def forward(self, x_orig):
-        r"""Records the running minimum and maximum of ``x``."""
+        r"""Merges the moments of ``x`` into the running ones."""
         if x_orig.numel() == 0:
             return x_orig
         x = x_orig.to(self.min_val.dtype)
         if self.ch_axis == -1:
-            min_val_cur, max_val_cur = torch._aminmax(x)
-            mean = x.mean()
-            std = x.std()
+            moments = Moments.from_tensor(x)
         else:
-            x_dim = x.size()
-            new_axis_list = [i for i in range(len(x_dim))]
-            new_axis_list[self.ch_axis] = 0
-            new_axis_list[0] = self.ch_axis
-            y = x.permute(new_axis_list)
-            y = torch.flatten(y, start_dim=1)
-            min_val_cur, max_val_cur = torch._aminmax(y, 1)
-            mean = y.mean(1)
-            std = y.std(1)
+            min_val_cur, max_val_cur = _channel_aminmax(x, self.ch_axis)
+            moments = Moments.from_tensor(x, _channel_reduce_dims(x, self.ch_axis), min_val_cur, max_val_cur)
+        self.count, self.mean, self.m2, self.min_val, self.max_val = self.moments().merge(moments)
+        return x
 
-        # using statistics to clip min and max
-        min_val = torch.minimum(mean - self.std_scale * std, min_val_cur)
-        max_val = torch.maximum(mean + self.std_scale * std, max_val_cur)
+    def sync_state(self):
+        moments = self.moments()
+        reduced = yield moments.reduce_requests()
+        self.count, self.mean, self.m2, self.min_val, self.max_val = moments.from_reduced(reduced)
 
-        self.min_val = min_val
-        self.max_val = max_val
 
-        return x
+class ClipStdObserver(MomentsObserverBase):
+    """Clip std.
+    """
+
+    def __init__(self, dtype=torch.quint8, qscheme=torch.per_tensor_affine, reduce_range=False,
+                 quant_min=None, quant_max=None, ch_axis=-1, pot_scale=False, std_scale=2.6,
+                 factory_kwargs=None):
+        super(ClipStdObserver, self).__init__(dtype, qscheme, reduce_range, quant_min, quant_max,
+                                              ch_axis, pot_scale, factory_kwargs=None)
+        self.std_scale = std_scale
+
+    @torch.jit.export
+    def calculate_qparams(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        moments = self.moments().all_reduce()
+        std = moments.std()
+        # using statistics to clip min and max
+        min_val = torch.minimum(moments.mean - self.std_scale * std, moments.min_val)
+        max_val = torch.maximum(moments.mean + self.std_scale * std, moments.max_val)
+        scale, zero_point = self._calculate_qparams(min_val, max_val)
+        if self.pot_scale:
+            scale = pot_quantization(scale)
+        return scale, zero_point
 
 
 class LSQObserver(ObserverBase):
@@ -392,28 +524,32 @@ class LSQObserver(ObserverBase):
                  quant_min=None, quant_max=None, ch_axis=-1, pot_scale=False, factory_kwargs=None):
         super(LSQObserver, self).__init__(dtype, qscheme, reduce_range, quant_min, quant_max,
                                           ch_axis, pot_scale, factory_kwargs)
-        self.tensor_norm = None
+        # norm_count is 0 until data is seen, so that a rank without data drops out of sync_state
+        self.register_buffer('tensor_norm', torch.tensor(0., dtype=self.min_val.dtype), persistent=False)
+        self.register_buffer('norm_count', torch.tensor(0., dtype=self.min_val.dtype), persistent=False)
 
     def forward(self, x_orig):
         if x_orig.numel() == 0:
             return x_orig
-        x = x_orig.to(self.min_val.dtype)
+        x = _observed(x_orig, self.min_val.dtype)
         if self.ch_axis == -1:
-            self.tensor_norm = x.abs().mean()
-            self.min_val, self.max_val = torch._aminmax(x)
+            self.tensor_norm = x.abs().mean(dtype=self.min_val.dtype)
         else:
             # compute channel-wise mean
-            x_dim = x.size()
-            new_axis_list = [i for i in range(len(x_dim))]
-            new_axis_list[self.ch_axis] = 0
-            new_axis_list[0] = self.ch_axis
-            y = x.permute(new_axis_list)
-            y = torch.flatten(y, start_dim=1)
-            self.tensor_norm = y.abs().mean(1)
-            self.min_val, self.max_val = torch._aminmax(y, 1)
+            self.tensor_norm = _channel_abs_mean(x, self.ch_axis).to(self.min_val.dtype)
+        self.min_val, self.max_val = _observed_aminmax(x, self.ch_axis, self.min_val.dtype)
+        self.norm_count.fill_(1)
 
         return x
 
+    def sync_state(self):
+        # the mean of tensor_norm over the ranks which saw data
+        requests = [(self.min_val, 'min'), (self.max_val, 'max'), (self.tensor_norm * self.norm_count, 'sum'),
+                    (self.norm_count, 'sum')]
+        self.min_val, self.max_val, norm_sum, norm_count = yield requests
+        self.tensor_norm = norm_sum / norm_count.clamp(min=1)
+        self.norm_count = norm_count.clamp(max=1)
+
     def calculate_qparams(self):
         scale = 2 * self.tensor_norm / math.sqrt(self.quant_max)
         zero_point = torch.zeros_like(self.tensor_norm)
@@ -426,7 +562,7 @@ class LSQObserver(ObserverBase):
         return scale, zero_point
 
 
-class LSQPlusObserver(ObserverBase):
+class LSQPlusObserver(MomentsObserverBase):
     '''
     LSQ+ observer.
     '''
@@ -436,56 +572,35 @@ class LSQPlusObserver(ObserverBase):
 
         super(LSQPlusObserver, self).__init__(dtype, qscheme, reduce_range, quant_min, quant_max,
                                               ch_axis, pot_scale, factory_kwargs)
-        self.mean = None
-        self.std = None
-
-    def forward(self, x_orig):
-        if x_orig.numel() == 0:
-            return x_orig
-        x = x_orig.to(self.min_val.dtype)
-        if self.ch_axis == -1:
-            self.mean = x.mean()
-            self.std = x.std()
-            self.min_val, self.max_val = torch._aminmax(x)
-        else:
-            # compute channel-wise mean
-            x_dim = x.size()
-            new_axis_list = [i for i in range(len(x_dim))]  # noqa: C416
-            new_axis_list[self.ch_axis] = 0
-            new_axis_list[0] = self.ch_axis
-            y = x.permute(new_axis_list)
-            y = torch.flatten(y, start_dim=1)
-            self.mean = y.mean(1)
-            self.std = y.std(1)
-            self.min_val, self.max_val = torch._aminmax(y)
-
-        return x
 
     def calculate_qparams(self):
-        scale = torch.maximum((self.mean - 3 * self.std).abs(),
-                              (self.mean + 3 * self.std).abs()) / (self.quant_max - self.quant_min + 1)
-        sync_tensor(scale)
-        sync_tensor(zero_point)
+        moments = self.moments().all_reduce()
+        mean, std = moments.mean, moments.std()
+        scale = torch.maximum((mean - 3 * std).abs(),
+                              (mean + 3 * std).abs()) / (self.quant_max - self.quant_min + 1)
         if self.pot_scale:
             scale = pot_quantization(scale)
-        zero_point = torch.zeros_like(self.mean)
+        zero_point = torch.zeros_like(scale)
         if not is_symmetric_quant(self.qscheme):
-            if self.min_val >= 0.:
-                zero_point = self.quant_min - torch.round(self.min_val / scale)
+            zero_point = torch.where(moments.min_val >= 0., self.quant_min - torch.round(moments.min_val / scale),
+                                     zero_point)
         return scale, zero_point
 
 
 class MSEObserver(ObserverBase):
     '''
     Calculate mseobserver of whole calibration dataset.
+    batch_search: score all clipping candidates together, about chunk_numel elements at a time.
     '''
 
     def __init__(self, dtype=torch.quint8, qscheme=torch.per_tensor_affine,
                  reduce_range=False, quant_min=None, quant_max=None, ch_axis=-1, pot_scale=False, p=2.0,
-                 factory_kwargs=None):
+                 batch_search=True, chunk_numel=2 ** 24, factory_kwargs=None):
         super(MSEObserver, self).__init__(dtype, qscheme, reduce_range, quant_min, quant_max,
                                           ch_axis, pot_scale, factory_kwargs)
         self.p = p
+        self.batch_search = batch_search
+        self.chunk_numel = chunk_numel
 
     def lp_loss(self, pred, tgt, dim=None):
         """
@@ -495,6 +610,9 @@ class MSEObserver(ObserverBase):
 
 
     def mse(self, x: torch.Tensor, x_min: torch.Tensor, x_max: torch.Tensor, iter=80):
+        if self.batch_search:
+            return _batched_lp_search(self, x, x_min, x_max, iter, self.p, chunk_numel=self.chunk_numel)
+        x = x.to(x_min.dtype)
         best_score = 1e+10
         best_min, best_max = torch.tensor([1.0], dtype=torch.float), torch.tensor([1.0], dtype=torch.float)
         best_min.copy_(x_min)
@@ -503,9 +621,8 @@ class MSEObserver(ObserverBase):
             new_min = x_min * (1.0 - (i * 0.01))
             new_max = x_max * (1.0 - (i * 0.01))
             scale, zero_point = self._calculate_qparams(new_min, new_max)
-            x_q = torch.fake_quantize_per_tensor_affine(
-                x, scale.item(), int(zero_point.item()),
-                self.quant_min, self.quant_max)
+            x_q = _fake_quantize_per_tensor_affine(
+                x, scale, zero_point, self.quant_min, self.quant_max)
             score = self.lp_loss(x_q, x)
             if score < best_score:
                 best_score = score
@@ -515,6 +632,9 @@ class MSEObserver(ObserverBase):
     def mse_perchannel(self, x: torch.Tensor, x_min: torch.Tensor, x_max: torch.Tensor, iter=80, ch_axis=0):
         assert x_min.shape == x_max.shape
         assert ch_axis >= 0, f'{ch_axis}'
+        if self.batch_search:
+            return _batched_lp_search(self, x, x_min, x_max, iter, self.p, ch_axis, self.chunk_numel)
+        x = x.to(x_min.dtype)
         best_score = 1e+10 * torch.ones_like(x_min)
         best_min, best_max = x_min.clone(), x_max.clone()
         reduce_dim = tuple([i for i in range(len(x.shape)) if i != ch_axis])
@@ -536,18 +656,11 @@ class MSEObserver(ObserverBase):
         r"""Records the running minimum and maximum of ``x``."""
         if x_orig.numel() == 0:
             return x_orig
-        x = x_orig.clone().detach().to(self.min_val.dtype)
+        x = _observed(x_orig, self.min_val.dtype)
+        min_val_cur, max_val_cur = _observed_aminmax(x, self.ch_axis, self.min_val.dtype)
         if self.ch_axis == -1:
-            min_val_cur, max_val_cur = torch._aminmax(x)
             min_val_cur, max_val_cur = self.mse(x, min_val_cur, max_val_cur, iter=95)
         else:
-            x_dim = x.size()
-            new_axis_list = [i for i in range(len(x_dim))]
-            new_axis_list[self.ch_axis] = 0
-            new_axis_list[0] = self.ch_axis
-            x_channel = x.permute(new_axis_list)
-            y = torch.flatten(x_channel, start_dim=1)
-            min_val_cur, max_val_cur = torch._aminmax(y, 1)
             min_val_cur, max_val_cur = self.mse_perchannel(x, min_val_cur, max_val_cur, iter=80, ch_axis=self.ch_axis)
 
         self.min_val = torch.min(self.min_val, min_val_cur)
@@ -558,14 +671,17 @@ class MSEObserver(ObserverBase):
 class EMAMSEObserver(ObserverBase):
     '''
     Calculate mseobserver of whole calibration dataset.
+    batch_search: score all clipping candidates together, about chunk_numel elements at a time.
     '''
     def __init__(self, dtype=torch.quint8, qscheme=torch.per_tensor_affine,
                  reduce_range=False, quant_min=None, quant_max=None, ch_axis=-1, pot_scale=False,
-                 p=2.0, ema_ratio=0.9, factory_kwargs=None):
+                 p=2.0, ema_ratio=0.9, batch_search=True, chunk_numel=2 ** 24, factory_kwargs=None):
         super(EMAMSEObserver, self).__init__(dtype, qscheme, reduce_range, quant_min, quant_max,
                                              ch_axis, pot_scale, factory_kwargs)
         self.ema_ratio = ema_ratio
         self.p = p
+        self.batch_search = batch_search
+        self.chunk_numel = chunk_numel
 
     def lp_loss(self, pred, tgt, dim=None):
         """
@@ -574,6 +690,9 @@ class EMAMSEObserver(ObserverBase):
         return (pred - tgt).abs().pow(self.p).mean(dim) if dim else (pred - tgt).abs().pow(self.p).mean()
 
     def mse(self, x: torch.Tensor, x_min: torch.Tensor, x_max: torch.Tensor, iter=80):
+        if self.batch_search:
+            return _batched_lp_search(self, x, x_min, x_max, iter, self.p, chunk_numel=self.chunk_numel)
+        x = x.to(x_min.dtype)
         best_score = 1e+10
         best_min, best_max = torch.tensor([1.0], dtype=torch.float), torch.tensor([1.0], dtype=torch.float)
         best_min.copy_(x_min)
@@ -582,9 +701,8 @@ class EMAMSEObserver(ObserverBase):
             new_min = x_min * (1.0 - (i * 0.01))
             new_max = x_max * (1.0 - (i * 0.01))
             scale, zero_point = self._calculate_qparams(new_min, new_max)
-            x_q = torch.fake_quantize_per_tensor_affine(
-                x, scale.item(), int(zero_point.item()),
-                self.quant_min, self.quant_max)
+            x_q = _fake_quantize_per_tensor_affine(
+                x, scale, zero_point, self.quant_min, self.quant_max)
             score = self.lp_loss(x_q, x)
             if score < best_score:
                 best_score = score
@@ -594,6 +712,9 @@ class EMAMSEObserver(ObserverBase):
     def mse_perchannel(self, x: torch.Tensor, x_min: torch.Tensor, x_max: torch.Tensor, iter=80, ch_axis=0):
         assert x_min.shape == x_max.shape
         assert ch_axis >= 0, f'{ch_axis}'
+        if self.batch_search:
+            return _batched_lp_search(self, x, x_min, x_max, iter, self.p, ch_axis, self.chunk_numel)
+        x = x.to(x_min.dtype)
         best_score = 1e+10 * torch.ones_like(x_min)
         best_min, best_max = x_min.clone(), x_max.clone()
         reduce_dim = tuple([i for i in range(len(x.shape)) if i != ch_axis])
@@ -615,24 +736,299 @@ class EMAMSEObserver(ObserverBase):
         r"""Records the running minimum and maximum of ``x``."""
         if x_orig.numel() == 0:
             return x_orig
-        x = x_orig.clone().detach().to(self.min_val.dtype)
+        x = _observed(x_orig, self.min_val.dtype)
+        min_val_cur, max_val_cur = _observed_aminmax(x, self.ch_axis, self.min_val.dtype)
         if self.ch_axis == -1:
-            min_val_cur, max_val_cur = torch._aminmax(x)
             min_val_cur, max_val_cur = self.mse(x, min_val_cur, max_val_cur, iter=95)
         else:
-            x_dim = x.size()
-            new_axis_list = [i for i in range(len(x_dim))]
-            new_axis_list[self.ch_axis] = 0
-            new_axis_list[0] = self.ch_axis
-            x_channel = x.permute(new_axis_list)
-            y = torch.flatten(x_channel, start_dim=1)
-            min_val_cur, max_val_cur = torch._aminmax(y, 1)
             min_val_cur, max_val_cur = self.mse_perchannel(x, min_val_cur, max_val_cur, iter=80, ch_axis=self.ch_axis)
 
-        if self.max_val.numel() <= 1 and self.max_val.isinf():
-            self.min_val = min_val_cur
-            self.max_val = max_val_cur
-        else:
-            self.min_val = self.min_val * self.ema_ratio + min_val_cur * (1.0 - self.ema_ratio)
-            self.max_val = self.max_val * self.ema_ratio + max_val_cur * (1.0 - self.ema_ratio)
+        self.min_val = _ema_update(self.min_val, min_val_cur, self.ema_ratio)
+        self.max_val = _ema_update(self.max_val, max_val_cur, self.ema_ratio)
+        return x
+
+    def sync_state(self):
+        self.min_val, self.max_val = yield [(self.min_val, 'mean'), (self.max_val, 'mean')]
+
+
+
+class HistogramObserver(ObserverBase):
+    """Streaming histogram of the whole calibration dataset, merged across batches.
+    Bins have a power-of-two width and sit on multiples of it, so when the range grows
+    the histogram is coarsened by merging whole bins and no information is redistributed.
+    Subclasses search the clipping range over the histogram in ``_clip_range``.
+    """
+
+    def __init__(self, dtype=torch.quint8, qscheme=torch.per_tensor_affine, reduce_range=False,
+                 quant_min=None, quant_max=None, ch_axis=-1, pot_scale=False, bins=2048,
+                 factory_kwargs=None):
+        super(HistogramObserver, self).__init__(dtype, qscheme, reduce_range, quant_min, quant_max,
+                                                ch_axis, pot_scale, factory_kwargs)
+        assert self.ch_axis == -1, "Histogram observer only support in per-tensor scheme."
+        self.bins = bins
+        self.register_buffer("histogram", torch.zeros(bins))
+        # bin i covers [(hist_start + i) * 2 ** hist_exp, (hist_start + i + 1) * 2 ** hist_exp)
+        self.register_buffer("hist_start", torch.tensor(0, dtype=torch.long))
+        self.register_buffer("hist_exp", torch.tensor(0, dtype=torch.long))
+
+    def _fit_grid(self, min_val, max_val, exp):
+        r"""The first bin and the smallest exponent from ``exp`` on of the grid covering ``[min_val, max_val]``
+        with ``bins`` bins, computed on the device of the tensor arguments."""
+        lo, hi = min_val.double(), max_val.double()
+        # the span takes at most two bins more than (hi - lo) / width
+        needed = torch.floor(torch.log2((hi - lo) / self.bins)).clamp(min=-1100)
+        exps = torch.max(exp, needed.long()) + torch.arange(3, device=exp.device)
+        widths = torch.pow(2., exps.double())
+        fits = torch.floor(hi / widths) - torch.floor(lo / widths) + 1 <= self.bins
+        exp = exps.gather(0, fits.long().argmax().unsqueeze(0))[0]
+        return torch.floor(lo / torch.pow(2., exp.double())).long(), exp
+
+    def _coarsen(self, hist, start, exp, new_start, new_exp):
+        idx = torch.arange(hist.numel(), device=hist.device) + start
+        # bins past the old maximum are empty, clamping them is harmless
+        idx = (torch.div(idx, 2 ** (new_exp - exp), rounding_mode='floor') - new_start).clamp_(0, self.bins - 1)
+        return torch.zeros(self.bins, dtype=hist.dtype, device=hist.device).index_add_(0, idx, hist)
+
+    def forward(self, x_orig):
+        r"""Records the running minimum and maximum of ``x`` and merges its histogram, without reading
+        anything back from the device."""
+        if x_orig.numel() == 0:
+            return x_orig
+        x = x_orig.detach().to(self.min_val.dtype)
+        min_val_cur, max_val_cur = aminmax(x)
+        min_val = torch.min(self.min_val, min_val_cur)
+        max_val = torch.max(self.max_val, max_val_cur)
+        # the first grid is about as fine as the range allows
+        empty = self.histogram.sum() == 0
+        first_exp = torch.floor(torch.log2((max_val.double() - min_val.double()) / self.bins)).clamp(min=-64).long()
+        first_exp = torch.where(max_val > min_val, first_exp, torch.full_like(first_exp, -24))
+        start, exp = self._fit_grid(min_val, max_val, torch.where(empty, first_exp, self.hist_exp))
+        # an empty histogram has nothing to coarsen, min keeps the merge factor an integer
+        self.histogram = self._coarsen(self.histogram, self.hist_start, torch.min(self.hist_exp, exp), start, exp)
+        idx = torch.floor(x * torch.pow(2., -exp.to(x.dtype))).long() - start
+        self.histogram.index_add_(0, idx.flatten().clamp_(0, self.bins - 1),
+                                  torch.ones(x.numel(), dtype=self.histogram.dtype, device=x.device))
+        self.hist_start.copy_(start)
+        self.hist_exp.copy_(exp)
+        self.min_val = min_val
+        self.max_val = max_val
         return x
+
+    def sync_state(self):
+        r"""Move the histograms of all ranks to a common grid before summing them."""
+        # ranks without data must not coarsen the grid of the others
+        hist_exp = self.hist_exp if self.histogram.sum() > 0 else torch.full_like(self.hist_exp, -2 ** 62)
+        self.min_val, self.max_val, hist_exp = yield [(self.min_val, 'min'), (self.max_val, 'max'),
+                                                      (hist_exp, 'max')]
+        if self.max_val.isinf():
+            return
+        start, exp = self._fit_grid(self.min_val, self.max_val, hist_exp)
+        if self.histogram.sum() > 0:
+            self.histogram = self._coarsen(self.histogram, self.hist_start, self.hist_exp, start, exp)
+        self.hist_start.copy_(start)
+        self.hist_exp.copy_(exp)
+        self.histogram, = yield [(self.histogram, 'sum')]
+
+    def _bin_edges(self):
+        width = 2. ** int(self.hist_exp)
+        start = int(self.hist_start)
+        return (torch.arange(self.bins + 1, dtype=self.histogram.dtype, device=self.histogram.device) + start) * width
+
+    def _abs_histogram(self):
+        r"""Fold the histogram onto ``|x|``. Zero is always a bin edge, so this is exact."""
+        start, exp = int(self.hist_start), int(self.hist_exp)
+        idx = torch.arange(start, start + self.bins, device=self.histogram.device)
+        idx = torch.where(idx >= 0, idx, -idx - 1)
+        num_bins = int(idx.max()) + 1
+        hist = torch.zeros(num_bins, dtype=self.histogram.dtype, device=self.histogram.device)
+        hist.index_add_(0, idx, self.histogram)
+        while hist.numel() > self.bins:
+            hist = torch.nn.functional.pad(hist, (0, hist.numel() % 2)).reshape(-1, 2).sum(1)
+            exp += 1
+        return hist, 2. ** exp
+
+    def _clip_range(self):
+        return self.min_val, self.max_val
+
+    @torch.jit.export
+    def calculate_qparams(self):
+        r"""Calculates the quantization parameters from the clipping range searched over the histogram."""
+        if self.histogram.sum() == 0:
+            min_val, max_val = self.min_val, self.max_val
+        else:
+            min_val, max_val = self._clip_range()
+        scale, zero_point = self._calculate_qparams(min_val, max_val)
+        scale.data = sync_tensor(scale).data
+        zero_point.data = sync_tensor(zero_point).data
+        if self.pot_scale:
+            scale = pot_quantization(scale)
+        return scale, zero_point
+
+
+class HistogramMSEObserver(HistogramObserver):
+    """Search the clipping range minimizing the Lp quantization error of the histogram,
+    with the same shrink candidates as MSEObserver.
+    """
+
+    def __init__(self, dtype=torch.quint8, qscheme=torch.per_tensor_affine, reduce_range=False,
+                 quant_min=None, quant_max=None, ch_axis=-1, pot_scale=False, bins=2048, p=2.0,
+                 factory_kwargs=None):
+        super(HistogramMSEObserver, self).__init__(dtype, qscheme, reduce_range, quant_min, quant_max,
+                                                   ch_axis, pot_scale, bins, factory_kwargs)
+        self.p = p
+
+    def _clip_range(self, iter=95):
+        edges = self._bin_edges()
+        centers = (edges[:-1] + edges[1:]) / 2
+        ratio = torch.tensor([1.0 - (i * 0.01) for i in range(iter)], dtype=centers.dtype, device=centers.device)
+        cand_min, cand_max = self.min_val * ratio, self.max_val * ratio
+        scale, zero_point = self._calculate_qparams(cand_min, cand_max)
+        centers_q = _fake_quantize_affine(centers.unsqueeze(0), scale.unsqueeze(1), zero_point.unsqueeze(1),
+                                          self.quant_min, self.quant_max)
+        score = (centers_q.sub_(centers).abs_().pow_(self.p) * self.histogram).sum(1)
+        best = torch.argmin(score)
+        return cand_min[best], cand_max[best]
+
+
+class HistogramKLObserver(HistogramObserver):
+    """Search the clipping threshold of ``|x|`` minimizing the KL divergence between the
+    histogram and its quantized version, as the TensorRT entropy calibrator does.
+    """
+
+    def __init__(self, dtype=torch.quint8, qscheme=torch.per_tensor_affine, reduce_range=False,
+                 quant_min=None, quant_max=None, ch_axis=-1, pot_scale=False, bins=2048, chunk_size=256,
+                 smooth_eps=1e-4, factory_kwargs=None):
+        super(HistogramKLObserver, self).__init__(dtype, qscheme, reduce_range, quant_min, quant_max,
+                                                  ch_axis, pot_scale, bins, factory_kwargs)
+        self.chunk_size = chunk_size
+        self.smooth_eps = smooth_eps
+
+    def _kl_divergence(self, hist, ends, levels):
+        r"""KL divergence of clipping ``hist`` at each bin index in ``ends`` (one candidate per row)."""
+        idx = torch.arange(hist.numel(), device=hist.device).unsqueeze(0)
+        valid = idx < ends.unsqueeze(1)
+        clipped = torch.where(valid, hist.unsqueeze(0), torch.zeros_like(hist))
+        # reference distribution: clipped histogram with the outliers added to the last bin
+        p = clipped.scatter_add(1, (ends - 1).unsqueeze(1), (hist.sum() - clipped.sum(1)).unsqueeze(1))
+        # candidate distribution: merge the clipped bins into ``levels`` groups and expand over the bins
+        # non-empty in p, an empty last bin which got the outliers included
+        group = torch.div(idx * levels, ends.unsqueeze(1), rounding_mode='floor')
+        group = torch.where(valid, group, torch.full_like(group, levels))
+        nonzero = (p > 0).to(hist.dtype)
+        group_sum = torch.zeros(ends.numel(), levels + 1, dtype=hist.dtype, device=hist.device)
+        group_sum.scatter_add_(1, group, clipped)
+        group_cnt = torch.zeros_like(group_sum).scatter_add_(1, group, nonzero)
+        q = nonzero * group_sum.gather(1, group) / group_cnt.gather(1, group).clamp(min=1)
+        # as TensorRT, move ``smooth_eps`` of mass to the empty bins, so that q has no zero where p has mass
+        p = self._smooth(p, valid)
+        q = self._smooth(q, valid)
+        p = p / p.sum(1, keepdim=True)
+        q = q / q.sum(1, keepdim=True)
+        return torch.where(valid, p * torch.log(p / q), torch.zeros_like(p)).sum(1)
+
+    def _smooth(self, hist, valid):
+        empty = ((hist == 0) & valid).to(hist.dtype)
+        num_empty = empty.sum(1, keepdim=True)
+        num_nonempty = valid.sum(1, keepdim=True) - num_empty
+        smoothed = hist + self.smooth_eps * empty - (1 - empty) * self.smooth_eps * num_empty / num_nonempty.clamp(min=1)
+        # a bin smaller than what it gives away keeps a tiny mass
+        return torch.where(valid, smoothed.clamp(min=self.smooth_eps ** 2), torch.zeros_like(hist))
+
+    def _clip_range(self):
+        hist, width = self._abs_histogram()
+        levels = self.quant_max - self.quant_min + 1
+        if not (self.min_val >= 0 and not is_symmetric_quant(self.qscheme)):
+            levels = levels // 2
+        num_bins = int(torch.nonzero(hist).max()) + 1
+        if num_bins <= levels:
+            return self.min_val, self.max_val
+        hist = hist[:num_bins]
+        ends = torch.arange(levels, num_bins + 1, device=hist.device)
+        kl = torch.cat([self._kl_divergence(hist, ends[i:i + self.chunk_size], levels)
+                        for i in range(0, ends.numel(), self.chunk_size)])
+        threshold = ends[torch.argmin(kl)].to(hist.dtype) * width
+        return torch.max(self.min_val, -threshold), torch.min(self.max_val, threshold)
+
+
+class HistogramPercentileObserver(HistogramObserver):
+    """Clip the range at the ``threshold`` quantile of the histogram. Symmetric schemes clip
+    ``|x|``, affine schemes clip both tails.
+    """
+
+    def __init__(self, dtype=torch.quint8, qscheme=torch.per_tensor_affine, reduce_range=False,
+                 quant_min=None, quant_max=None, ch_axis=-1, pot_scale=False, bins=2048, threshold=0.99999,
+                 factory_kwargs=None):
+        super(HistogramPercentileObserver, self).__init__(dtype, qscheme, reduce_range, quant_min, quant_max,
+                                                          ch_axis, pot_scale, bins, factory_kwargs)
+        self.threshold = threshold
+
+    def _clip_range(self):
+        if is_symmetric_quant(self.qscheme):
+            hist, width = self._abs_histogram()
+            cdf = torch.cumsum(hist, dim=0)
+            idx = torch.searchsorted(cdf, cdf[-1:] * self.threshold)
+            clip_value = (idx[0] + 1).to(hist.dtype) * width
+            return torch.max(self.min_val, -clip_value), torch.min(self.max_val, clip_value)
+        edges = self._bin_edges()
+        cdf = torch.cumsum(self.histogram, dim=0)
+        hi_idx = torch.searchsorted(cdf, cdf[-1:] * self.threshold)
+        lo_idx = torch.searchsorted(cdf, cdf[-1:] * (1 - self.threshold), right=True)
+        return torch.max(self.min_val, edges[lo_idx[0]]), torch.min(self.max_val, edges[hi_idx[0] + 1])
+
+
+class MultiObserver(ObserverBase):
+    """Fan the data out to several observers, so calibration strategies can be compared after a
+    single calibration pass.
+
+    observers: observer names in ObserverDict (or observer classes), or a dict mapping them to
+    their extra kwargs. They share the quantization scheme of this observer.
+    calculate_qparams uses the ``active`` one, the first by default; calculate_all_qparams gives
+    the qparams of every strategy.
+    """
+
+    def __init__(self, dtype=torch.quint8, qscheme=torch.per_tensor_affine, reduce_range=False,
+                 quant_min=None, quant_max=None, ch_axis=-1, pot_scale=False,
+                 observers=('MinMaxObserver', 'EMAQuantileObserver', 'MSEObserver'), factory_kwargs=None):
+        super(MultiObserver, self).__init__(dtype, qscheme, reduce_range, quant_min, quant_max,
+                                            ch_axis, pot_scale, factory_kwargs)
+        # ObserverDict imports this module.
+        from mqbench.prepare_by_platform import ObserverDict
+        if not isinstance(observers, dict):
+            observers = {observer: {} for observer in observers}
+        assert len(observers) > 0, 'MultiObserver needs at least one observer.'
+        self.observers = torch.nn.ModuleDict()
+        for observer, observer_kwargs in observers.items():
+            if isinstance(observer, str):
+                assert observer in ObserverDict, 'Do not support observer name: {}'.format(observer)
+                name, observer = observer, ObserverDict[observer]
+            else:
+                name = observer.__name__
+            self.observers[name] = observer(dtype=dtype, qscheme=qscheme, reduce_range=reduce_range,
+                                            quant_min=quant_min, quant_max=quant_max, ch_axis=ch_axis,
+                                            pot_scale=pot_scale, **observer_kwargs)
+        self.active = next(iter(self.observers))
+
+    def forward(self, x_orig):
+        if x_orig.numel() == 0:
+            return x_orig
+        for observer in self.observers.values():
+            observer(x_orig)
+        return x_orig
+
+    def select(self, name):
+        assert name in self.observers, '{} is not one of {}'.format(name, list(self.observers))
+        self.active = name
+
+    @torch.jit.export
+    def calculate_qparams(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self.observers[self.active].calculate_qparams()
+
+    def calculate_all_qparams(self):
+        return {name: observer.calculate_qparams() for name, observer in self.observers.items()}
+
+    def sync_state(self):
+        # the wrapped observers are modules of their own and synced as such
+        return iter(())
+
+    def extra_repr(self):
+        return 'active={}'.format(self.active)
@@ -32,6 +32,10 @@ from mqbench.observer import (
     EMAQuantileObserver,
     MSEObserver,
     EMAMSEObserver,
+    HistogramMSEObserver,
+    HistogramKLObserver,
+    HistogramPercentileObserver,
+    MultiObserver,
 )
 from mqbench.fake_sparsity import (
     NormFakeSparse,
@@ -150,6 +154,10 @@ ObserverDict = {
     'LSQObserver':              LSQObserver,              # Usually used for LSQ.  # noqa: E241
     'MSEObserver':              MSEObserver,                                       # noqa: E241
     'EMAMSEObserver':           EMAMSEObserver,                                    # noqa: E241
+    'HistogramMSEObserver':     HistogramMSEObserver,     # Streaming histogram.   # noqa: E241
+    'HistogramKLObserver':      HistogramKLObserver,      # TensorRT entropy.      # noqa: E241
+    'HistogramPercentileObserver': HistogramPercentileObserver,                    # noqa: E241
+    'MultiObserver':            MultiObserver,            # Compare observers.     # noqa: E241
 }
 
 FakeQuantizeDict = {
@@ -191,7 +199,8 @@ def get_qconfig_by_platform(deploy_backend: BackendType, extra_qparams: Dict):
                 'bit': bitwidth,
                 'symmetry': whether quantize scheme is symmetric,
                 'per_channel': whether quantize scheme is perchannel,
-                'pot_scale': whether scale is power of two.
+                'pot_scale': whether scale is power of two,
+                'group_size': optional, weight only, quantize each row of the weight in groups of this size.
             }
             'a_qscheme': {
                 same with w_qscheme.
@@ -251,6 +260,10 @@ def get_qconfig_by_platform(deploy_backend: BackendType, extra_qparams: Dict):
         else:
             logger.info("Activation Quant Scheme is overrided!")
             a_qscheme = QuantizeScheme(**a_qscheme)
+    if a_qscheme.group_size is not None:
+        raise ValueError('group_size is only supported in w_qscheme, not in a_qscheme.')
+    if w_qscheme.group_size is not None and deploy_backend not in [BackendType.Academic, BackendType.Academic_NLP]:
+        raise ValueError('group_size is only supported by the Academic backends, not by {}.'.format(deploy_backend))
 
     # Set extra args for observers.
     w_observer_extra_args = extra_qparams.get('w_observer_extra_args', {})
@@ -3,10 +3,14 @@ import torch
 
 class QuantizeScheme(object):
     """Describe quantization scheme.
+
+    ``group_size`` (in kwargs) quantizes each row of the weight in groups of that many elements,
+    one scale / zero_point per group, and implies per_channel.
     """
     def __init__(self, symmetry=True, per_channel=False, pot_scale=False, bit=8, **kwargs):
         self.symmetry = symmetry
-        self.per_channel = per_channel
+        self.group_size = kwargs.pop('group_size', None)
+        self.per_channel = per_channel or self.group_size is not None
         self.pot_scale = pot_scale
         self.bit = bit
         if self.per_channel:
@@ -30,9 +34,11 @@ class QuantizeScheme(object):
             'reduce_range': False,
             'ch_axis': 0 if self.per_channel else -1
         }
+        if self.group_size is not None:
+            naive_para['group_size'] = self.group_size
         naive_para.update(self.kwargs)
         return naive_para
 
     def __str__(self):
-        return "Symmetric: {} / Bitwidth: {} / Per channel: {} / Pot scale: {} / Extra kwargs: {}".format(
-            self.symmetry, self.bit, self.per_channel, self.pot_scale, self.kwargs)
+        return "Symmetric: {} / Bitwidth: {} / Per channel: {} / Group size: {} / Pot scale: {} / Extra kwargs: {}".format(
+            self.symmetry, self.bit, self.per_channel, self.group_size, self.pot_scale, self.kwargs)
@@ -0,0 +1,58 @@
+import torch
+
+CACHE_DTYPES = ('float32', 'float16', 'bfloat16', 'int8')
+
+
+class CompressedTensor:
+    r"""A float tensor stored as float16 / bfloat16, or as int8 ``data`` times ``scale``.
+
+    int8 scales are per sample and channel (dims 0 and 1) for inputs of more than 2 dims, else per
+    sample, so the compressed batches can be concatenated along dim 0. decompress gives back a
+    tensor of the original ``dtype``.
+    """
+    def __init__(self, data: torch.Tensor, scale: torch.Tensor, dtype: torch.dtype):
+        self.data = data
+        self.scale = scale
+        self.dtype = dtype
+
+    @classmethod
+    def compress(cls, x: torch.Tensor, cache_dtype: str):
+        if cache_dtype == 'int8':
+            dims = tuple(range(2 if x.dim() > 2 else 1, x.dim()))
+            scale = x.abs().amax(dims, keepdim=True).float().div_(127.).clamp_(min=torch.finfo(torch.float32).tiny)
+            data = torch.round(x / scale).clamp_(-127, 127).to(torch.int8)
+            return cls(data, scale, x.dtype)
+        return cls(x.to(getattr(torch, cache_dtype)), None, x.dtype)
+
+    def decompress(self) -> torch.Tensor:
+        if self.scale is None:
+            return self.data.to(self.dtype)
+        return (self.data.float() * self.scale).to(self.dtype)
+
+    def tensors(self):
+        return [self.data] if self.scale is None else [self.data, self.scale]
+
+    def to(self, device, non_blocking=False):
+        return CompressedTensor(self.data.to(device, non_blocking=non_blocking),
+                                None if self.scale is None else self.scale.to(device, non_blocking=non_blocking),
+                                self.dtype)
+
+    @property
+    def device(self):
+        return self.data.device
+
+    @property
+    def nbytes(self):
+        return sum([x.numel() * x.element_size() for x in self.tensors()])
+
+
+def compress(value, cache_dtype: str):
+    r"""``value`` compressed to ``cache_dtype`` (one of CACHE_DTYPES) if it is a float tensor, else itself."""
+    if cache_dtype is None or cache_dtype == 'float32' or not isinstance(value, torch.Tensor) or \
+            not value.is_floating_point():
+        return value
+    return CompressedTensor.compress(value.detach(), cache_dtype)
+
+
+def decompress(value):
+    return value.decompress() if isinstance(value, CompressedTensor) else value
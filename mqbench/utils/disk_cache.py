@@ -0,0 +1,132 @@
+import tempfile
+import weakref
+from collections.abc import Sequence
+
+import numpy as np
+import torch
+
+from mqbench.utils.compression import CompressedTensor
+
+# numpy has no bfloat16, it is saved as int16 and viewed back.
+_STORAGE_DTYPE = {torch.bfloat16: torch.int16}
+
+
+class DiskTensorList(Sequence):
+    r"""A list of tensors (or CompressedTensor) appended one after the other to a temporary file in ``directory``.
+
+    Reading an item maps only its bytes with numpy memmap and copies them out, so the list takes
+    no memory besides the items in use. The file has no name, it is removed by the OS once the
+    list is garbage collected.
+    """
+    def __init__(self, directory=None):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.entries = []
+        self.nbytes = 0
+        self._dirty = False
+
+    def append(self, value):
+        if isinstance(value, CompressedTensor):
+            self.entries.append(([self._write(x) for x in value.tensors()], value.dtype))
+        else:
+            self.entries.append(([self._write(value)], None))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        metas, compressed_dtype = self.entries[idx]
+        tensors = [self._read(*meta) for meta in metas]
+        if compressed_dtype is None:
+            return tensors[0]
+        return CompressedTensor(tensors[0], tensors[1] if len(tensors) > 1 else None, compressed_dtype)
+
+    def _write(self, tensor):
+        tensor = tensor.detach().cpu().contiguous()
+        array = tensor.view(_STORAGE_DTYPE.get(tensor.dtype, tensor.dtype)).numpy()
+        self.file.seek(self.nbytes)
+        array.tofile(self.file)
+        meta = (self.nbytes, array.dtype, tuple(tensor.shape), tensor.dtype)
+        self.nbytes += array.nbytes
+        self._dirty = True
+        return meta
+
+    def _read(self, offset, np_dtype, shape, dtype):
+        if int(np.prod(shape)) == 0:
+            return torch.empty(shape, dtype=dtype)
+        if self._dirty:
+            self.file.flush()
+            self._dirty = False
+        array = np.memmap(self.file, dtype=np_dtype, mode='r', offset=offset, shape=shape)
+        return torch.from_numpy(np.array(array)).view(dtype)
+
+
+class MemoryBudget:
+    r"""Bytes of host memory the activation caches sharing it may keep, the rest goes to
+    DiskTensorList in ``directory`` (the system temporary directory if None).
+    """
+    def __init__(self, max_bytes: int, directory: str = None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.used = 0
+
+    def reserve(self, nbytes: int) -> bool:
+        if self.used + nbytes > self.max_bytes:
+            return False
+        self.used += nbytes
+        return True
+
+    def release(self, nbytes: int):
+        self.used -= nbytes
+
+    def new_list(self):
+        r"""An empty BudgetedTensorList keeping its values in this budget."""
+        return BudgetedTensorList(self)
+
+
+def _release(budget, reserved):
+    budget.release(reserved[0])
+
+
+class BudgetedTensorList(Sequence):
+    r"""A list of values which keeps each CPU tensor (or CompressedTensor) in memory if its bytes fit in
+    ``budget``, else in a DiskTensorList. Other values (e.g. on the GPU) are kept as they are. The bytes
+    are reserved value by value and released once the list is garbage collected, i.e. once no one
+    reads the values from it any more.
+    """
+    def __init__(self, budget: MemoryBudget):
+        self.budget = budget
+        # in memory value or None, index in self.disk or None
+        self.entries = []
+        self.disk = None
+        self.reserved = [0]
+        weakref.finalize(self, _release, budget, self.reserved)
+
+    def append(self, value):
+        nbytes = _cpu_nbytes(value)
+        if nbytes is None or self.budget.reserve(nbytes):
+            self.reserved[0] += nbytes or 0
+            self.entries.append((value, None))
+            return
+        if self.disk is None:
+            self.disk = DiskTensorList(self.budget.directory)
+        self.entries.append((None, len(self.disk)))
+        self.disk.append(value)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        value, disk_idx = self.entries[idx]
+        return value if disk_idx is None else self.disk[disk_idx]
+
+
+def _cpu_nbytes(value):
+    if isinstance(value, CompressedTensor) and value.device.type == 'cpu':
+        return value.nbytes
+    if isinstance(value, torch.Tensor) and value.device.type == 'cpu':
+        return value.numel() * value.element_size()
+    return None
@@ -0,0 +1,76 @@
+from typing import NamedTuple
+
+import torch
+
+from mqbench.utils import utils
+
+
+class Moments(NamedTuple):
+    r"""Count, mean, sum of squared deviations (M2), min and max of a stream of tensors.
+
+    ``from_tensor`` gets the moments of one batch with ``var_mean`` (Welford) and ``aminmax``,
+    ``merge`` combines two of them with Chan's parallel update and ``all_reduce`` merges the
+    moments of all ranks, so the result does not depend on how the data was split between
+    batches or ranks. ``count`` is a scalar, the other fields are scalars or per-channel tensors.
+    """
+    count: torch.Tensor
+    mean: torch.Tensor
+    m2: torch.Tensor
+    min_val: torch.Tensor
+    max_val: torch.Tensor
+
+    @classmethod
+    def from_tensor(cls, x, dim=None, min_val=None, max_val=None):
+        r"""Moments of ``x`` reduced over ``dim`` (all dims if None).
+
+        ``min_val`` / ``max_val`` of the batch may be given if already computed.
+        """
+        if dim is None:
+            var, mean = torch.var_mean(x, unbiased=False)
+            count = x.numel()
+            if min_val is None:
+                min_val, max_val = utils.aminmax(x)
+        else:
+            var, mean = torch.var_mean(x, dim, unbiased=False)
+            count = x.numel() // mean.numel()
+            if min_val is None:
+                min_val, max_val = torch.amin(x, dim), torch.amax(x, dim)
+        count = torch.tensor(count, device=x.device)
+        return cls(count, mean, var * count, min_val, max_val)
+
+    def merge(self, other: 'Moments') -> 'Moments':
+        count = self.count + other.count
+        ratio = other.count / count.clamp(min=1)
+        delta = other.mean - self.mean
+        mean = self.mean + delta * ratio
+        m2 = self.m2 + other.m2 + delta * delta * self.count * ratio
+        return Moments(count, mean, m2, torch.minimum(self.min_val, other.min_val),
+                       torch.maximum(self.max_val, other.max_val))
+
+    def reduce_requests(self):
+        r"""(tensor, op) to merge the moments over ranks with all_reduce_tensors, see from_reduced.
+
+        Sums of x and x ** 2 are reduced in float64, so a single round is enough.
+        """
+        count = self.count.double()
+        total = self.mean.double() * count
+        square = self.m2.double() + total * self.mean.double()
+        return [(count, 'sum'), (total, 'sum'), (square, 'sum'), (self.min_val, 'min'), (self.max_val, 'max')]
+
+    def from_reduced(self, reduced) -> 'Moments':
+        count, total, square, min_val, max_val = reduced
+        mean = total / count.clamp(min=1)
+        m2 = (square - total * mean).clamp(min=0)
+        return Moments(count.to(self.count.dtype), mean.to(self.mean.dtype), m2.to(self.m2.dtype), min_val, max_val)
+
+    def all_reduce(self) -> 'Moments':
+        r"""Merge the moments of all ranks, a no-op outside distributed training."""
+        if not (utils.USE_LINK or utils.USE_DDP) or not utils.SYNC_ENABLED:
+            return self
+        return self.from_reduced(utils.all_reduce_tensors(self.reduce_requests()))
+
+    def var(self, unbiased=True) -> torch.Tensor:
+        return self.m2 / (self.count - 1 if unbiased else self.count).clamp(min=1)
+
+    def std(self, unbiased=True) -> torch.Tensor:
+        return self.var(unbiased).sqrt()
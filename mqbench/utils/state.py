@@ -1,7 +1,9 @@
 import torch
 
 from mqbench.utils.logger import logger
+from mqbench.utils.utils import no_sync_tensor, sync_observers
 from mqbench.fake_sparsity.sparsity_base import FakeSparseBase
+from mqbench.fake_quantize.quantize_base import QuantizeBase
 
 
 def enable_sparse(model):
@@ -17,15 +19,40 @@ def disable_sparse(model):
             submodule.disable_fake_sparse()
 
 
-def enable_calibration(model):
+def enable_calibration(model, defer_qparams=False):
+    """With defer_qparams, observers only collect statistics in forward and the qparams are
+    computed by finalize_calibration.
+    """
     logger.info('Enable observer and Disable quantize.')
     for name, submodule in model.named_modules():
         if isinstance(submodule, torch.quantization.FakeQuantizeBase):
             logger.debug('Enable observer and Disable quant: {}'.format(name))
             submodule.enable_observer()
             submodule.disable_fake_quant()
+            if isinstance(submodule, QuantizeBase):
+                submodule.defer_qparams = defer_qparams
 
-def enable_calibration_woquantization(model, quantizer_type='fake_quant'):
+
+def finalize_calibration(model):
+    """Compute the qparams of quantizers calibrated with defer_qparams. The observer statistics
+    are merged over ranks once beforehand (see sync_observers), call it once after calibration.
+    enable_quantization calls it if it was not.
+    """
+    logger.info('Compute deferred qparams.')
+    quantizers = [submodule for submodule in model.modules()
+                  if isinstance(submodule, QuantizeBase) and submodule.defer_qparams]
+    sync_observers(torch.nn.ModuleList([quantizer.activation_post_process for quantizer in quantizers]))
+    with no_sync_tensor():
+        for quantizer in quantizers:
+            quantizer.update_qparams()
+            quantizer.defer_qparams = False
+
+
+def _has_deferred_qparams(model):
+    return any([isinstance(submodule, QuantizeBase) and submodule.defer_qparams for submodule in model.modules()])
+
+def enable_calibration_woquantization(model, quantizer_type='fake_quant', defer_qparams=False):
+    """See enable_calibration for defer_qparams."""
     logger.info('Enable observer and Disable quantize for {}'.format(quantizer_type))
     for name, submodule in model.named_modules():
         if isinstance(submodule, torch.quantization.FakeQuantizeBase):
@@ -36,8 +63,12 @@ def enable_calibration_woquantization(model, quantizer_type='fake_quant'):
             logger.debug('Enable observer and Disable quant: {}'.format(name))
             submodule.enable_observer()
             submodule.disable_fake_quant()
+            if isinstance(submodule, QuantizeBase):
+                submodule.defer_qparams = defer_qparams
 
-def enable_calibration_quantization(model, quantizer_type='fake_quant'):
+def enable_calibration_quantization(model, quantizer_type='fake_quant', defer_qparams=False):
+    """See enable_calibration for defer_qparams, the quantizers calibrated this way quantize with their
+    qparams from before until finalize_calibration."""
     logger.info('Enable observer and Enable quantize for {}'.format(quantizer_type))
     for name, submodule in model.named_modules():
         if isinstance(submodule, torch.quantization.FakeQuantizeBase):
@@ -48,8 +79,13 @@ def enable_calibration_quantization(model, quantizer_type='fake_quant'):
             logger.debug('Enable observer and Enable quant: {}'.format(name))
             submodule.enable_observer()
             submodule.enable_fake_quant()
+            if isinstance(submodule, QuantizeBase):
+                submodule.defer_qparams = defer_qparams
 
 def enable_quantization(model):
+    """Qparams still deferred from calibration are computed first, see finalize_calibration."""
+    if _has_deferred_qparams(model):
+        finalize_calibration(model)
     logger.info('Disable observer and Enable quantize.')
     for name, submodule in model.named_modules():
         if isinstance(submodule, torch.quantization.FakeQuantizeBase):
@@ -65,3 +101,96 @@ def disable_all(model):
             logger.debug('Disable observer and Disable quantize: {}'.format(name))
             submodule.disable_observer()
             submodule.disable_fake_quant()
+
+
+def enable_weight_cache(model):
+    """Keep the fake quantized weights and reuse them until the weights, their qparams or the
+    quantizer state change, for evaluation and activation calibration under torch.no_grad.
+    Costs one more copy of the weights.
+    """
+    logger.info('Enable weight fake quantize cache.')
+    for name, submodule in model.named_modules():
+        if isinstance(submodule, QuantizeBase) and name.endswith('weight_fake_quant'):
+            submodule.cache_output = True
+
+
+def disable_weight_cache(model):
+    logger.info('Disable weight fake quantize cache.')
+    for name, submodule in model.named_modules():
+        if isinstance(submodule, QuantizeBase):
+            submodule.cache_output = False
+            submodule.clear_cache()
+
+
+def enable_export_mode(model):
+    """Write the scale / zero_point the quantizers use in forward back into them and switch them to
+    the traceable path of forward, with qparams exported as constants. Used by convert_deploy on its
+    copy of the model, the result is meant for tracing only.
+    """
+    logger.info('Enable export mode.')
+    for submodule in model.modules():
+        if isinstance(submodule, QuantizeBase):
+            submodule.normalize_qparams()
+            submodule.export_mode = True
+            submodule.clear_cache()
+
+
+def compile_prepared(model, **kwargs):
+    """torch.compile a model returned by prepare_by_platform, kwargs are passed to torch.compile.
+
+    Meant for QAT and evaluation, calibrate the model eagerly before: observer state set inside the
+    torch.nn.qat modules is not written back by the compiled graph. The enabled flags of the quantizers
+    are Python attributes, so toggling them recompiles the model instead of breaking the graph. The
+    weight cache is turned off, it keys on tensor versions torch.compile can not trace.
+    """
+    if not hasattr(torch, 'compile'):
+        raise RuntimeError('compile_prepared needs torch.compile (torch >= 2.0), got torch {}.'.format(
+            torch.__version__))
+    disable_weight_cache(model)
+    logger.info('Compile the prepared model.')
+    return torch.compile(model, **kwargs)
+
+
+def select_observer(model, strategy):
+    """Pick the calibration strategy of every ``MultiObserver`` and load its qparams into the
+    fake quantizer.
+
+    Args:
+        model: calibrated model.
+        strategy: an observer name used for every quantizer, a dict mapping quantizer names to
+            observer names (quantizers not in it keep their active observer), or a callable taking
+            the quantizer name and the dict of qparams per observer and returning an observer name.
+    """
+    from mqbench.observer import MultiObserver
+    for name, submodule in model.named_modules():
+        if not isinstance(submodule, torch.quantization.FakeQuantizeBase) or \
+                not isinstance(submodule.activation_post_process, MultiObserver):
+            continue
+        observer = submodule.activation_post_process
+        if isinstance(strategy, str):
+            observer.select(strategy)
+        elif isinstance(strategy, dict):
+            if name in strategy:
+                observer.select(strategy[name])
+        else:
+            observer.select(strategy(name, observer.calculate_all_qparams()))
+        logger.debug('Select {} for {}'.format(observer.active, name))
+        _copy_qparams(submodule, *observer.calculate_qparams())
+
+
+def load_qparams(model, qparams):
+    """Load a dict of quantizer name to (scale, zero_point) into the fake quantizers of model."""
+    for name, submodule in model.named_modules():
+        if isinstance(submodule, torch.quantization.FakeQuantizeBase) and name in qparams:
+            _copy_qparams(submodule, *qparams[name])
+
+
+def _copy_qparams(fake_quant, scale, zero_point):
+    scale, zero_point = scale.to(fake_quant.scale.device), zero_point.to(fake_quant.zero_point.device)
+    if fake_quant.scale.shape != scale.shape:
+        fake_quant.scale.data = torch.ones_like(scale, dtype=fake_quant.scale.dtype)
+        fake_quant.zero_point.data = torch.zeros_like(zero_point, dtype=fake_quant.zero_point.dtype)
+    fake_quant.scale.data.copy_(scale)
+    fake_quant.zero_point.data.copy_(zero_point)
+    if isinstance(fake_quant, QuantizeBase):
+        fake_quant.clear_cache()
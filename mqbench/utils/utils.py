@@ -7,6 +7,7 @@ from torch.nn import Module
 
 USE_LINK = False
 USE_DDP = False
+SYNC_ENABLED = True
 
 try:
     import spring.linklink as link
@@ -21,6 +22,8 @@ except (ModuleNotFoundError, AssertionError):
 def sync_tensor(tensor):
     global USE_LINK
     global USE_DDP
+    if not SYNC_ENABLED:
+        return tensor
     if USE_LINK:
         if tensor.is_cuda is True:
             tensor.data = tensor.data / link.get_world_size()
@@ -31,6 +34,100 @@ def sync_tensor(tensor):
     return tensor
 
 
+def _all_reduce(tensor, op='sum'):
+    r"""Reduce ``tensor`` over all ranks with ``op`` in ('sum', 'mean', 'min', 'max') and return the result.
+
+    linklink only offers a sum allreduce, min / max go through an allgather emulated by summing
+    a buffer where each rank fills its own slot.
+    """
+    if USE_LINK:
+        if not tensor.is_cuda:
+            return tensor
+        world_size = link.get_world_size()
+        if op in ('sum', 'mean'):
+            tensor = tensor.clone()
+            link.allreduce(tensor)
+            return tensor / world_size if op == 'mean' else tensor
+        gathered = tensor.new_zeros((world_size, ) + tensor.shape)
+        gathered[link.get_rank()] = tensor
+        link.allreduce(gathered)
+        return gathered.amin(0) if op == 'min' else gathered.amax(0)
+    reduce_op = {'sum': dist.ReduceOp.SUM, 'mean': dist.ReduceOp.SUM,
+                 'min': dist.ReduceOp.MIN, 'max': dist.ReduceOp.MAX}
+    tensor = tensor.clone()
+    dist.all_reduce(tensor, op=reduce_op[op])
+    return tensor / dist.get_world_size() if op == 'mean' else tensor
+
+
+def all_reduce_tensors(requests, bucket_numel=2 ** 22):
+    r"""Reduce a list of (tensor, op) over all ranks and return the reduced tensors.
+
+    op is one of 'sum', 'mean', 'min' and 'max'. Tensors with the same op, dtype and device are
+    flattened into buckets of about ``bucket_numel`` elements, one collective per bucket.
+    Every rank has to make the same requests in the same order.
+    """
+    if not (USE_LINK or USE_DDP) or not SYNC_ENABLED:
+        return [tensor for tensor, _ in requests]
+    results = [None] * len(requests)
+    groups = {}
+    for idx, (tensor, op) in enumerate(requests):
+        groups.setdefault((op, tensor.dtype, tensor.device), []).append(idx)
+    for (op, _, _), indices in groups.items():
+        start = 0
+        while start < len(indices):
+            end, numel = start + 1, requests[indices[start]][0].numel()
+            while end < len(indices) and numel + requests[indices[end]][0].numel() <= bucket_numel:
+                numel += requests[indices[end]][0].numel()
+                end += 1
+            bucket = [requests[idx][0].detach() for idx in indices[start:end]]
+            reduced = _all_reduce(torch.cat([tensor.reshape(-1) for tensor in bucket]), op)
+            for idx, tensor, chunk in zip(indices[start:end], bucket, reduced.split([t.numel() for t in bucket])):
+                results[idx] = chunk.view_as(tensor)
+            start = end
+    return results
+
+
+def sync_observers(model, bucket_numel=2 ** 22):
+    r"""Merge the statistics of every observer in ``model`` over all ranks, in place.
+
+    Each observer describes its merge in ``sync_state``, a generator yielding lists of
+    (tensor, op) and receiving the reduced tensors, e.g. min for min_val, max for max_val and
+    sum for histograms and counts. The requests of all observers are reduced together by
+    all_reduce_tensors, round after round until every generator is exhausted.
+    Sums are not idempotent: call it once, after calibration.
+    """
+    if not (USE_LINK or USE_DDP) or not SYNC_ENABLED:
+        return model
+    syncs = [module.sync_state() for module in model.modules() if hasattr(module, 'sync_state')]
+    pending = [(sync, next(sync, None)) for sync in syncs]
+    pending = [(sync, requests) for sync, requests in pending if requests is not None]
+    while len(pending) > 0:
+        results = all_reduce_tensors([request for _, requests in pending for request in requests], bucket_numel)
+        next_pending, offset = [], 0
+        for sync, requests in pending:
+            reduced = results[offset:offset + len(requests)]
+            offset += len(requests)
+            try:
+                next_pending.append((sync, sync.send(reduced)))
+            except StopIteration:
+                pass
+        pending = next_pending
+    return model
+
+
+class no_sync_tensor:
+    """sync_tensor does nothing inside, so the caller can sync once afterwards."""
+    def __enter__(self):
+        global SYNC_ENABLED
+        self.state = SYNC_ENABLED
+        SYNC_ENABLED = False
+
+    def __exit__(self, *args):
+        global SYNC_ENABLED
+        SYNC_ENABLED = self.state
+        self.state = None
+
+
 def pot_quantization(tensor: torch.Tensor, mode='round'):
     log2t = torch.log2(tensor)
     if mode == 'round':
@@ -42,6 +139,26 @@ def pot_quantization(tensor: torch.Tensor, mode='round'):
 
 
 
+def aminmax(x: torch.Tensor, dim=None):
+    r"""Min and max of ``x`` (over ``dim``) in one pass. Uses torch.aminmax where it exists
+    (torch >= 1.11), which torch.compile can trace, else torch._aminmax.
+    """
+    if x.dtype in (torch.float16, torch.bfloat16) and not x.is_cuda:
+        # CPU aminmax lacks these dtypes
+        return (x.min(), x.max()) if dim is None else (torch.amin(x, dim), torch.amax(x, dim))
+    if not hasattr(torch, 'aminmax'):
+        return torch._aminmax(x) if dim is None else torch._aminmax(x, dim)
+    return torch.aminmax(x) if dim is None else torch.aminmax(x, dim=dim)
+
+
+def drop_mask(x: torch.Tensor, prob: float, generator=None) -> torch.Tensor:
+    r"""Bool tensor shaped like ``x``, True with probability ``prob``. Drawn with bernoulli into one
+    byte per element instead of comparing a float32 ``rand_like``, reproducible with torch.manual_seed
+    or ``generator``.
+    """
+    return torch.empty_like(x, dtype=torch.bool).bernoulli_(prob, generator=generator)
+
+
 def is_symmetric_quant(qscheme: 'torch.qscheme') -> bool:
     return qscheme in [torch.per_tensor_symmetric, torch.per_channel_symmetric]
 
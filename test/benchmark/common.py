@@ -0,0 +1,56 @@
+import os
+import time
+import unittest
+
+import prettytable
+import torch
+from torch.profiler import profile, ProfilerActivity
+
+from mqbench.utils.logger import logger
+
+
+# The benchmarks take minutes and compare timings, they only run with MQBENCH_BENCHMARK=1. The
+# correctness of the code they measure is checked by the regular tests.
+benchmark = unittest.skipUnless(os.environ.get('MQBENCH_BENCHMARK', '0') not in ('', '0'),
+                                'set MQBENCH_BENCHMARK=1 to run the benchmarks')
+
+
+def peak_memory(fn, *args, **kwargs):
+    """Peak bytes allocated while running ``fn``, on CUDA if the inputs are there, else on CPU."""
+    device = next((arg.device for arg in args if isinstance(arg, torch.Tensor)), torch.device('cpu'))
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+        fn(*args, **kwargs)
+        torch.cuda.synchronize()
+        return torch.cuda.max_memory_allocated() - base
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        fn(*args, **kwargs)
+    usage, peak = 0, 0
+    for event in sorted(prof.events(), key=lambda e: e.time_range.start):
+        usage += event.self_cpu_memory_usage
+        peak = max(peak, usage)
+    return peak
+
+
+def elapsed_time(fn, *args, repeat=10, **kwargs):
+    """Average seconds per call of ``fn`` after one warm up call."""
+    fn(*args, **kwargs)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.time()
+    for _ in range(repeat):
+        fn(*args, **kwargs)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.time() - start) / repeat
+
+
+def report(title, rows):
+    """Log ``rows`` of (case, baseline time, new time, baseline peak bytes, new peak bytes)."""
+    table = prettytable.PrettyTable(['case', 'time (ms)', 'new time (ms)', 'peak (MB)', 'new peak (MB)'])
+    for case, time_old, time_new, mem_old, mem_new in rows:
+        table.add_row([case, '{:.3f}'.format(time_old * 1e3), '{:.3f}'.format(time_new * 1e3),
+                       '{:.2f}'.format(mem_old / 2 ** 20), '{:.2f}'.format(mem_new / 2 ** 20)])
+    logger.info('{}\n{}'.format(title, table))
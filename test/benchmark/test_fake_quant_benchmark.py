@@ -0,0 +1,308 @@
+import types
+
+import torch
+import unittest
+
+from torch.quantization import QConfig
+
+import mqbench.nn.intrinsic.qat as qnniqat
+from mqbench.fake_quantize.fixed import FixedFakeQuantize
+from mqbench.fake_quantize.dsq import FakeQuantizeDSQTraining, dsq_function_per_channel
+from mqbench.fake_quantize.tqt import FakeQuantizeTqtAffine, _fake_quantize_tqt_affine_training
+from mqbench.fake_quantize.nnie import NNIEQuantizeFunc
+from mqbench.fake_quantize.lsq import (
+    LearnableFakeQuantize,
+    FakeQuantizeLearnablePerchannelAffineTraining,
+    _fake_quantize_learnable_per_channel_affine_training
+)
+from mqbench.observer import MinMaxObserver
+from mqbench.prepare_by_platform import prepare_by_platform, BackendType
+from mqbench.utils import drop_mask
+from mqbench.utils.state import enable_calibration, enable_quantization, enable_weight_cache, compile_prepared
+
+from .common import benchmark, peak_memory, elapsed_time, report
+from ..version import GITHUB_RES
+
+
+def _forward(fn, x, scale, zero_point, ch_axis):
+    return fn(x, scale, zero_point, ch_axis, -128, 127, 1.0)
+
+
+def _forward_backward(fn, x, scale, zero_point, ch_axis):
+    y = fn(x, scale, zero_point, ch_axis, -128, 127, 1.0)
+    y.backward(torch.ones_like(y))
+
+
+def _item_fake_quantize(fake_quant, x):
+    # What FixedFakeQuantize did before: read the flags and qparams back to the host.
+    if fake_quant.observer_enabled[0] == 1:
+        fake_quant.activation_post_process(x.detach())
+    if fake_quant.fake_quant_enabled[0] == 1:
+        x = torch.fake_quantize_per_tensor_affine(
+            x, fake_quant.scale.item(), int(fake_quant.zero_point.item()), fake_quant.quant_min, fake_quant.quant_max)
+    return x
+
+
+def _nnie_float64(x, data_max):
+    # What NNIEQuantizeFunc did before: float64 and a boolean index per sign.
+    z = (16 * torch.log2(data_max.double())).round() - 127
+    x = x.double()
+    pos_idx = x > 2 ** ((z - 16) / 16)
+    neg_idx = x < - 2 ** ((z + 1 - 16) / 16)
+    zero_idx = (x >= - 2 ** ((z + 1 - 16) / 16)) & (x < 2 ** ((z - 16) / 16))
+    x[zero_idx] = 0
+    x[pos_idx] = 2 ** ((torch.clamp(torch.round(16 * torch.log2(x[pos_idx]) - z), 0, 127) + z) / 16)
+    x[neg_idx] = - 2 ** ((torch.clamp(torch.round(16 * torch.log2(-x[neg_idx]) - z), 1, 127) + z) / 16)
+    return x.float()
+
+
+def _drop_rand_like(x_quant, x, prob):
+    # What QDrop did before: a float32 rand_like compared with prob.
+    return torch.where(torch.rand_like(x_quant) < prob, x_quant, x)
+
+
+def _drop_bernoulli(x_quant, x, prob):
+    return torch.where(drop_mask(x_quant, prob), x_quant, x)
+
+
+def _sweep_reobserve(fake_quants, weights, bitwidths):
+    # What mix_precision did before: edit the ranges and observe the weight again for every bit width.
+    outs = []
+    for fake_quant, weight in zip(fake_quants, weights):
+        fake_quant.enable_observer()
+        for bits in bitwidths:
+            fake_quant.quant_min = fake_quant.activation_post_process.quant_min = -2 ** (bits - 1)
+            fake_quant.quant_max = fake_quant.activation_post_process.quant_max = 2 ** (bits - 1) - 1
+            outs.append(fake_quant(weight))
+        fake_quant.disable_observer()
+    return outs
+
+
+def _sweep_select(fake_quants, weights, bitwidths):
+    outs = []
+    for fake_quant, weight in zip(fake_quants, weights):
+        for bits in bitwidths:
+            fake_quant.select_bitwidth(bits)
+            outs.append(fake_quant(weight))
+    return outs
+
+
+def _upcast_forward(fake_quant, x):
+    # What a bfloat16 run had to do before: quantize a float32 copy and cast the result back.
+    return fake_quant(x.float()).to(x.dtype)
+
+
+def _upcast_step(fake_quant, x):
+    _upcast_forward(fake_quant, x).sum().backward()
+
+
+def _native_step(fake_quant, x):
+    fake_quant(x).sum().backward()
+
+
+
+def _dsq_step(fn, x, scale, zero_point):
+    fn(x, scale, zero_point, 0, 15, 1, 0.4).sum().backward()
+
+
+class _TqtAffineOld(torch.autograd.Function):
+    # FakeQuantizeTqtAffine before: qmin / qmax saved as tensors, the mask built out of place.
+    @staticmethod
+    def forward(ctx, x, scale, zero_point, quant_min, quant_max, mth):
+        qx = _fake_quantize_tqt_affine_training(x, scale, zero_point, quant_min, quant_max, mth)
+        ctx.save_for_backward(x, scale, torch.tensor(quant_min).type_as(x), torch.tensor(quant_max).type_as(x))
+        return qx
+
+    @staticmethod
+    def backward(ctx, grad_outputs):
+        x, s, qmin, qmax = ctx.saved_tensors
+        scaled_x = x / s
+        rounded_scaled_x = torch.where((scaled_x < 0) & (scaled_x - torch.floor(scaled_x) == 0.5),
+                                       torch.ceil(scaled_x), torch.round(scaled_x))
+        is_ge_min_and_le_max = ~(rounded_scaled_x < qmin) & ~(rounded_scaled_x > qmax)
+        grad_x = grad_outputs.clone()
+        return torch.where(is_ge_min_and_le_max, grad_x, 0 * grad_x), None, None, None, None, None
+
+
+def _tqt_step(fn, x, scale):
+    fn(x, scale, torch.zeros(1), -8, 7, torch.tensor(2)).sum().backward()
+
+@benchmark
+class TestFakeQuantBenchmark(unittest.TestCase):
+    def test_lsq_per_channel(self):
+        rows = []
+        for case, shape, ch_axis in [('NCHW activation, ch_axis=1', (8, 64, 56, 56), 1),
+                                     ('OIHW weight, ch_axis=0', (256, 256, 3, 3), 0)]:
+            x = torch.randn(shape, requires_grad=True)
+            scale = torch.full((shape[ch_axis], ), 0.05, requires_grad=True)
+            zero_point = torch.zeros(shape[ch_axis], requires_grad=True)
+            args = (x, scale, zero_point, ch_axis)
+            # Peak of the forward pass is what stays alive for backward while training.
+            mem_old = peak_memory(_forward, _fake_quantize_learnable_per_channel_affine_training, *args)
+            mem_new = peak_memory(_forward, FakeQuantizeLearnablePerchannelAffineTraining.apply, *args)
+            rows.append((case, elapsed_time(_forward_backward, _fake_quantize_learnable_per_channel_affine_training, *args),
+                         elapsed_time(_forward_backward, FakeQuantizeLearnablePerchannelAffineTraining.apply, *args),
+                         mem_old, mem_new))
+            self.assertLess(mem_new, 2 * x.numel() * x.element_size())
+            self.assertLess(mem_new, mem_old)
+        report('Per-channel LSQ, time of forward + backward, peak of forward', rows)
+
+
+    def test_sync_free_per_tensor(self):
+        rows = []
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        fake_quant = FixedFakeQuantize(MinMaxObserver, quant_min=0, quant_max=255).to(device)
+        fake_quant(torch.rand(64, device=device))
+        fake_quant.disable_observer()
+        for case, shape in [('small activation', (1, 64, 14, 14)), ('large activation', (8, 64, 56, 56))]:
+            x = torch.rand(shape, device=device)
+            self.assertTrue(torch.equal(_item_fake_quantize(fake_quant, x), fake_quant(x)))
+            rows.append((case, elapsed_time(_item_fake_quantize, fake_quant, x, repeat=100),
+                         elapsed_time(fake_quant, x, repeat=100),
+                         peak_memory(_item_fake_quantize, fake_quant, x), peak_memory(fake_quant, x)))
+        report('Per-tensor FixedFakeQuantize on {}, with and without host reads'.format(device), rows)
+
+    def test_weight_cache(self):
+        rows = []
+        qconfig = QConfig(activation=torch.nn.Identity, weight=LearnableFakeQuantize.with_args(
+            observer=MinMaxObserver, quant_min=-8, quant_max=7, dtype=torch.qint8,
+            qscheme=torch.per_channel_symmetric, ch_axis=0))
+        float_module = torch.nn.intrinsic.ConvBn2d(torch.nn.Conv2d(256, 256, 3, padding=1), torch.nn.BatchNorm2d(256))
+        float_module.qconfig = qconfig
+        module = qnniqat.ConvBn2d.from_float(float_module)
+        module.bias_fake_quant.set_quant_type('tensor')
+        module(torch.randn(2, 256, 7, 7))
+        module.eval()
+        module.weight_fake_quant.disable_observer()
+        module.bias_fake_quant.disable_observer()
+        x = torch.randn(1, 256, 7, 7)
+        with torch.no_grad():
+            out, time_old, mem_old = module(x), elapsed_time(module, x), peak_memory(module, x)
+            enable_weight_cache(module)
+            self.assertTrue(torch.equal(out, module(x)))
+            rows.append(('ConvBn2d 256x256x3x3, 1x256x7x7', time_old, elapsed_time(module, x),
+                         mem_old, peak_memory(module, x)))
+        report('Evaluation with and without the weight cache', rows)
+
+    @unittest.skipIf(not hasattr(torch, 'compile'), 'torch.compile needs torch >= 2.0')
+    def test_compile_prepared(self):
+        model_to_quantize = torch.hub.load(GITHUB_RES, 'resnet18', pretrained=False)
+        dummy_input = torch.randn(2, 3, 224, 224, device='cpu')
+        model_to_quantize.train()
+        model_prepared = prepare_by_platform(model_to_quantize, BackendType.Tensorrt)
+        enable_calibration(model_prepared)
+        model_prepared(dummy_input)
+        enable_quantization(model_prepared)
+        model_compiled = compile_prepared(model_prepared)
+
+        def train_step(model, x):
+            model(x).sum().backward()
+
+        rows = [('resnet18 Tensorrt QAT step, 2x3x224x224',
+                 elapsed_time(train_step, model_prepared, dummy_input),
+                 elapsed_time(train_step, model_compiled, dummy_input),
+                 peak_memory(train_step, model_prepared, dummy_input),
+                 peak_memory(train_step, model_compiled, dummy_input))]
+        model_prepared.eval()
+        with torch.no_grad():
+            out, out_compiled = model_prepared(dummy_input), model_compiled(dummy_input)
+            # a different accumulation order may move a few values by one quantization step
+            self.assertLess(float((out - out_compiled).norm() / out.norm()), 1e-2)
+            rows.append(('resnet18 Tensorrt evaluation, 2x3x224x224',
+                         elapsed_time(model_prepared, dummy_input), elapsed_time(model_compiled, dummy_input),
+                         peak_memory(model_prepared, dummy_input), peak_memory(model_compiled, dummy_input)))
+        report('Prepared resnet18, eager and compile_prepared', rows)
+
+    def test_nnie(self):
+        rows = []
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        for case, shape in [('small activation', (1, 64, 14, 14)), ('large activation', (8, 64, 56, 56))]:
+            x = torch.randn(shape, device=device)
+            data_max = x.abs().max() * 0.7
+            out_old, out_new = _nnie_float64(x, data_max), NNIEQuantizeFunc.apply(x, data_max)
+            self.assertLess((~torch.isclose(out_old, out_new, rtol=1e-6, atol=0)).float().mean().item(), 1e-3)
+            rows.append((case, elapsed_time(_nnie_float64, x, data_max), elapsed_time(NNIEQuantizeFunc.apply, x, data_max),
+                         peak_memory(_nnie_float64, x, data_max), peak_memory(NNIEQuantizeFunc.apply, x, data_max)))
+        report('NNIE fake quantize on {}, float64 masks and float32 in one buffer'.format(device), rows)
+
+    def test_qdrop_mask(self):
+        rows = []
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        for case, shape in [('small activation', (1, 64, 14, 14)), ('large activation', (8, 64, 112, 112))]:
+            x = torch.randn(shape, device=device)
+            x_quant = x.round()
+            mask = drop_mask(x, 0.5)
+            self.assertEqual(mask.dtype, torch.bool)
+            self.assertAlmostEqual(mask.float().mean().item(), 0.5, delta=0.02)
+            rows.append((case, elapsed_time(_drop_rand_like, x_quant, x, 0.5),
+                         elapsed_time(_drop_bernoulli, x_quant, x, 0.5),
+                         peak_memory(_drop_rand_like, x_quant, x, 0.5), peak_memory(_drop_bernoulli, x_quant, x, 0.5)))
+        report('QDrop mix of quantized and float activations on {}, rand_like and bernoulli mask'.format(device), rows)
+
+    def test_select_bitwidth(self):
+        bitwidths = [2, 4, 6, 8]
+        fake_quants, weights = [], []
+        for _ in range(16):
+            fake_quant = FixedFakeQuantize(MinMaxObserver, quant_min=-128, quant_max=127, dtype=torch.qint8,
+                                           qscheme=torch.per_channel_symmetric, ch_axis=0)
+            weight = torch.randn(256, 256, 3, 3)
+            fake_quant(weight)
+            fake_quant.disable_observer()
+            fake_quant.precompute_bitwidths(bitwidths, weight)
+            fake_quants.append(fake_quant)
+            weights.append(weight)
+        with torch.no_grad():
+            for out_old, out_new in zip(_sweep_reobserve(fake_quants, weights, bitwidths),
+                                        _sweep_select(fake_quants, weights, bitwidths)):
+                self.assertTrue(torch.equal(out_old, out_new))
+            rows = [('16 x 256x256x3x3 per-channel, 2/4/6/8 bits',
+                     elapsed_time(_sweep_reobserve, fake_quants, weights, bitwidths, repeat=3),
+                     elapsed_time(_sweep_select, fake_quants, weights, bitwidths, repeat=3),
+                     peak_memory(_sweep_reobserve, fake_quants, weights, bitwidths),
+                     peak_memory(_sweep_select, fake_quants, weights, bitwidths))]
+        report('Bit width sweep of the weight quantizers, observing again and switching precomputed qparams', rows)
+
+    def test_bfloat16(self):
+        rows = []
+        for case, shape, kwargs in [
+                ('LSQ per-tensor, 8x64x56x56', (8, 64, 56, 56), dict(quant_min=0, quant_max=255)),
+                ('LSQ per-channel, 256x256x3x3', (256, 256, 3, 3),
+                 dict(quant_min=-128, quant_max=127, dtype=torch.qint8, qscheme=torch.per_channel_symmetric, ch_axis=0))]:
+            fake_quant = LearnableFakeQuantize(MinMaxObserver, **kwargs)
+            x = torch.randn(shape, dtype=torch.bfloat16, requires_grad=True)
+            fake_quant(x)
+            fake_quant.disable_observer()
+            self.assertEqual(fake_quant(x).dtype, torch.bfloat16)
+            self.assertTrue(torch.equal(fake_quant(x), _upcast_forward(fake_quant, x)))
+            # Peak of the forward pass is what stays alive for backward while training.
+            mem_old, mem_new = peak_memory(_upcast_forward, fake_quant, x), peak_memory(fake_quant, x)
+            self.assertLess(mem_new, mem_old)
+            rows.append((case, elapsed_time(_upcast_step, fake_quant, x), elapsed_time(_native_step, fake_quant, x),
+                         mem_old, mem_new))
+        report('bfloat16 fake quantize on cpu, time of forward + backward, peak of forward', rows)
+
+    def test_dsq_tqt(self):
+        x = torch.randn(8, 64, 56, 56, requires_grad=True)
+        scale, zero_point = torch.full((64, ), 0.2), torch.zeros(64)
+        y = dsq_function_per_channel(x, scale, zero_point, 0, 15, 1, 0.4)
+        self.assertTrue(torch.equal(y, FakeQuantizeDSQTraining.apply(x, scale, zero_point, 0, 15, 1, 0.4)))
+        del y
+        # Peak of the forward pass is what stays alive for backward while training.
+        mem_old = peak_memory(dsq_function_per_channel, x, scale, zero_point, 0, 15, 1, 0.4)
+        mem_new = peak_memory(FakeQuantizeDSQTraining.apply, x, scale, zero_point, 0, 15, 1, 0.4)
+        self.assertLess(mem_new, 3 * x.numel() * x.element_size())
+        self.assertLess(mem_new, mem_old)
+        rows = [('DSQ per-channel 4 bit, peak of forward', elapsed_time(_dsq_step, dsq_function_per_channel, x, scale,
+                                                                        zero_point),
+                 elapsed_time(_dsq_step, FakeQuantizeDSQTraining.apply, x, scale, zero_point), mem_old, mem_new)]
+        scale, grad_output = torch.tensor([0.25]), torch.randn_like(x)
+        # Call backward directly, the profiler does not see what autograd allocates in it.
+        ctx_old = types.SimpleNamespace(saved_tensors=(x, scale, torch.tensor(-8.), torch.tensor(7.)))
+        ctx_new = types.SimpleNamespace(saved_tensors=(x, scale), quant_min=-8, quant_max=7)
+        mem_old = peak_memory(_TqtAffineOld.backward, ctx_old, grad_output)
+        mem_new = peak_memory(FakeQuantizeTqtAffine.backward, ctx_new, grad_output)
+        self.assertLess(mem_new, 2 * x.numel() * x.element_size())
+        self.assertLess(mem_new, mem_old)
+        rows.append(('TQT 4 bit, peak of backward', elapsed_time(_tqt_step, _TqtAffineOld.apply, x, scale),
+                     elapsed_time(_tqt_step, FakeQuantizeTqtAffine.apply, x, scale), mem_old, mem_new))
+        report('DSQ / TQT with recomputing backward on 8x64x56x56, time of forward + backward', rows)
\ No newline at end of file
@@ -0,0 +1,36 @@
+import torch
+import unittest
+
+from mqbench.observer import _channel_aminmax, _channel_reduce_dims
+from mqbench.utils.moments import Moments
+
+from .common import benchmark, peak_memory, elapsed_time, report
+
+
+def _permute_flatten_stats(x, ch_axis):
+    new_axis_list = [i for i in range(x.dim())]  # noqa: C416
+    new_axis_list[ch_axis] = 0
+    new_axis_list[0] = ch_axis
+    y = torch.flatten(x.permute(new_axis_list), start_dim=1)
+    return torch._aminmax(y, 1), y.mean(1), y.std(1)
+
+
+def _channel_stats(x, ch_axis):
+    min_val, max_val = _channel_aminmax(x, ch_axis)
+    return Moments.from_tensor(x, _channel_reduce_dims(x, ch_axis), min_val, max_val)
+
+
+@benchmark
+class TestObserverBenchmark(unittest.TestCase):
+    def test_per_channel_reduction(self):
+        rows = []
+        x = torch.randn(8, 64, 56, 56)
+        for case, data, ch_axis in [('NCHW, ch_axis=1', x, 1),
+                                    ('channels_last, ch_axis=1', x.to(memory_format=torch.channels_last), 1),
+                                    ('OIHW weight, ch_axis=0', torch.randn(256, 256, 3, 3), 0)]:
+            mem_old = peak_memory(_permute_flatten_stats, data, ch_axis)
+            mem_new = peak_memory(_channel_stats, data, ch_axis)
+            rows.append((case, elapsed_time(_permute_flatten_stats, data, ch_axis),
+                         elapsed_time(_channel_stats, data, ch_axis), mem_old, mem_new))
+            self.assertLess(mem_new, data.numel() * data.element_size())
+        report('Per-channel min/max/mean/std', rows)
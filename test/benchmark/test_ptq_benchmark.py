@@ -0,0 +1,238 @@
+import copy
+import time
+import numpy as np
+import torch
+import unittest
+from types import SimpleNamespace
+from torch import fx, nn
+from torch.quantization import QConfig
+
+from mqbench.advanced_ptq import ReconstructionBatches, SequentialActivationCache, save_inp_oup_data, to_device, \
+    subgraph_reconstruction, lp_loss
+from mqbench.fake_quantize.adaround_quantizer import AdaRoundFakeQuantize
+from mqbench.observer import MinMaxObserver
+from mqbench.utils.logger import logger
+from mqbench.utils.compression import CompressedTensor, compress, decompress
+from mqbench.utils.disk_cache import DiskTensorList, MemoryBudget
+
+from .common import benchmark, peak_memory, elapsed_time, report
+
+
+class _BasicBlock(nn.Module):
+    def __init__(self, channels):
+        super().__init__()
+        self.conv1 = nn.Conv2d(channels, channels, 3, padding=1)
+        self.relu1 = nn.ReLU(inplace=True)
+        self.conv2 = nn.Conv2d(channels, channels, 3, padding=1)
+        # save_inp_oup_data hooks modules, so each one is called once
+        self.relu2 = nn.ReLU(inplace=True)
+
+    def forward(self, x):
+        out = self.conv2(self.relu1(self.conv1(x)))
+        out += x
+        return self.relu2(out)
+
+
+class _ResNet(nn.Module):
+    def __init__(self, num_blocks, channels=16):
+        super().__init__()
+        self.stem = nn.Conv2d(3, channels, 3, padding=1)
+        self.blocks = nn.Sequential(*[_BasicBlock(channels) for _ in range(num_blocks)])
+        self.fc = nn.Linear(channels, 10)
+
+    def forward(self, x):
+        return self.fc(self.blocks(self.stem(x)).mean((2, 3)))
+
+
+def _block_nodes(model):
+    # (input node, output node) of every residual block, as ptq_reconstruction gets them
+    nodes = {node.target: node for node in model.graph.nodes if node.op == 'call_module'}
+    return [(nodes['blocks.{}.conv1'.format(name)].args[0], nodes['blocks.{}.relu2'.format(name)])
+            for name, _ in model.blocks.named_children()]
+
+
+def _prefix_forwards(fp32_model, quant_model, blocks, cali_data):
+    # What ptq_reconstruction did before: three forwards of the model prefix for every block.
+    fp32_modules, quant_modules = dict(fp32_model.named_modules()), dict(quant_model.named_modules())
+    outputs = []
+    for input_node, output_node in blocks:
+        fp32_input = save_inp_oup_data(fp32_model, None, fp32_modules[input_node.target], cali_data, store_inp=False)[1]
+        fp32_output = save_inp_oup_data(fp32_model, None, fp32_modules[output_node.target], cali_data,
+                                        store_inp=False)[1]
+        quant_input = save_inp_oup_data(quant_model, None, quant_modules[input_node.target], cali_data,
+                                        store_inp=False)[1]
+        outputs.append((fp32_input, fp32_output, quant_input))
+    return outputs
+
+
+def _sequential(fp32_model, quant_model, blocks, cali_data):
+    fp32_cache = SequentialActivationCache(fp32_model, cali_data)
+    quant_cache = SequentialActivationCache(quant_model, cali_data)
+    fp32_nodes = {node.name: node for node in fp32_model.graph.nodes}
+    outputs = []
+    for input_node, output_node in blocks:
+        fp32_input, fp32_output = fp32_cache.get([fp32_nodes[input_node.name], fp32_nodes[output_node.name]])
+        quant_input, = quant_cache.get([input_node])
+        outputs.append((fp32_input, fp32_output, quant_input))
+        quant_cache.evict([output_node])
+    return outputs
+
+
+def _read_blocks(model, blocks, cali_data, budget):
+    # The reads of subgraph_reconstruction: every batch of the input and output of each block, in random order.
+    cache = SequentialActivationCache(model, cali_data, keep_gpu=False, budget=budget)
+    total = 0.
+    for input_node, output_node in blocks:
+        inputs, outputs = cache.get([input_node, output_node])
+        for idx in torch.randperm(len(inputs)).tolist():
+            total += float((inputs[idx] - outputs[idx]).abs().sum())
+    return total
+
+
+def _indexed_steps(cached_inps, cached_oups, device, max_count):
+    # What subgraph_reconstruction did before: a synchronous to_device of every input and the output per step.
+    steps = []
+    for _ in range(max_count):
+        idx = np.random.randint(0, len(cached_oups))
+        steps.append([to_device(inps[idx], device) for inps in cached_inps] + [to_device(cached_oups[idx], device)])
+    return steps
+
+
+def _prefetched_steps(cached_inps, cached_oups, device, max_count):
+    return list(ReconstructionBatches(cached_inps, cached_oups, 1.0, device, max_count))
+
+
+def _cached_bytes(values):
+    return sum([x.nbytes if isinstance(x, CompressedTensor) else x.numel() * x.element_size()
+                for batches in values for x in batches])
+
+
+def _reconstruct(layer, cali_data, targets, max_count, adaptive_budget=None):
+    # (seconds, reconstruction loss after hard rounding) of one AdaRound layer
+    subgraph = nn.Sequential(copy.deepcopy(layer))
+    config = SimpleNamespace(max_count=max_count, warm_up=0.2, weight=0.01, b_range=[20, 2], prob=1.0,
+                             round_mode='learned_hard_sigmoid')
+    if adaptive_budget is not None:
+        config.adaptive_budget = adaptive_budget
+    start = time.time()
+    subgraph_reconstruction(subgraph, [cali_data], targets, config)
+    elapsed = time.time() - start
+    with torch.no_grad():
+        loss = sum([float(lp_loss(subgraph(x), y)) for x, y in zip(cali_data, targets)]) / len(cali_data)
+    return elapsed, loss
+
+
+@benchmark
+class TestPTQBenchmark(unittest.TestCase):
+    def test_sequential_activation_cache(self):
+        rows = []
+        cali_data = [torch.randn(8, 3, 32, 32) for _ in range(4)]
+        for num_blocks in [4, 16]:
+            fp32_model = fx.symbolic_trace(_ResNet(num_blocks)).eval()
+            quant_model = fx.symbolic_trace(_ResNet(num_blocks)).eval()
+            blocks = _block_nodes(quant_model)
+            for old, new in zip(_prefix_forwards(fp32_model, quant_model, blocks, cali_data),
+                                _sequential(fp32_model, quant_model, blocks, cali_data)):
+                for old_batches, new_batches in zip(old, new):
+                    self.assertTrue(all([torch.equal(x, y) for x, y in zip(old_batches, new_batches)]))
+            args = (fp32_model, quant_model, blocks, cali_data)
+            rows.append(('{} residual blocks, 4 batches'.format(num_blocks),
+                         elapsed_time(_prefix_forwards, *args, repeat=2), elapsed_time(_sequential, *args, repeat=2),
+                         peak_memory(_prefix_forwards, *args), peak_memory(_sequential, *args)))
+        self.assertLess(rows[-1][2], rows[-1][1])
+        report('Block inputs / outputs for ptq_reconstruction, prefix forwards and sequential cache', rows)
+
+
+    def test_disk_activation_cache(self):
+        cali_data = [torch.randn(8, 3, 64, 64) for _ in range(8)]
+        model = fx.symbolic_trace(_ResNet(4)).eval()
+        blocks = _block_nodes(model)
+        budget = MemoryBudget(2 ** 20)
+        cache = SequentialActivationCache(model, cali_data, keep_gpu=False, budget=budget)
+        in_memory = SequentialActivationCache(model, cali_data, keep_gpu=False)
+        for input_node, output_node in blocks:
+            values = cache.get([input_node, output_node])
+            self.assertTrue(all([len(batches.disk) > 0 for batches in values]))
+            self.assertLessEqual(budget.used, budget.max_bytes)
+            for old_batches, new_batches in zip(in_memory.get([input_node, output_node]), values):
+                self.assertTrue(all([torch.equal(x, y) for x, y in zip(old_batches, new_batches)]))
+        del cache, values
+        self.assertEqual(budget.used, 0)
+        args = (model, blocks, cali_data)
+        rows = [('4 residual blocks, 8 batches of 8x16x64x64, 1MB budget',
+                 elapsed_time(_read_blocks, *args, None, repeat=2), elapsed_time(_read_blocks, *args, budget, repeat=2),
+                 peak_memory(_read_blocks, *args, None), peak_memory(_read_blocks, *args, budget))]
+        self.assertEqual(budget.used, 0)
+        self.assertLess(rows[0][4], rows[0][3])
+        report('Cached activations of ptq_reconstruction with keep_gpu False, in memory and on disk', rows)
+
+    def test_reconstruction_batches(self):
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        cached_inps = [[torch.randn(16, 64, 56, 56) for _ in range(8)] for _ in range(2)]
+        cached_oups = [torch.randn(16, 64, 56, 56) for _ in range(8)]
+        args = (cached_inps, cached_oups, device, 20)
+        np.random.seed(0)
+        old = _indexed_steps(*args)
+        np.random.seed(0)
+        new = _prefetched_steps(*args)
+        for old_step, new_step in zip(old, new):
+            self.assertTrue(all([torch.equal(x, y) for x, y in zip(old_step, new_step)]))
+        steps = list(ReconstructionBatches((cached_inps, cached_inps), cached_oups, 0.5, device, 3, batches_per_step=3))
+        self.assertEqual(len(steps), 3)
+        self.assertTrue(all([len(step) == 5 and step[-1].shape[0] == 48 for step in steps]))
+        rows = [('{} steps of 3 x 16x64x56x56 on {}'.format(args[-1], device),
+                 elapsed_time(_indexed_steps, *args, repeat=2), elapsed_time(_prefetched_steps, *args, repeat=2),
+                 peak_memory(_indexed_steps, *args), peak_memory(_prefetched_steps, *args))]
+        report('Steps of subgraph_reconstruction, synchronous copies and ReconstructionBatches', rows)
+
+    def test_compressed_activation_cache(self):
+        cali_data = [torch.randn(8, 3, 32, 32) for _ in range(4)]
+        model = fx.symbolic_trace(_ResNet(4)).eval()
+        blocks = _block_nodes(model)
+        reference = SequentialActivationCache(model, cali_data)
+        expected = [reference.get(list(block)) for block in blocks]
+        rows = []
+        for cache_dtype, rtol in [('float16', 1e-2), ('bfloat16', 1e-1), ('int8', 1e-1)]:
+            x = torch.randn(8, 16, 32, 32)
+            self.assertLess(float((decompress(compress(x, cache_dtype)) - x).norm() / x.norm()), rtol)
+            cache = SequentialActivationCache(model, cali_data, keep_gpu=False, cache_dtype=cache_dtype)
+            values = [cache.get(list(block)) for block in blocks]
+            for old, new in zip(expected, values):
+                for old_batches, new_batches in zip(old, new):
+                    self.assertTrue(all([isinstance(y, CompressedTensor) for y in new_batches]))
+                    self.assertTrue(all([float((decompress(y) - x).norm() / x.norm()) < rtol
+                                         for x, y in zip(old_batches, new_batches)]))
+            # compressed batches go through the disk and into steps of several batches
+            on_disk = DiskTensorList()
+            for y in values[0][0]:
+                on_disk.append(y)
+            step = next(iter(ReconstructionBatches([values[0][0]], on_disk, 1.0, 'cpu', 1, batches_per_step=2)))
+            self.assertEqual(step[0].shape, (16, 16, 32, 32))
+            self.assertEqual(step[0].dtype, torch.float32)
+            old_steps, new_steps = [expected[-1][0], expected[-1][1]], values[-1]
+            rows.append(('4 blocks, 4 batches, {}'.format(cache_dtype),
+                         elapsed_time(_prefetched_steps, old_steps[:1], old_steps[1], 'cpu', 20, repeat=2),
+                         elapsed_time(_prefetched_steps, new_steps[:1], new_steps[1], 'cpu', 20, repeat=2),
+                         _cached_bytes(sum(expected, [])), _cached_bytes(sum(values, []))))
+        self.assertLess(rows[-1][4] * 3, rows[-1][3])
+        report('Block inputs / outputs of 4 residual blocks (bytes kept) and 20 steps read from them, compressed',
+               rows)
+
+    def test_adaptive_iteration_budget(self):
+        torch.manual_seed(0)
+        np.random.seed(0)
+        weight_fake_quant = AdaRoundFakeQuantize.with_args(observer=MinMaxObserver, quant_min=-8, quant_max=7,
+                                                           dtype=torch.qint8, qscheme=torch.per_tensor_symmetric)
+        fp32_layer = nn.Conv2d(16, 16, 3, padding=1)
+        layer = nn.qat.Conv2d(16, 16, 3, padding=1, qconfig=QConfig(weight=weight_fake_quant, activation=None))
+        layer.load_state_dict(fp32_layer.state_dict(), strict=False)
+        cali_data = [torch.randn(8, 16, 16, 16) for _ in range(8)]
+        with torch.no_grad():
+            layer.weight_fake_quant(layer.weight)
+            targets = [fp32_layer(x) for x in cali_data]
+        time_old, loss_old = _reconstruct(layer, cali_data, targets, 5000)
+        time_new, loss_new = _reconstruct(layer, cali_data, targets, 5000, {})
+        self.assertLess(time_new, time_old)
+        self.assertLess(loss_new, loss_old * 1.05)
+        logger.info('AdaRound of a 16x16x3x3 conv: 5000 iterations {:.2f}s, loss {:.5f}; adaptive budget {:.2f}s, '
+                    'loss {:.5f}'.format(time_old, loss_old, time_new, loss_new))
\ No newline at end of file
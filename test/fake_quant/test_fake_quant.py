@@ -1,9 +1,33 @@
+import copy
 import torch
 import unittest
+from collections import OrderedDict
 
-from mqbench.prepare_by_platform import prepare_by_platform, BackendType
+from mqbench.prepare_by_platform import prepare_by_platform, get_qconfig_by_platform, BackendType
 from mqbench.convert_deploy import convert_deploy
-from mqbench.utils.state import enable_calibration, enable_quantization
+from mqbench.fake_quantize.nnie import NNIEQuantizeFunc
+from mqbench.fake_quantize.qdrop_quantizer import QDropFakeQuantize
+from mqbench.fake_quantize.fixed import FixedFakeQuantize
+from mqbench.fake_quantize.adaround_quantizer import AdaRoundFakeQuantize
+from mqbench.fake_quantize.dsq import FakeQuantizeDSQTraining, dsq_function_per_tensor, dsq_function_per_channel
+from mqbench.fake_quantize.tqt import FakeQuantizeTqtAffine
+from mqbench.observer import MinMaxObserver
+from mqbench.scheme import QuantizeScheme
+from mqbench.deploy import collect_group_qparams
+from mqbench.fake_quantize.lsq import (
+    LearnableFakeQuantize,
+    FakeQuantizeLearnablePerchannelAffineTraining,
+    _fake_quantize_learnable_per_channel_affine_training
+)
+from mqbench.utils.state import (
+    enable_calibration,
+    enable_calibration_woquantization,
+    enable_calibration_quantization,
+    enable_quantization,
+    finalize_calibration,
+    enable_weight_cache,
+    compile_prepared
+)
 
 from ..version import GITHUB_RES
 
@@ -127,4 +151,336 @@ class TestFakeQuantize(unittest.TestCase):
         loss = model_prepared(dummy_input).sum()
         loss.backward()
         model_prepared.eval()
-        convert_deploy(model_prepared, BackendType.Tensorrt, {'x': [1, 3, 224, 224]}, model_name='resnet18_dsq_trt.onnx')
\ No newline at end of file
+        convert_deploy(model_prepared, BackendType.Tensorrt, {'x': [1, 3, 224, 224]}, model_name='resnet18_dsq_trt.onnx')
+
+    def test_deferred_qparams(self):
+        for fake_quantize in ['FixedFakeQuantize', 'LearnableFakeQuantize', 'DSQFakeQuantize']:
+            model_to_quantize = torch.hub.load(GITHUB_RES, 'resnet18', pretrained=False)
+            dummy_input = torch.randn(2, 3, 224, 224, device='cpu')
+            model_to_quantize.train()
+            extra_qconfig_dict = {
+                'w_observer': 'MinMaxObserver',
+                'a_observer': 'EMAMinMaxObserver',
+                'w_fakequantize': fake_quantize,
+                'a_fakequantize': fake_quantize,
+            }
+            prepare_custom_config_dict = {'extra_qconfig_dict': extra_qconfig_dict}
+            model_prepared = prepare_by_platform(model_to_quantize, BackendType.Tensorrt, prepare_custom_config_dict)
+            model_deferred = copy.deepcopy(model_prepared)
+            enable_calibration(model_prepared)
+            enable_calibration(model_deferred, defer_qparams=True)
+            for data in [dummy_input, dummy_input * 2]:
+                model_prepared(data)
+                model_deferred(data)
+            finalize_calibration(model_deferred)
+            for (name, module), deferred in zip(model_prepared.named_modules(), model_deferred.modules()):
+                if isinstance(module, torch.quantization.FakeQuantizeBase):
+                    self.assertTrue(torch.equal(module.scale, deferred.scale), name)
+                    self.assertTrue(torch.equal(module.zero_point, deferred.zero_point), name)
+            enable_quantization(model_deferred)
+            loss = model_deferred(dummy_input).sum()
+            loss.backward()
+
+    def test_deferred_qparams_without_finalize(self):
+        data = [torch.randn(4, 16), torch.randn(4, 16) * 2]
+        for enable in [enable_calibration, enable_calibration_woquantization, enable_calibration_quantization]:
+            models = [torch.nn.ModuleDict(OrderedDict(
+                fixed_fake_quant=FixedFakeQuantize(MinMaxObserver, quant_min=0, quant_max=255),
+                lsq_fake_quant=LearnableFakeQuantize(MinMaxObserver, quant_min=0, quant_max=255)))
+                for _ in range(2)]
+            enable(models[0])
+            enable(models[1], defer_qparams=True)
+            for x in data:
+                for module, deferred in zip(models[0].values(), models[1].values()):
+                    module(x)
+                    deferred(x)
+            # enable_quantization computes the deferred qparams
+            enable_quantization(models[1])
+            for module, deferred in zip(models[0].values(), models[1].values()):
+                self.assertFalse(deferred.defer_qparams)
+                self.assertTrue(torch.equal(module.scale, deferred.scale))
+                self.assertTrue(torch.equal(module.zero_point, deferred.zero_point))
+
+    def test_lsq_per_channel_function(self):
+        for shape, ch_axis in [((4, 8, 7, 7), 1), ((8, 4, 3, 3), 0)]:
+            x = torch.randn(shape, dtype=torch.double) * 3
+            scale = torch.rand(shape[ch_axis], dtype=torch.double) * 0.1 + 0.05
+            zero_point = torch.randn(shape[ch_axis], dtype=torch.double) * 2
+            grad_output = torch.randn(shape, dtype=torch.double)
+            results = []
+            for fn in [_fake_quantize_learnable_per_channel_affine_training,
+                       FakeQuantizeLearnablePerchannelAffineTraining.apply]:
+                inputs = [t.clone().requires_grad_() for t in [x, scale, zero_point]]
+                out = fn(*inputs, ch_axis, -8, 7, 0.5)
+                out.backward(grad_output)
+                results.append([out.detach()] + [t.grad for t in inputs])
+            for ref, fused in zip(*results):
+                self.assertTrue(torch.allclose(ref, fused))
+
+    def test_enabled_flags(self):
+        model_to_quantize = torch.hub.load(GITHUB_RES, 'resnet18', pretrained=False)
+        dummy_input = torch.randn(2, 3, 224, 224, device='cpu')
+        model_to_quantize.eval()
+        model_prepared = prepare_by_platform(copy.deepcopy(model_to_quantize), BackendType.Tensorrt)
+        enable_calibration(model_prepared)
+        model_prepared(dummy_input)
+        enable_quantization(model_prepared)
+        model_loaded = prepare_by_platform(copy.deepcopy(model_to_quantize), BackendType.Tensorrt)
+        model_loaded.load_state_dict(model_prepared.state_dict())
+        for module in model_loaded.modules():
+            if isinstance(module, torch.quantization.FakeQuantizeBase):
+                self.assertFalse(module._observer_enabled)
+                self.assertTrue(module._fake_quant_enabled)
+        self.assertTrue(torch.equal(model_prepared(dummy_input), model_loaded(dummy_input)))
+
+    def test_per_tensor_fake_quantize(self):
+        fake_quant = FixedFakeQuantize(MinMaxObserver, quant_min=0, quant_max=255)
+        fake_quant(torch.rand(64))
+        fake_quant.disable_observer()
+        x = torch.rand(2, 8, 5, 5)
+        expected = torch.fake_quantize_per_tensor_affine(x, fake_quant.scale.item(), int(fake_quant.zero_point.item()),
+                                                         0, 255)
+        self.assertTrue(torch.equal(fake_quant(x), expected))
+
+    def test_weight_cache(self):
+        model_to_quantize = torch.hub.load(GITHUB_RES, 'resnet18', pretrained=False)
+        dummy_input = torch.randn(2, 3, 224, 224, device='cpu')
+        model_to_quantize.train()
+        model_prepared = prepare_by_platform(model_to_quantize, BackendType.Tensorrt)
+        enable_calibration(model_prepared)
+        model_prepared(dummy_input)
+        enable_quantization(model_prepared)
+        model_prepared.eval()
+        model_cached = copy.deepcopy(model_prepared)
+        enable_weight_cache(model_cached)
+        with torch.no_grad():
+            for _ in range(2):
+                self.assertTrue(torch.equal(model_prepared(dummy_input), model_cached(dummy_input)))
+            for model in [model_prepared, model_cached]:
+                for param in model.parameters():
+                    param.mul_(0.9)
+            self.assertTrue(torch.equal(model_prepared(dummy_input), model_cached(dummy_input)))
+
+    def test_lsq_qparams_projection(self):
+        fake_quant = LearnableFakeQuantize(MinMaxObserver, quant_min=0, quant_max=255)
+        fake_quant.disable_observer()
+        fake_quant.scale.data.fill_(-0.05)
+        fake_quant.zero_point.data.fill_(300.)
+        x = torch.randn(4, 16)
+        out = fake_quant(x)
+        self.assertTrue(torch.equal(fake_quant.scale, torch.tensor([-0.05])))
+        expected = torch.fake_quantize_per_tensor_affine(x, 0.05, 255, 0, 255)
+        self.assertTrue(torch.allclose(out, expected))
+        out.sum().backward()
+        self.assertNotEqual(float(fake_quant.scale.grad), 0.)
+        state_dict = fake_quant.state_dict()
+        self.assertTrue(torch.equal(state_dict['scale'], torch.tensor([0.05])))
+        self.assertEqual(float(state_dict['zero_point']), 255.)
+        # traced directly, e.g. by torch.onnx.export outside convert_deploy
+        fake_quant.scale.data.fill_(-0.05)
+        _, traced_out = torch.jit._get_trace_graph(fake_quant, (x, ))
+        self.assertTrue(torch.equal(fake_quant.scale, torch.tensor([0.05])))
+        self.assertTrue(torch.equal(traced_out, out))
+        fake_quant.export_mode = True
+        self.assertTrue(torch.equal(fake_quant(x), out))
+
+    def test_cached_quantizer_hooks(self):
+        observer_params = QuantizeScheme(symmetry=True, bit=4, group_size=32).to_observer_params()
+        fake_quant = FixedFakeQuantize(MinMaxObserver, **observer_params)
+        weight = torch.randn(16, 128)
+        fake_quant(weight)
+        fake_quant.disable_observer()
+        fake_quant.cache_output = True
+        shapes = []
+        fake_quant.register_forward_hook(lambda module, inputs, output: shapes.append((inputs[0].shape, output.shape)))
+        with torch.no_grad():
+            outputs = [fake_quant(weight) for _ in range(2)]
+        self.assertIs(outputs[0], outputs[1])
+        self.assertEqual(shapes, [(weight.shape, weight.shape)] * 2)
+
+    @unittest.skipIf(not hasattr(torch, 'compile'), 'torch.compile needs torch >= 2.0')
+    def test_compile_prepared(self):
+        model_to_quantize = torch.hub.load(GITHUB_RES, 'resnet18', pretrained=False)
+        dummy_input = torch.randn(2, 3, 224, 224, device='cpu')
+        model_to_quantize.train()
+        model_prepared = prepare_by_platform(model_to_quantize, BackendType.Tensorrt)
+        enable_calibration(model_prepared)
+        model_prepared(dummy_input)
+        enable_quantization(model_prepared)
+        model_prepared.eval()
+        with torch.no_grad():
+            explanation = torch._dynamo.explain(model_prepared)(dummy_input)
+            self.assertEqual(explanation.graph_break_count, 0)
+            out = model_prepared(dummy_input)
+            out_compiled = compile_prepared(model_prepared)(dummy_input)
+        # a different accumulation order may move a few values by one quantization step
+        self.assertLess(float((out - out_compiled).norm() / out.norm()), 1e-2)
+
+    def test_nnie_quantize_func(self):
+        x = torch.randn(4, 16, 28, 28)
+        x[0, 0, 0, :3] = torch.tensor([0., 1e-30, -1e-30])
+        x_orig = x.clone()
+        data_max = x.abs().max() * 0.7
+        z = (16 * torch.log2(data_max.double())).round() - 127
+        code = torch.round(16 * torch.log2(x.double().abs()) - z).clamp(max=127)
+        code = torch.where(x < 0, code.clamp(min=1), code.clamp(min=0))
+        expected = torch.copysign(2 ** ((code + z) / 16), x.double())
+        expected[(x >= -2 ** ((z - 15) / 16)) & (x < 2 ** ((z - 16) / 16))] = 0
+        out = NNIEQuantizeFunc.apply(x, data_max)
+        self.assertTrue(torch.equal(x, x_orig))
+        self.assertEqual(out.dtype, torch.float32)
+        # float32 log2 may only round the other way on a tie
+        mismatch = ~torch.isclose(out.double(), expected, rtol=1e-6, atol=0)
+        self.assertLess(mismatch.float().mean().item(), 1e-3)
+        self.assertTrue(torch.allclose(out.double(), expected, rtol=2 ** (1 / 16) - 1 + 1e-6, atol=0))
+
+    def test_qdrop_mask(self):
+        fake_quant = QDropFakeQuantize(MinMaxObserver, quant_min=0, quant_max=15)
+        x = torch.rand(4, 16, 28, 28, requires_grad=True)
+        fake_quant(x)
+        fake_quant.disable_observer()
+        fake_quant.prob = 0.3
+        torch.manual_seed(0)
+        out = fake_quant(x)
+        torch.manual_seed(0)
+        self.assertTrue(torch.equal(out, fake_quant(x)))
+        fake_quant.prob = 1.0
+        out_quant = fake_quant(x)
+        kept = torch.isclose(out, out_quant) & ~torch.isclose(x, out_quant)
+        dropped = torch.isclose(out, x) & ~torch.isclose(x, out_quant)
+        self.assertTrue(torch.all(kept | dropped | torch.isclose(x, out_quant)))
+        self.assertAlmostEqual(kept.sum().item() / (kept | dropped).sum().item(), 0.3, delta=0.02)
+        out.sum().backward()
+        self.assertTrue(torch.all(x.grad[dropped] == 1))
+
+    def test_select_bitwidth(self):
+        weight = torch.randn(32, 16, 3, 3)
+        for fake_quant_cls, kwargs in [
+                (FixedFakeQuantize, dict(quant_min=0, quant_max=255)),
+                (LearnableFakeQuantize, dict(quant_min=-128, quant_max=127, dtype=torch.qint8,
+                                             qscheme=torch.per_channel_symmetric, ch_axis=0))]:
+            fake_quant = fake_quant_cls(MinMaxObserver, **kwargs)
+            out = fake_quant(weight).detach()
+            fake_quant.disable_observer()
+            fake_quant.precompute_bitwidths([2, 4, 8], weight)
+            for bits in [2, 4, 8]:
+                fake_quant.select_bitwidth(bits)
+                if kwargs['quant_min'] < 0:
+                    kwargs.update(quant_min=-2 ** (bits - 1), quant_max=2 ** (bits - 1) - 1)
+                else:
+                    kwargs.update(quant_min=0, quant_max=2 ** bits - 1)
+                expected = fake_quant_cls(MinMaxObserver, **kwargs)
+                self.assertEqual(fake_quant.bitwidth, bits)
+                self.assertTrue(torch.equal(fake_quant(weight), expected(weight)))
+            fake_quant.restore_bitwidth()
+            self.assertEqual(fake_quant.bitwidth, 8)
+            self.assertTrue(torch.equal(fake_quant(weight), out))
+        # per-channel qparams of a learnable quantizer which has not seen data yet
+        fake_quant = LearnableFakeQuantize(MinMaxObserver, quant_min=-128, quant_max=127, dtype=torch.qint8,
+                                           qscheme=torch.per_channel_symmetric, ch_axis=0)
+        fake_quant.disable_observer()
+        fake_quant.precompute_bitwidths([4], weight)
+        fake_quant.select_bitwidth(4)
+        self.assertEqual(fake_quant.scale.shape, (32, ))
+        self.assertEqual(fake_quant.zero_point.shape, (32, ))
+        self.assertIsInstance(fake_quant.zero_point, torch.nn.Parameter)
+        fake_quant.restore_bitwidth()
+        self.assertEqual(fake_quant.scale.shape, (1, ))
+        self.assertEqual(fake_quant.zero_point.shape, (1, ))
+
+    def test_reduced_precision_fake_quantize(self):
+        for dtype in [torch.bfloat16, torch.float16]:
+            x = torch.randn(4, 16, 14, 14)
+            for fake_quant_cls, kwargs in [
+                    (FixedFakeQuantize, dict(quant_min=0, quant_max=255)),
+                    (LearnableFakeQuantize, dict(quant_min=0, quant_max=255)),
+                    (LearnableFakeQuantize, dict(quant_min=-128, quant_max=127, dtype=torch.qint8,
+                                                 qscheme=torch.per_channel_symmetric, ch_axis=1))]:
+                fake_quant = fake_quant_cls(MinMaxObserver, **kwargs)
+                fake_quant(x)
+                fake_quant.disable_observer()
+                reference = copy.deepcopy(fake_quant)
+                x_half, x_float = x.to(dtype).requires_grad_(), x.to(dtype).float().requires_grad_()
+                out, out_ref = fake_quant(x_half), reference(x_float)
+                grad = torch.randn_like(out)
+                out.backward(grad)
+                out_ref.backward(grad.float())
+                self.assertEqual(out.dtype, dtype)
+                self.assertEqual(x_half.grad.dtype, dtype)
+                self.assertTrue(torch.equal(out, out_ref.to(dtype)))
+                self.assertTrue(torch.equal(x_half.grad, x_float.grad.to(dtype)))
+                for param, param_ref in zip(fake_quant.parameters(), reference.parameters()):
+                    self.assertEqual(param.grad.dtype, torch.float32)
+                    self.assertTrue(torch.allclose(param.grad, param_ref.grad, rtol=1e-4, atol=1e-6))
+
+    def test_dsq_function(self):
+        x = torch.randn(4, 8, 7, 7) * 3
+        scale = torch.rand(8) * 0.5 + 0.05
+        zero_point = torch.randint(0, 4, (8, )).float()
+        grad_output = torch.randn_like(x)
+        for ref_fn, args, ch_axis in [
+                (dsq_function_per_tensor, (scale[:1], zero_point[:1], 0, 15), None),
+                (dsq_function_per_channel, (scale, zero_point, 0, 15, 1), 1)]:
+            x_ref, x_new = x.clone().requires_grad_(), x.clone().requires_grad_()
+            out_ref = ref_fn(x_ref, *args, 0.4)
+            out = FakeQuantizeDSQTraining.apply(x_new, *args[:4], ch_axis, 0.4)
+            out_ref.backward(grad_output)
+            out.backward(grad_output)
+            self.assertTrue(torch.equal(out_ref, out))
+            self.assertTrue(torch.allclose(x_ref.grad, x_new.grad, atol=1e-5))
+
+    def test_tqt_function_grad(self):
+        scale = torch.tensor([2 ** -5])
+        x = torch.randn(4096) * 4
+        # Halves on both ends of the range, they round in or out depending on sign and parity.
+        x[:6] = torch.tensor([-128.5, 127.5, -8.5, 7.5, 6.5, 8.5]) * scale
+        grad_output = torch.randn_like(x)
+        for quant_min, quant_max in [(-128, 127), (-8, 7), (-8, 8), (0, 255)]:
+            x_new = x.clone().requires_grad_()
+            FakeQuantizeTqtAffine.apply(x_new, scale, torch.zeros(1), quant_min, quant_max,
+                                        torch.tensor(2)).backward(grad_output)
+            x_scaled = x / scale
+            x_round = torch.where((x_scaled < 0) & (x_scaled - x_scaled.floor() == 0.5),
+                                  x_scaled.ceil(), x_scaled.round())
+            expected = grad_output * ((x_round >= quant_min) & (x_round <= quant_max))
+            self.assertTrue(torch.equal(x_new.grad, expected))
+
+    def test_group_wise_fake_quantize(self):
+        observer_params = QuantizeScheme(symmetry=True, bit=4, group_size=32).to_observer_params()
+        self.assertEqual(observer_params['qscheme'], torch.per_channel_symmetric)
+        weight = torch.randn(16, 128)
+        groups = weight.reshape(-1, 32)
+        scale = groups.abs().amax(1) / 7.5
+        expected = torch.fake_quantize_per_channel_affine(
+            groups, scale, torch.zeros(64, dtype=torch.int), 0, -8, 7).reshape(weight.shape)
+        fake_quant = FixedFakeQuantize(MinMaxObserver, **observer_params)
+        self.assertTrue(torch.equal(fake_quant(weight), expected))
+        self.assertEqual(fake_quant.scale.shape, (64, ))
+        self.assertTrue(torch.allclose(fake_quant.scale, scale))
+        with self.assertRaises(ValueError):
+            fake_quant(torch.randn(16, 48))
+        fake_quant = LearnableFakeQuantize(MinMaxObserver, **observer_params)
+        weight.requires_grad_()
+        fake_quant(weight).sum().backward()
+        self.assertEqual(weight.grad.shape, weight.shape)
+        self.assertEqual(fake_quant.scale.grad.shape, (64, ))
+        model = torch.nn.Sequential(torch.nn.qat.Linear(128, 16, qconfig=torch.quantization.QConfig(
+            weight=FixedFakeQuantize.with_args(observer=MinMaxObserver, **observer_params),
+            activation=torch.nn.Identity)))
+        model(torch.randn(2, 128))
+        qparams = collect_group_qparams(model)['0.weight']
+        self.assertEqual(qparams['group_size'], 32)
+        self.assertEqual(qparams['bit'], 4)
+        self.assertTrue(torch.allclose(torch.tensor(qparams['step']), model[0].weight_fake_quant.scale.reshape(16, 4)))
+        self.assertTrue(torch.allclose(torch.tensor(qparams['max']), torch.tensor(qparams['step']) * 7))
+        fake_quant = AdaRoundFakeQuantize(MinMaxObserver, **observer_params)
+        fake_quant(weight.detach())
+        fake_quant.init(weight.detach())
+        self.assertEqual(fake_quant.alpha.shape, groups.shape)
+        # adaround rounds ties up, fake_quantize_per_channel_affine to even
+        hard_value = fake_quant.get_hard_value(weight.detach())
+        self.assertTrue(torch.allclose(hard_value, expected, atol=float(scale.max()) + 1e-6))
+        for w_qscheme, a_qscheme, backend in [({'group_size': 32}, {}, BackendType.Tensorrt),
+                                              ({}, {'group_size': 32}, BackendType.Academic)]:
+            with self.assertRaises(ValueError):
+                get_qconfig_by_platform(backend, {'w_qscheme': w_qscheme, 'a_qscheme': a_qscheme})
\ No newline at end of file
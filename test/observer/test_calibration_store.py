@@ -0,0 +1,100 @@
+import copy
+import os
+import tempfile
+import unittest
+
+import torch
+
+from mqbench.calibration_store import CalibrationStatistics, record_calibration, solve_qparams
+from mqbench.prepare_by_platform import prepare_by_platform, BackendType
+from mqbench.utils.state import enable_calibration, enable_quantization, load_qparams
+
+from ..version import GITHUB_RES
+
+
+class TestCalibrationStore(unittest.TestCase):
+    def test_solve_qparams(self):
+        model_to_quantize = torch.hub.load(GITHUB_RES, 'resnet18', pretrained=False)
+        model_to_quantize.eval()
+        cali_data = [torch.randn(2, 3, 224, 224) for _ in range(2)]
+        path = os.path.join(tempfile.mkdtemp(), 'resnet18_stats.bin')
+        model_prepared = prepare_by_platform(copy.deepcopy(model_to_quantize), BackendType.Academic, {
+            'extra_qconfig_dict': {
+                'w_qscheme': {'bit': 8, 'symmetry': False, 'per_channel': False, 'pot_scale': False},
+                'a_qscheme': {'bit': 8, 'symmetry': False, 'per_channel': False, 'pot_scale': False},
+            }})
+        record_calibration(model_prepared, cali_data, path)
+        for observer in ['MinMaxObserver', 'EMAMinMaxObserver', 'ClipStdObserver', 'HistogramMSEObserver']:
+            extra_qconfig_dict = {
+                'w_observer': 'MinMaxObserver',
+                'a_observer': observer,
+                'w_qscheme': {'bit': 4, 'symmetry': True, 'per_channel': True, 'pot_scale': False},
+                'a_qscheme': {'bit': 6, 'symmetry': False, 'per_channel': False, 'pot_scale': False},
+            }
+            qparams = solve_qparams(path, extra_qconfig_dict)
+            model_calibrated = prepare_by_platform(copy.deepcopy(model_to_quantize), BackendType.Academic,
+                                                   {'extra_qconfig_dict': extra_qconfig_dict})
+            enable_calibration(model_calibrated)
+            for data in cali_data:
+                model_calibrated(data)
+            model_solved = prepare_by_platform(copy.deepcopy(model_to_quantize), BackendType.Academic,
+                                               {'extra_qconfig_dict': extra_qconfig_dict})
+            load_qparams(model_solved, qparams)
+            for (name, module), solved in zip(model_calibrated.named_modules(), model_solved.modules()):
+                if isinstance(module, torch.quantization.FakeQuantizeBase):
+                    self.assertTrue(torch.allclose(module.scale, solved.scale, rtol=1e-4), name)
+                    self.assertTrue(torch.equal(module.zero_point, solved.zero_point), name)
+            enable_quantization(model_solved)
+            model_solved(cali_data[0])
+
+    def test_weight_statistics(self):
+        model_to_quantize = torch.nn.Sequential(torch.nn.Conv2d(3, 8, 3), torch.nn.ReLU(),
+                                                torch.nn.Conv2d(8, 4, 3))
+        cali_data = [torch.randn(2, 3, 16, 16) for _ in range(2)]
+        path = os.path.join(tempfile.mkdtemp(), 'stats.bin')
+        model_prepared = prepare_by_platform(copy.deepcopy(model_to_quantize), BackendType.Academic)
+        record_calibration(model_prepared, cali_data, path)
+        for name, entry in CalibrationStatistics(path).quantizers.items():
+            self.assertNotIn('weight', entry['fields'], name)
+        for observer in ['MinMaxObserver', 'ClipStdObserver', 'LSQObserver']:
+            for per_channel in [True, False]:
+                extra_qconfig_dict = {
+                    'w_observer': observer,
+                    'a_observer': 'MinMaxObserver',
+                    'w_qscheme': {'bit': 4, 'symmetry': False, 'per_channel': per_channel, 'pot_scale': False},
+                    'a_qscheme': {'bit': 8, 'symmetry': False, 'per_channel': False, 'pot_scale': False},
+                }
+                qparams = solve_qparams(path, extra_qconfig_dict)
+                model_calibrated = prepare_by_platform(copy.deepcopy(model_to_quantize), BackendType.Academic,
+                                                       {'extra_qconfig_dict': extra_qconfig_dict})
+                enable_calibration(model_calibrated)
+                for data in cali_data:
+                    model_calibrated(data)
+                for name, module in model_calibrated.named_modules():
+                    if name.endswith('weight_fake_quant'):
+                        scale, zero_point = qparams[name]
+                        self.assertTrue(torch.allclose(module.scale, scale, rtol=1e-4), name)
+                        self.assertTrue(torch.equal(module.zero_point, zero_point.to(module.zero_point.dtype)), name)
+        extra_qconfig_dict['w_observer'] = 'MSEObserver'
+        with self.assertRaisesRegex(ValueError, 'MSEObserver'):
+            solve_qparams(path, extra_qconfig_dict)
+        # the weights are saved when the observer to be solved needs them
+        record_calibration(model_prepared, cali_data, path, extra_qconfig_dict=extra_qconfig_dict)
+        self.assertEqual(len(solve_qparams(path, extra_qconfig_dict)), len(CalibrationStatistics(path).quantizers))
+
+
+    def test_record_unsupported_qconfig(self):
+        path = os.path.join(tempfile.mkdtemp(), 'stats.bin')
+        extra_qconfig_dict = {
+            'w_observer': 'MinMaxObserver',
+            'a_observer': 'EMAMinMaxObserver',
+            'w_qscheme': {'bit': 8, 'symmetry': True, 'per_channel': True, 'pot_scale': False},
+            'a_qscheme': {'bit': 8, 'symmetry': True, 'per_channel': True, 'pot_scale': False},
+        }
+        with self.assertRaisesRegex(ValueError, 'EMAMinMaxObserver'):
+            record_calibration(torch.nn.Sequential(), [torch.randn(2, 3)], path, extra_qconfig_dict=extra_qconfig_dict)
+        self.assertFalse(os.path.exists(path))
+        extra_qconfig_dict['a_qscheme']['per_channel'] = False
+        extra_qconfig_dict['a_observer'] = 'MultiObserver'
+        with self.assertRaisesRegex(ValueError, 'MultiObserver'):
+            record_calibration(torch.nn.Sequential(), [torch.randn(2, 3)], path, extra_qconfig_dict=extra_qconfig_dict)
\ No newline at end of file
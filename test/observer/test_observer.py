@@ -97,4 +97,185 @@ class TestObserver(unittest.TestCase):
         model_prepared(dummy_input)
         enable_quantization(model_prepared)
         loss = model_prepared(dummy_input).sum()
-        loss.backward()
\ No newline at end of file
+        loss.backward()
+
+    def test_mse_observer_batch_search(self):
+        from mqbench.observer import MSEObserver, EMAMSEObserver
+        x = torch.randn(4, 8, 14, 14)
+        for observer in [MSEObserver, EMAMSEObserver]:
+            for kwargs in [dict(quant_min=0, quant_max=255, qscheme=torch.per_tensor_affine),
+                           dict(quant_min=-128, quant_max=127, qscheme=torch.per_channel_symmetric, ch_axis=1)]:
+                loop_observer = observer(batch_search=False, **kwargs)
+                batch_observer = observer(batch_search=True, chunk_numel=1000, **kwargs)
+                for data in [x, x * 1.5]:
+                    loop_observer(data)
+                    batch_observer(data)
+                self.assertTrue(torch.equal(loop_observer.min_val, batch_observer.min_val))
+                self.assertTrue(torch.equal(loop_observer.max_val, batch_observer.max_val))
+
+    def test_quantile_observer_per_channel(self):
+        from mqbench.observer import EMAQuantileObserver
+        x = torch.randn(4, 3, 16, 16) ** 3
+        per_channel_observer = EMAQuantileObserver(ch_axis=1, threshold=0.999)
+        per_channel_observer(x)
+        for c in range(x.shape[1]):
+            per_tensor_observer = EMAQuantileObserver(threshold=0.999)
+            per_tensor_observer(x[:, c])
+            self.assertTrue(torch.allclose(per_channel_observer.min_val[c], per_tensor_observer.min_val))
+            self.assertTrue(torch.allclose(per_channel_observer.max_val[c], per_tensor_observer.max_val))
+
+    def test_channel_stats(self):
+        from mqbench.observer import _channel_aminmax, _channel_reduce_dims
+        from mqbench.utils.moments import Moments
+        x = torch.randn(4, 6, 5, 5)
+        for data, ch_axis in [(x, 1), (x.to(memory_format=torch.channels_last), 1), (x, 0), (x, 3)]:
+            y = data.transpose(0, ch_axis).flatten(1)
+            min_val, max_val = _channel_aminmax(data, ch_axis)
+            self.assertTrue(torch.equal(min_val, y.min(1)[0]))
+            self.assertTrue(torch.equal(max_val, y.max(1)[0]))
+            moments = Moments.from_tensor(data, _channel_reduce_dims(data, ch_axis), min_val, max_val)
+            self.assertTrue(torch.allclose(moments.mean, y.mean(1), atol=1e-6))
+            self.assertTrue(torch.allclose(moments.m2 / moments.count, y.var(1, unbiased=False), atol=1e-5))
+
+    def test_histogram_observer(self):
+        for a_observer in ['HistogramMSEObserver', 'HistogramKLObserver', 'HistogramPercentileObserver']:
+            model_to_quantize = torch.hub.load(GITHUB_RES, 'resnet18', pretrained=False)
+            dummy_input = torch.randn(2, 3, 224, 224, device='cpu')
+            model_to_quantize.train()
+            extra_qconfig_dict = {
+                'w_observer': 'MinMaxObserver',
+                'a_observer': a_observer,
+                'w_fakequantize': 'FixedFakeQuantize',
+                'a_fakequantize': 'FixedFakeQuantize',
+            }
+            prepare_custom_config_dict = {'extra_qconfig_dict': extra_qconfig_dict}
+            model_prepared = prepare_by_platform(model_to_quantize, BackendType.Tensorrt, prepare_custom_config_dict)
+            enable_calibration(model_prepared)
+            model_prepared(dummy_input)
+            model_prepared(dummy_input * 2)
+            enable_quantization(model_prepared)
+            loss = model_prepared(dummy_input).sum()
+            loss.backward()
+
+    def test_histogram_observer_merge(self):
+        from mqbench.observer import HistogramMSEObserver
+        data = [torch.randn(1000) * (i + 1) + i for i in range(4)]
+        streaming_observer = HistogramMSEObserver(bins=256)
+        for x in data:
+            streaming_observer(x)
+        full_observer = HistogramMSEObserver(bins=256)
+        full_observer(torch.cat(data))
+        hist = full_observer._coarsen(full_observer.histogram, int(full_observer.hist_start), int(full_observer.hist_exp),
+                                      int(streaming_observer.hist_start), int(streaming_observer.hist_exp))
+        self.assertTrue(torch.equal(hist, streaming_observer.histogram))
+
+    def test_histogram_kl_empty_tail_bin(self):
+        from mqbench.observer import HistogramKLObserver
+        observer = HistogramKLObserver(bins=16)
+
+        def smooth(dist):
+            empty = dist == 0
+            dist = dist + observer.smooth_eps * empty
+            dist[~empty] -= observer.smooth_eps * empty.sum() / (~empty).sum()
+            return dist
+
+        # bin 5 is empty, clipping there puts the 6 outliers in it. Clipping after bin 3 with 4 levels
+        # puts the outliers in bin 2, whose level has no other mass.
+        for hist, levels in [(torch.tensor([40., 30., 20., 10., 8., 0., 4., 2.]), 2),
+                             (torch.tensor([40., 30., 0., 10., 8., 0., 4., 2.]), 3)]:
+            ends = torch.arange(levels, 9)
+            kl = observer._kl_divergence(hist, ends, levels)
+            self.assertTrue(torch.isfinite(kl).all())
+            for end, value in zip(ends.tolist(), kl):
+                p = hist[:end].clone()
+                p[-1] += hist[end:].sum()
+                q = torch.zeros(end)
+                for level in range(levels):
+                    members = [i for i in range(end) if i * levels // end == level]
+                    nonzero = [i for i in members if p[i] > 0]
+                    for i in nonzero:
+                        q[i] = hist[members].sum() / len(nonzero)
+                p, q = smooth(p), smooth(q)
+                p, q = p / p.sum(), q / q.sum()
+                self.assertTrue(torch.allclose(value, (p * torch.log(p / q)).sum()))
+
+    def test_pot_mode_observer(self):
+        from mqbench.observer import PoTModeObserver
+        observer = PoTModeObserver(quant_min=-128, quant_max=127, qscheme=torch.per_tensor_symmetric, chunk_numel=100)
+        observer.set_quant_type('tensor')
+        for _ in range(3):
+            observer(torch.randn(4, 64))
+        scale, zero_point = observer.calculate_qparams()
+        self.assertFalse(hasattr(observer, '_x'))
+        self.assertEqual(sum(observer.counter), 3)
+        self.assertEqual(torch.log2(scale).round(), torch.log2(scale))
+
+    def test_pot_observer_without_quant_type(self):
+        from mqbench.observer import PoTModeObserver, MinMaxFloorObserver
+        for observer_cls in [PoTModeObserver, MinMaxFloorObserver]:
+            observer = observer_cls(quant_min=-128, quant_max=127, qscheme=torch.per_tensor_symmetric)
+            observer(torch.randn(4, 64))
+            with self.assertRaises(ValueError):
+                observer.calculate_qparams()
+
+    def test_moments_observer_merge(self):
+        from mqbench.observer import ClipStdObserver
+        x = torch.randn(8, 16, 7, 7) * 3 + 1
+        for ch_axis, qscheme in [(-1, torch.per_tensor_affine), (1, torch.per_channel_affine)]:
+            streaming_observer = ClipStdObserver(qscheme=qscheme, ch_axis=ch_axis)
+            for x_batch in x.split(3):
+                streaming_observer(x_batch)
+            full_observer = ClipStdObserver(qscheme=qscheme, ch_axis=ch_axis)
+            full_observer(x)
+            self.assertEqual(streaming_observer.count, full_observer.count)
+            self.assertTrue(torch.equal(streaming_observer.min_val, full_observer.min_val))
+            self.assertTrue(torch.allclose(streaming_observer.mean, full_observer.mean, atol=1e-6))
+            self.assertTrue(torch.allclose(streaming_observer.m2, full_observer.m2, rtol=1e-4))
+            reduce_dim = [0, 1, 2, 3] if ch_axis == -1 else [0, 2, 3]
+            self.assertTrue(torch.allclose(full_observer.moments().std(), x.std(reduce_dim), rtol=1e-4))
+
+    def test_multi_observer(self):
+        from mqbench.utils.state import select_observer
+        model_to_quantize = torch.hub.load(GITHUB_RES, 'resnet18', pretrained=False)
+        dummy_input = torch.randn(2, 3, 224, 224, device='cpu')
+        model_to_quantize.train()
+        observers = ['MinMaxObserver', 'EMAQuantileObserver', 'MSEObserver']
+        extra_qconfig_dict = {
+            'w_observer': 'MinMaxObserver',
+            'a_observer': 'MultiObserver',
+            'a_observer_extra_args': {'observers': observers},
+            'w_fakequantize': 'FixedFakeQuantize',
+            'a_fakequantize': 'FixedFakeQuantize',
+        }
+        prepare_custom_config_dict = {'extra_qconfig_dict': extra_qconfig_dict}
+        model_prepared = prepare_by_platform(model_to_quantize, BackendType.Tensorrt, prepare_custom_config_dict)
+        enable_calibration(model_prepared)
+        model_prepared(dummy_input)
+        model_prepared(dummy_input * 2)
+        select_observer(model_prepared, lambda name, qparams: min(qparams, key=lambda k: qparams[k][0].item()))
+        for name, module in model_prepared.named_modules():
+            if isinstance(module, torch.quantization.FakeQuantizeBase) and 'weight' not in name:
+                qparams = module.activation_post_process.calculate_all_qparams()
+                self.assertEqual(list(qparams), observers)
+                self.assertTrue(torch.equal(module.scale, min(scale for scale, _ in qparams.values())))
+        enable_quantization(model_prepared)
+        loss = model_prepared(dummy_input).sum()
+        loss.backward()
+
+    def test_reduced_precision_observer(self):
+        from mqbench import observer as observers
+        for dtype in [torch.bfloat16, torch.float16]:
+            x = torch.randn(4, 8, 14, 14).to(dtype)
+            for name in ['MinMaxObserver', 'EMAMinMaxObserver', 'EMAQuantileObserver', 'LSQObserver',
+                         'MSEObserver', 'EMAMSEObserver']:
+                for kwargs in [dict(), dict(qscheme=torch.per_channel_affine, ch_axis=1)]:
+                    observer, reference = getattr(observers, name)(**kwargs), getattr(observers, name)(**kwargs)
+                    for data in [x, x * 0.5]:
+                        observer(data)
+                        reference(data.float())
+                    self.assertEqual(observer.min_val.dtype, torch.float32)
+                    scale, zero_point = observer.calculate_qparams()
+                    scale_ref, zero_point_ref = reference.calculate_qparams()
+                    self.assertEqual(scale.dtype, torch.float32)
+                    self.assertTrue(torch.allclose(scale, scale_ref, rtol=1e-5))
+                    self.assertTrue(torch.equal(zero_point, zero_point_ref))
\ No newline at end of file
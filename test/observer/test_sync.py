@@ -0,0 +1,105 @@
+import os
+import socket
+import unittest
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from mqbench.observer import MinMaxObserver, ClipStdObserver, HistogramMSEObserver, PoTModeObserver, \
+    MinMaxFloorObserver, LSQObserver
+from mqbench.utils import utils
+
+WORLD_SIZE = 2
+
+
+def _build_observers():
+    pot_observer = PoTModeObserver(quant_min=-128, quant_max=127, qscheme=torch.per_tensor_symmetric)
+    pot_observer.set_quant_type('tensor')
+    return torch.nn.ModuleList([
+        MinMaxObserver(),
+        MinMaxObserver(qscheme=torch.per_channel_affine, ch_axis=1),
+        ClipStdObserver(),
+        ClipStdObserver(qscheme=torch.per_channel_affine, ch_axis=1),
+        HistogramMSEObserver(bins=256),
+        pot_observer,
+    ])
+
+
+def _sync_worker(rank, port):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group('gloo', rank=rank, world_size=WORLD_SIZE)
+    utils.USE_DDP = True
+    torch.manual_seed(0)
+    data = [torch.randn(4, 8, 6) * (i + 1) + i for i in range(2 * WORLD_SIZE)]
+    local_observers, full_observers = _build_observers(), _build_observers()
+    for i, x in enumerate(data):
+        if i % WORLD_SIZE == rank:
+            for observer in local_observers:
+                observer(x)
+    with utils.no_sync_tensor():
+        for x in data:
+            for observer in full_observers:
+                observer(x)
+    utils.sync_observers(local_observers)
+    for local, full in zip(local_observers[:5], full_observers[:5]):
+        assert torch.equal(local.min_val, full.min_val) and torch.equal(local.max_val, full.max_val)
+    for local, full in zip(local_observers[2:4], full_observers[2:4]):
+        assert torch.equal(local.count, full.count)
+        assert torch.allclose(local.mean, full.mean, atol=1e-5)
+        assert torch.allclose(local.m2, full.m2, rtol=1e-4)
+    local, full = local_observers[4], full_observers[4]
+    hist = full._coarsen(full.histogram, int(full.hist_start), int(full.hist_exp),
+                         int(local.hist_start), int(local.hist_exp))
+    assert torch.equal(hist, local.histogram)
+    assert local_observers[5].counter == full_observers[5].counter
+    # gloo can hang in destroy_process_group once the other rank exited, wait for it instead
+    dist.barrier()
+
+
+def _empty_rank_sync_worker(rank, port):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group('gloo', rank=rank, world_size=WORLD_SIZE)
+    utils.USE_DDP = True
+    torch.manual_seed(0)
+    x = torch.randn(4, 8, 6)
+    # only rank 0 sees data, none of the ranks observed the second observer
+    observers = torch.nn.ModuleList([MinMaxFloorObserver(quant_min=-128, quant_max=127,
+                                                         qscheme=torch.per_tensor_symmetric) for _ in range(2)])
+    full = MinMaxFloorObserver(quant_min=-128, quant_max=127, qscheme=torch.per_tensor_symmetric)
+    for observer in [*observers, full]:
+        observer.set_quant_type('tensor')
+    if rank == 0:
+        observers[0](x)
+    with utils.no_sync_tensor():
+        full(x)
+    utils.sync_observers(observers)
+    assert observers[0].pot_exp == full.pot_exp
+    assert torch.equal(observers[0].calculate_qparams()[0], full.calculate_qparams()[0])
+    assert observers[1].pot_exp is None
+    scale, zero_point = observers[1].calculate_qparams()
+    assert scale.numel() == 1 and zero_point.numel() == 1
+    lsq_observers = torch.nn.ModuleList([LSQObserver(), LSQObserver()])
+    if rank == 0:
+        lsq_observers[0](x)
+    utils.sync_observers(lsq_observers)
+    assert torch.equal(lsq_observers[0].tensor_norm, x.abs().mean())
+    assert lsq_observers[1].norm_count == 0
+    dist.barrier()
+
+
+class TestObserverSync(unittest.TestCase):
+    def test_sync_observers(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        mp.spawn(_sync_worker, args=(port, ), nprocs=WORLD_SIZE)
+
+
+    def test_sync_observers_without_data(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        mp.spawn(_empty_rank_sync_worker, args=(port, ), nprocs=WORLD_SIZE)
\ No newline at end of file
@@ -0,0 +1 @@
+from ..version import GITHUB_RES
\ No newline at end of file
@@ -0,0 +1,158 @@
+import unittest
+
+import numpy as np
+import torch
+from torch import fx, nn
+
+from mqbench.advanced_ptq import ReconstructionBatches, SequentialActivationCache, save_inp_oup_data, to_device
+from mqbench.utils.compression import CompressedTensor, compress, decompress
+from mqbench.utils.disk_cache import DiskTensorList, MemoryBudget
+
+
+class _BasicBlock(nn.Module):
+    def __init__(self, channels):
+        super().__init__()
+        self.conv1 = nn.Conv2d(channels, channels, 3, padding=1)
+        self.relu1 = nn.ReLU(inplace=True)
+        self.conv2 = nn.Conv2d(channels, channels, 3, padding=1)
+        # save_inp_oup_data hooks modules, so each one is called once
+        self.relu2 = nn.ReLU(inplace=True)
+
+    def forward(self, x):
+        out = self.conv2(self.relu1(self.conv1(x)))
+        out += x
+        return self.relu2(out)
+
+
+class _ResNet(nn.Module):
+    def __init__(self, num_blocks, channels=8):
+        super().__init__()
+        self.stem = nn.Conv2d(3, channels, 3, padding=1)
+        self.blocks = nn.Sequential(*[_BasicBlock(channels) for _ in range(num_blocks)])
+        self.fc = nn.Linear(channels, 10)
+
+    def forward(self, x):
+        return self.fc(self.blocks(self.stem(x)).mean((2, 3)))
+
+
+def _block_nodes(model):
+    # (input node, output node) of every residual block, as ptq_reconstruction gets them
+    nodes = {node.target: node for node in model.graph.nodes if node.op == 'call_module'}
+    return [(nodes['blocks.{}.conv1'.format(name)].args[0], nodes['blocks.{}.relu2'.format(name)])
+            for name, _ in model.blocks.named_children()]
+
+
+class TestAdvancedPTQ(unittest.TestCase):
+    def assertBatchesEqual(self, expected, values):
+        self.assertEqual(len(expected), len(values))
+        self.assertTrue(all([torch.equal(x, y) for x, y in zip(expected, values)]))
+
+    def test_sequential_activation_cache(self):
+        cali_data = [torch.randn(2, 3, 8, 8) for _ in range(3)]
+        fp32_model = fx.symbolic_trace(_ResNet(3)).eval()
+        quant_model = fx.symbolic_trace(_ResNet(3)).eval()
+        fp32_modules, quant_modules = dict(fp32_model.named_modules()), dict(quant_model.named_modules())
+        fp32_nodes = {node.name: node for node in fp32_model.graph.nodes}
+        fp32_cache = SequentialActivationCache(fp32_model, cali_data)
+        quant_cache = SequentialActivationCache(quant_model, cali_data)
+        for input_node, output_node in _block_nodes(quant_model):
+            fp32_input, fp32_output = fp32_cache.get([fp32_nodes[input_node.name], fp32_nodes[output_node.name]])
+            quant_input, = quant_cache.get([input_node])
+            self.assertBatchesEqual(save_inp_oup_data(fp32_model, None, fp32_modules[input_node.target], cali_data,
+                                                      store_inp=False)[1], fp32_input)
+            self.assertBatchesEqual(save_inp_oup_data(fp32_model, None, fp32_modules[output_node.target], cali_data,
+                                                      store_inp=False)[1], fp32_output)
+            self.assertBatchesEqual(save_inp_oup_data(quant_model, None, quant_modules[input_node.target],
+                                                      cali_data, store_inp=False)[1], quant_input)
+            quant_cache.evict([output_node])
+
+    def test_disk_tensor_list(self):
+        tensors = [torch.randn(2, 3), torch.randn(4).to(torch.bfloat16), torch.randint(0, 9, (3, 1)),
+                   torch.zeros(0, 5), torch.randn(5, 6).t()]
+        values = DiskTensorList()
+        for tensor in tensors:
+            values.append(tensor)
+        for tensor, value in zip(tensors, values):
+            self.assertEqual(value.dtype, tensor.dtype)
+        self.assertBatchesEqual(tensors, values)
+        budget = MemoryBudget(100)
+        values = budget.new_list()
+        for tensor in tensors:
+            values.append(tensor)
+        # the last tensor does not fit any more
+        self.assertEqual(budget.used, 24 + 8 + 24 + 0)
+        self.assertEqual(len(values.disk), 1)
+        self.assertBatchesEqual(tensors, values)
+        del values
+        self.assertEqual(budget.used, 0)
+
+    def test_disk_activation_cache(self):
+        cali_data = [torch.randn(2, 3, 8, 8) for _ in range(4)]
+        model = fx.symbolic_trace(_ResNet(2)).eval()
+        budget = MemoryBudget(2 ** 12)
+        cache = SequentialActivationCache(model, cali_data, keep_gpu=False, budget=budget)
+        in_memory = SequentialActivationCache(model, cali_data, keep_gpu=False)
+        for input_node, output_node in _block_nodes(model):
+            values = cache.get([input_node, output_node])
+            self.assertTrue(all([len(batches.disk) > 0 for batches in values]))
+            self.assertLessEqual(budget.used, budget.max_bytes)
+            for expected, batches in zip(in_memory.get([input_node, output_node]), values):
+                self.assertBatchesEqual(expected, batches)
+        del cache, values
+        self.assertEqual(budget.used, 0)
+
+    def test_reconstruction_batches(self):
+        cached_inps = [[torch.randn(2, 4) for _ in range(5)] for _ in range(2)]
+        cached_oups = [torch.randn(2, 4) for _ in range(5)]
+        np.random.seed(0)
+        expected = []
+        for _ in range(10):
+            idx = np.random.randint(0, len(cached_oups))
+            expected.append([to_device(inps[idx], 'cpu') for inps in cached_inps] + [cached_oups[idx]])
+        np.random.seed(0)
+        for expected_step, step in zip(expected, ReconstructionBatches(cached_inps, cached_oups, 1.0, 'cpu', 10)):
+            self.assertBatchesEqual(expected_step, step)
+        steps = list(ReconstructionBatches((cached_inps, cached_inps), cached_oups, 0.5, 'cpu', 3, batches_per_step=3))
+        self.assertEqual(len(steps), 3)
+        self.assertTrue(all([len(step) == 5 and step[-1].shape[0] == 6 for step in steps]))
+
+    def test_reconstruction_batches_determinism(self):
+        # Stop early like adaptive_budget does, np.random has to end in the same state in every run.
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        cached_inps = [torch.randn(4, 8) for _ in range(6)]
+        cached_oups = [torch.randn(4, 8) for _ in range(6)]
+        runs = []
+        for _ in range(3):
+            np.random.seed(0)
+            steps = iter(ReconstructionBatches([cached_inps], cached_oups, 1.0, device, 20, batches_per_step=2))
+            taken = [[x.cpu() for x in next(steps)] for _ in range(3)]
+            steps.close()
+            runs.append((taken, np.random.rand()))
+        for taken, state in runs[1:]:
+            self.assertEqual(state, runs[0][1])
+            for step, first in zip(taken, runs[0][0]):
+                self.assertBatchesEqual(first, step)
+
+    def test_compressed_activation_cache(self):
+        cali_data = [torch.randn(2, 3, 8, 8) for _ in range(3)]
+        model = fx.symbolic_trace(_ResNet(2)).eval()
+        blocks = _block_nodes(model)
+        reference = SequentialActivationCache(model, cali_data)
+        expected = [reference.get(list(block)) for block in blocks]
+        for cache_dtype, rtol in [('float16', 1e-2), ('bfloat16', 1e-1), ('int8', 1e-1)]:
+            x = torch.randn(2, 8, 8, 8)
+            self.assertLess(float((decompress(compress(x, cache_dtype)) - x).norm() / x.norm()), rtol)
+            cache = SequentialActivationCache(model, cali_data, keep_gpu=False, cache_dtype=cache_dtype)
+            values = [cache.get(list(block)) for block in blocks]
+            for old, new in zip(expected, values):
+                for old_batches, new_batches in zip(old, new):
+                    self.assertTrue(all([isinstance(y, CompressedTensor) for y in new_batches]))
+                    self.assertTrue(all([float((decompress(y) - x).norm() / x.norm()) < rtol
+                                         for x, y in zip(old_batches, new_batches)]))
+            # compressed batches go through the disk and into steps of several batches
+            on_disk = DiskTensorList()
+            for y in values[0][0]:
+                on_disk.append(y)
+            step = next(iter(ReconstructionBatches([values[0][0]], on_disk, 1.0, 'cpu', 1, batches_per_step=2)))
+            self.assertEqual(step[0].shape, (4, 8, 8, 8))
+            self.assertEqual(step[0].dtype, torch.float32)